@@ -0,0 +1,196 @@
+import os
+import glob
+import random
+import hashlib
+import threading
+import time
+import pandas as pd
+from pyarrow import feather
+from sqlalchemy import inspect, text
+
+# Directory holding the Feather snapshots shared by every worker
+CACHE_DIR = os.getenv('DATA_CACHE_DIR', './cache')
+# Seconds between two checks of the database freshness token
+REFRESH_INTERVAL = int(os.getenv('DATA_REFRESH_INTERVAL', 300))
+# Seconds a superseded snapshot is kept, so that workers still serving the previous token can map it
+SNAPSHOT_GRACE = int(os.getenv('DATA_SNAPSHOT_GRACE', max(2 * REFRESH_INTERVAL, 60)))
+
+# The import scripts record every load in this table, its latest entry tells whether the data changed
+WATERMARK_TABLE = 'import_watermarks'
+FRESHNESS_QUERY = f"SELECT MAX(imported_at) AS imported_at, COUNT(*) AS sources FROM {WATERMARK_TABLE}"
+
+
+def partition(frame, column):
+    # Dict-of-slices index: one pre-filtered frame per value of `column`
+    return {key: group.reset_index(drop=True) for key, group in frame.groupby(column, sort=False)}
+
+
+class DataStore:
+    # Lazily loaded dataframes, persisted as Feather snapshots keyed by the database freshness token.
+    # `queries` maps a frame name to its SQL query and an optional function applied once after loading.
+    # `views` maps a derived value name to the frame it is built from and its builder; views are
+    # computed alongside their frame and replaced together with it on refresh.
+    def __init__(self, engine, queries, views=None, cache_dir=CACHE_DIR, refresh_interval=REFRESH_INTERVAL,
+                 snapshot_grace=SNAPSHOT_GRACE):
+        self.engine = engine
+        self.queries = queries
+        self.views = views or {}
+        self.cache_dir = cache_dir
+        self.refresh_interval = refresh_interval
+        self.snapshot_grace = snapshot_grace
+        self._frames = {}
+        self._token = None
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._refresher_pid = None
+        self._refresher_lock = threading.Lock()
+        self._listeners = []
+        # Outcome of the latest freshness checks, reported by health()
+        self.last_check = None
+        self.last_refresh = None
+        self.last_error = None
+
+    def token(self):
+        # Cheap version marker: latest import watermark, or a constant when imports are not tracked.
+        # Any other failure (database unreachable...) is raised: the refresher keeps the served token
+        # and reports the error instead of taking it for a new version.
+        with self.engine.connect() as conn:
+            if not inspect(conn).has_table(WATERMARK_TABLE):
+                return 'untracked'
+            row = conn.execute(text(FRESHNESS_QUERY)).first()
+        return f"{row[0]}|{row[1]}"
+
+    def _snapshot_path(self, name, token):
+        digest = hashlib.sha1(token.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.cache_dir, f"{name}-{digest}.feather")
+
+    def _load(self, name, token):
+        # Memory-map the snapshot for this token if a worker already wrote it, query the database otherwise
+        path = self._snapshot_path(name, token)
+        try:
+            return feather.read_table(path, memory_map=True).to_pandas()
+        except FileNotFoundError:
+            pass
+        query, postprocess = self.queries[name]
+        frame = pd.read_sql(query, self.engine)
+        if postprocess is not None:
+            frame = postprocess(frame)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write then rename so that other workers never read a partial snapshot
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        frame.reset_index(drop=True).to_feather(tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path)
+        frame = feather.read_table(path, memory_map=True).to_pandas()
+        self._prune(name, path)
+        return frame
+
+    def _prune(self, name, current):
+        # Remove the snapshots of `name` superseded by a newer one more than `snapshot_grace` seconds ago.
+        # Workers poll at different times, so the previous snapshot stays until all of them moved on.
+        snapshots = []
+        for path in glob.glob(os.path.join(self.cache_dir, f"{name}-*.feather")):
+            try:
+                snapshots.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        snapshots.sort()
+        now = time.time()
+        for (_, path), (superseded_at, _) in zip(snapshots, snapshots[1:]):
+            if path != current and now - superseded_at > self.snapshot_grace:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    @property
+    def version(self):
+        return self._token
+
+    def _build(self, name, frames, token):
+        # Load a frame or compute a view into `frames`, loading the frame a view depends on first
+        if name in frames:
+            return
+        if name in self.views:
+            source, builder = self.views[name]
+            self._build(source, frames, token)
+            frames[name] = builder(frames[source])
+        else:
+            frames[name] = self._load(name, token)
+
+    def get(self, name):
+        frames = self._frames
+        if name not in frames:
+            with self._lock:
+                if self._token is None:
+                    self._token = self.token()
+                if name not in self._frames:
+                    frames = dict(self._frames)
+                    self._build(name, frames, self._token)
+                    self._frames = frames
+                frames = self._frames
+                self.start_refresher()
+        return frames[name]
+
+    def on_refresh(self, listener):
+        # Called with the new token after each refresh, once the new frames are in place, to rebuild what
+        # depends on them (figure caches...) before requests ask for it
+        self._listeners.append(listener)
+        return listener
+
+    def refresh(self):
+        # Reload every frame and view already in use when the token changed, then swap them in at once
+        start = time.perf_counter()
+        token = self.token()
+        self.last_check = time.strftime('%Y-%m-%d %H:%M:%S')
+        if token == self._token:
+            if token is not None:
+                for name in list(self._frames):
+                    if name not in self.views:
+                        self._prune(name, self._snapshot_path(name, token))
+            return False
+        frames = {}
+        for name in list(self._frames):
+            self._build(name, frames, token)
+        with self._lock:
+            self._frames = frames
+            self._token = token
+        frames_seconds = time.perf_counter() - start
+        for listener in self._listeners:
+            try:
+                listener(token)
+            except Exception as e:
+                self.last_error = {'at': time.strftime('%Y-%m-%d %H:%M:%S'), 'error': f"{listener.__name__}: {e}"}
+                print(f"Refresh listener {listener.__name__} failed: {e}")
+        self.last_refresh = {'version': token, 'finished_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                             'frames': sorted(frames), 'frames_seconds': round(frames_seconds, 3),
+                             'seconds': round(time.perf_counter() - start, 3)}
+        return True
+
+    def _poll(self):
+        while True:
+            # Workers drift apart so that the first one to see a new token writes the snapshots the others map
+            time.sleep(self.refresh_interval * random.uniform(0.9, 1.1))
+            try:
+                self.refresh()
+            except Exception as e:
+                self.last_error = {'at': time.strftime('%Y-%m-%d %H:%M:%S'), 'error': str(e)}
+                print(f"Data refresh failed: {e}")
+
+    def health(self):
+        # Served data version, state of the refresher and its latest check, refresh and failure
+        return {'version': self._token, 'frames': sorted(self._frames),
+                'refresher': (self._refresher is not None and self._refresher_pid == os.getpid()
+                              and self._refresher.is_alive()),
+                'refresh_interval': self.refresh_interval, 'last_check': self.last_check,
+                'last_refresh': self.last_refresh, 'last_error': self.last_error}
+
+    def start_refresher(self):
+        # One refresher per process: a thread started before a pre-fork server forks its workers only runs in the
+        # master, so a worker starts its own the first time it is called
+        if self.refresh_interval <= 0 or self._refresher_pid == os.getpid():
+            return
+        with self._refresher_lock:
+            if self._refresher_pid != os.getpid():
+                self._refresher = threading.Thread(target=self._poll, name='data-refresher', daemon=True)
+                self._refresher.start()
+                self._refresher_pid = os.getpid()
@@ -0,0 +1,89 @@
+import os
+import json
+import functools
+import threading
+from collections import OrderedDict
+
+# Maximum number of figures kept per worker
+FIGURE_CACHE_SIZE = int(os.getenv('FIGURE_CACHE_SIZE', 512))
+# Build every figure of the dropdowns in the background once the data is loaded
+FIGURE_CACHE_WARM = os.getenv('FIGURE_CACHE_WARM', '0') == '1'
+
+
+class FigureCache:
+    # Bounded LRU cache of figures as plain JSON dicts, keyed by callback, data version and selection
+    def __init__(self, version, maxsize=FIGURE_CACHE_SIZE):
+        self.version = version
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._warmed = None
+        self._funcs = {}
+
+    def get(self, key):
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+            return payload
+
+    def put(self, key, payload):
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def memoize(self, func):
+        # Cache the figure returned by a callback as the plain dict Dash serializes: it is converted once, on a
+        # miss, and hits return it as is (callers must not modify it). Nothing is cached before the data is
+        # loaded, when there is no data version to invalidate the entry with.
+        @functools.wraps(func)
+        def wrapper(*args):
+            version = self.version()
+            if version is None:
+                return json.loads(func(*args).to_json())
+            key = (func.__name__, version, args)
+            figure = self.get(key)
+            if figure is None:
+                figure = json.loads(func(*args).to_json())
+                self.put(key, figure)
+            return figure
+        self._funcs[func.__name__] = wrapper
+        return wrapper
+
+    def rebuild(self):
+        # Recompute, for the current data version, the figures cached for older versions, and drop those.
+        # Called by the data refresher so that the figures being viewed are ready before they are asked for again.
+        version = self.version()
+        with self._lock:
+            stale = [key for key in self._entries if key[1] != version]
+            for key in stale:
+                del self._entries[key]
+        for name, _, args in stale:
+            try:
+                self._funcs[name](*args)
+            except Exception as e:
+                print(f"Figure rebuild failed for {name}{args!r}: {e}")
+        return len(stale)
+
+    def warm(self, jobs):
+        # Pre-compute figures in a background thread; `jobs` is a list of (memoized callback, values)
+        version = self.version()
+        if self._warmed == version:
+            return
+        self._warmed = version
+
+        def run():
+            for func, values in jobs:
+                for value in values:
+                    try:
+                        func(value)
+                    except Exception as e:
+                        print(f"Figure warm-up failed for {func.__name__}({value!r}): {e}")
+
+        threading.Thread(target=run, name='figure-warmup', daemon=True).start()
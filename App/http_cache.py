@@ -0,0 +1,202 @@
+import os
+import re
+import json
+import gzip
+import html
+import hashlib
+import threading
+from collections import OrderedDict
+import flask
+from data_access import CACHE_DIR
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from nbconvert import HTMLExporter
+except ImportError:
+    HTMLExporter = None
+
+# Responses smaller than this are sent uncompressed
+RESPONSE_COMPRESS_MIN_SIZE = int(os.getenv('RESPONSE_COMPRESS_MIN_SIZE', 1024))
+RESPONSE_GZIP_LEVEL = int(os.getenv('RESPONSE_GZIP_LEVEL', 6))
+RESPONSE_BROTLI_QUALITY = int(os.getenv('RESPONSE_BROTLI_QUALITY', 5))
+# Compressed bodies kept per worker, so that cached figures and assets are only compressed once
+RESPONSE_CACHE_BYTES = int(os.getenv('RESPONSE_CACHE_BYTES', 64 * 1024 * 1024))
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'image/svg+xml')
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+
+def compressible(mimetype):
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+def negotiate(accept_encodings):
+    # Best encoding accepted by the client: brotli when installed, then gzip
+    for encoding in ('br', 'gzip'):
+        if (encoding != 'br' or brotli is not None) and accept_encodings.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+
+
+class CompressedBodies:
+    # LRU of compressed bodies keyed by content hash and encoding, bounded in bytes
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest, encoding, body):
+        key = (digest, encoding)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+        data = compress(body, encoding)
+        if len(data) > self.max_bytes:
+            return data
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = data
+                self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+        return data
+
+
+compressed_bodies = CompressedBodies()
+
+
+def finalize_response(response):
+    # after_request hook: content-hash ETag and revalidation for GET responses, then compression.
+    # Callback responses (POST) are compressed only, browsers do not revalidate them.
+    request = flask.request
+    if response.status_code != 200 or 'Content-Encoding' in response.headers \
+            or not compressible(response.mimetype):
+        return response
+    response.direct_passthrough = False
+    body = response.get_data()
+    encoding = negotiate(request.accept_encodings) if len(body) >= RESPONSE_COMPRESS_MIN_SIZE else None
+    digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+    response.vary.add('Accept-Encoding')
+    if request.method in ('GET', 'HEAD'):
+        # Each encoding is a distinct representation and gets its own validator
+        response.set_etag(f"{digest}-{encoding}" if encoding else digest)
+        if 'Cache-Control' not in response.headers:
+            response.headers['Cache-Control'] = 'no-cache'
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+    if encoding:
+        response.set_data(compressed_bodies.get(digest, encoding, body))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def install(server):
+    server.after_request(finalize_response)
+
+
+def _text(value):
+    return ''.join(value) if isinstance(value, list) else value
+
+
+def _output_html(output):
+    if output['output_type'] == 'stream':
+        return f'<pre class="output">{html.escape(_text(output["text"]))}</pre>'
+    if output['output_type'] == 'error':
+        return f'<pre class="error">{html.escape(ANSI_ESCAPE.sub("", chr(10).join(output["traceback"])))}</pre>'
+    data = output.get('data', {})
+    if 'text/html' in data:
+        return f'<div class="output">{_text(data["text/html"])}</div>'
+    if 'image/svg+xml' in data:
+        return f'<div class="output">{_text(data["image/svg+xml"])}</div>'
+    for mimetype in ('image/png', 'image/jpeg'):
+        if mimetype in data:
+            return f'<img class="output" src="data:{mimetype};base64,{_text(data[mimetype]).strip()}">'
+    for mimetype in ('text/markdown', 'text/plain'):
+        if mimetype in data:
+            return f'<pre class="output">{html.escape(_text(data[mimetype]))}</pre>'
+    return ''
+
+
+def basic_html(notebook, title):
+    # Fallback without nbconvert: cell sources as preformatted text, followed by their outputs
+    parts = []
+    for cell in notebook['cells']:
+        source = html.escape(_text(cell['source']))
+        if cell['cell_type'] == 'code':
+            parts.append(f'<pre class="input"><code>{source}</code></pre>')
+            parts += [_output_html(output) for output in cell.get('outputs', [])]
+        else:
+            parts.append(f'<pre class="markdown">{source}</pre>')
+    return ('<!DOCTYPE html><html><head><meta charset="utf-8">'
+            f'<title>{html.escape(title)}</title><style>'
+            'body{font-family:Roboto,sans-serif;margin:1em 2em}pre{white-space:pre-wrap}'
+            '.input{background:#f5f5f5;padding:.5em;border-left:3px solid #1f77b4}'
+            '.error{color:#a00}img{max-width:100%}'
+            f'</style></head><body>{"".join(parts)}</body></html>')
+
+
+def render_notebook(path, cache_dir=CACHE_DIR):
+    # HTML page of a notebook, written to `cache_dir` under its content hash so that it is rendered once
+    # for all workers and restarts
+    with open(path, 'rb') as f:
+        source = f.read()
+    cached = os.path.join(cache_dir, f"notebook-{hashlib.sha1(source).hexdigest()[:12]}.html")
+    if os.path.exists(cached):
+        with open(cached, 'rb') as f:
+            return f.read()
+    title = os.path.splitext(os.path.basename(path))[0]
+    if HTMLExporter is not None:
+        page, _ = HTMLExporter().from_filename(path)
+    else:
+        page = basic_html(json.loads(source), title)
+    page = page.encode('utf-8')
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cached}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(page)
+    os.replace(tmp_path, cached)
+    return page
+
+
+class RenderedNotebook:
+    # Rendered page of a notebook, rendered again when the notebook file changes
+    def __init__(self, path, cache_dir=CACHE_DIR):
+        self.path = path
+        self.cache_dir = cache_dir
+        self._mtime = None
+        self._page = None
+        self._lock = threading.Lock()
+
+    def page(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        with self._lock:
+            if self._mtime != mtime:
+                self._page = render_notebook(self.path, self.cache_dir)
+                self._mtime = mtime
+            return self._page
+
+    def warm(self):
+        # Render in the background at startup, so that the first visitor does not wait for it
+        def run():
+            try:
+                self.page()
+            except (OSError, ValueError) as e:
+                print(f"Notebook rendering failed for {self.path}: {e}")
+
+        threading.Thread(target=run, name='notebook-render', daemon=True).start()
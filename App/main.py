@@ -1,12 +1,27 @@
 import pandas as pd
 import plotly.express as px
-from dash import Dash, html, dcc, callback, Output, Input
-import json
+import plotly.graph_objects as go
+from dash import Dash, html, dcc, callback, Output, Input, Patch, ctx, no_update
+import hashlib
 import flask
 from sqlalchemy import create_engine
 import os
+import sys
+import math
 from dotenv import load_dotenv
 import dash_bootstrap_components as dbc
+from data_access import DataStore, partition
+from figure_cache import FigureCache, FIGURE_CACHE_WARM
+import http_cache
+from prediction import get_predictor, reload_predictor
+
+# Modules shared with the import scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from spatial_index import SpatialIndex, summary  # noqa: E402
+from price_tiles import PriceTiles  # noqa: E402
+from quantile_sketches import yearly_quantiles  # noqa: E402
+import instrumentation  # noqa: E402
+from instrumentation import timed_callback  # noqa: E402
 
 # Load environment variables
 load_dotenv()
@@ -19,111 +34,359 @@ db_name = os.getenv('DB_NAME')
 
 engine = create_engine(f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}/{db_name}")
 
-# Load data from the database
-df = pd.read_sql("""
+# Queries behind the dashboard frames, read from the rollup tables maintained by the import scripts.
+# Frames are loaded on first use and cached on disk by the data store.
+def parse_prevision(df_prevision):
+    df_prevision['month'] = pd.to_datetime(df_prevision['month'], format='%Y-%m')
+    return df_prevision
+
+
+store = DataStore(engine, {
+    'df': ("""
 SELECT 
-    YEAR(date_transaction) AS year,
+    year,
     departement,
-    AVG(prix) AS prix_moyen,
+    prix_moyen,
     type_batiment
-FROM transactions
-GROUP BY year, departement, type_batiment
-""", engine)
-
-df_loyers = pd.read_sql("""
+FROM transactions_yearly
+""", None),
+    'df_loyers': ("""
 SELECT 
-    date AS year, 
+    year, 
     departement, 
-    AVG(loyer_m2_appartement) AS loyer_m2_appartement, 
-    AVG(loyer_m2_maison) AS loyer_m2_maison 
-FROM loyers
-GROUP BY year, departement
-""", engine)
-
-df_prevision = pd.read_sql("""
+    loyer_m2_appartement, 
+    loyer_m2_maison 
+FROM loyers_yearly
+""", None),
+    'df_prevision': ("""
 SELECT * FROM
   `immodb`.`prix_mensuel`
-                           """, engine)
-df_prevision['month'] = pd.to_datetime(df_prevision['month'], format='%Y-%m')
+                           """, parse_prevision),
+    # Mergeable price per m² sketches per month, departement and building type (scripts/quantile_sketches.py)
+    'df_sketches': ("""
+SELECT month, departement, type_batiment, n, sketch FROM transactions_sketches
+""", None),
+}, views={
+    # Pre-partitioned slices so that callbacks look up a selection instead of scanning the frame
+    'df_by_year': ('df', lambda df: partition(df, 'year')),
+    'df_by_departement': ('df', lambda df: partition(df, 'departement')),
+    'prix_max': ('df', lambda df: df['prix_moyen'].max()),
+    'df_prevision_by_departement': ('df_prevision', lambda df_prevision: partition(df_prevision, 'departement')),
+    # Yearly p10/p50/p90 of the price per m², merged from the monthly sketches
+    'quantiles_by_departement': ('df_sketches', lambda df: partition(yearly_quantiles(df), 'departement')),
+})
+
+# Serialized figures per callback and selection, invalidated when the data version changes
+figures = FigureCache(lambda: store.version)
+
 
-# Load GeoJSON
-zipcodes = json.load(open("./data/departements.geojson"))
+# Background refresh: when the import watermarks change, the frames in use are reloaded off the request path and
+# swapped in at once, then the figures being viewed are rebuilt and a retrained price model is reloaded
+@store.on_refresh
+def rebuild_caches(version):
+    figures.rebuild()
+    reload_predictor()
 
-# Create flask server
+
+def select(view, frame, value):
+    # Slice of `frame` for `value`, empty when nothing matches
+    return store.get(view).get(value, store.get(frame).iloc[0:0])
+
+# Department polygons, simplified by scripts/simplify_geojson.py. The browser downloads them once from a
+# versioned URL and caches them, so figures only carry the department codes and prices.
+MAP_GEOJSON_TOLERANCE = os.getenv('MAP_GEOJSON_TOLERANCE', '0.005')
+geojson_path = f"./data/geo/departements-{MAP_GEOJSON_TOLERANCE}.json"
+if not os.path.exists(geojson_path):
+    geojson_path = "./data/departements.geojson"
+with open(geojson_path, 'rb') as f:
+    geojson_bytes = f.read()
+geojson_url = f"/geo/departements-{hashlib.sha1(geojson_bytes).hexdigest()[:12]}.json"
+
+# Create flask server. Responses are compressed (brotli or gzip) and GET responses carry a content-hash ETag,
+# so that a repeat visit revalidates the layout, the notebook and the assets with 304s.
 server = flask.Flask(__name__)
+http_cache.install(server)
+
+
+# The data refresher is started on the first request of each worker rather than at import, which runs in the
+# master of a pre-fork server
+@server.before_request
+def start_refresher():
+    store.start_refresher()
+
+
+@server.route('/geo/departements-<version>.json')
+def departements_geojson(version):
+    response = flask.Response(geojson_bytes, mimetype='application/json')
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+# Price predictions: a single row, a list of rows or {"rows": [...]}, answered as {"predictions": [...]}.
+# Concurrent requests of a worker are merged into one vectorized predict call.
+@server.route('/api/predict', methods=['POST'])
+def predict_prices():
+    payload = flask.request.get_json(silent=True)
+    if isinstance(payload, dict) and 'rows' in payload:
+        payload = payload['rows']
+    if not isinstance(payload, (dict, list)):
+        return flask.jsonify({'error': 'Expected a JSON row or a list of rows'}), 400
+    try:
+        predictions = get_predictor().predict(payload)
+    except (ValueError, TypeError) as e:
+        return flask.jsonify({'error': str(e)}), 400
+    return flask.jsonify({'predictions': predictions.tolist()})
+
+# Comparable sales: around lat/lon within `radius` meters (default 500) or the `k` nearest, or inside
+# bbox=south,west,north,east; filtered by type_batiment and since/until dates.
+# Larger areas than COMPARABLES_MAX_RADIUS meters or COMPARABLES_MAX_BBOX degrees are refused, so that a
+# request never materializes a whole region; `k` and `limit` are clamped to [1, COMPARABLES_MAX_LIMIT] rows
+COMPARABLES_MAX_RADIUS = float(os.getenv('COMPARABLES_MAX_RADIUS', 5000))
+COMPARABLES_MAX_BBOX = float(os.getenv('COMPARABLES_MAX_BBOX', 0.2))
+COMPARABLES_MAX_LIMIT = int(os.getenv('COMPARABLES_MAX_LIMIT', 1000))
+spatial_index = SpatialIndex()
+
+
+def _finite_arg(args, name, default=None):
+    value = float(args[name] if default is None else args.get(name, default))
+    if not math.isfinite(value):
+        raise ValueError(f"{name} must be a finite number")
+    return value
+
+
+def _row_count_arg(args, name, default=None):
+    return min(max(int(args[name] if default is None else args.get(name, default)), 1), COMPARABLES_MAX_LIMIT)
+
+
+@server.route('/api/comparables')
+def comparables():
+    args = flask.request.args
+    filters = {'type_batiment': args.getlist('type_batiment') or None,
+               'since': args.get('since'), 'until': args.get('until')}
+    try:
+        limit = _row_count_arg(args, 'limit', 100)
+        if 'bbox' in args:
+            south, west, north, east = (float(v) for v in args['bbox'].split(','))
+            if not all(map(math.isfinite, (south, west, north, east))):
+                raise ValueError("bbox coordinates must be finite numbers")
+            if not (0 <= north - south <= COMPARABLES_MAX_BBOX and 0 <= east - west <= COMPARABLES_MAX_BBOX):
+                raise ValueError(f"bbox sides must be between 0 and {COMPARABLES_MAX_BBOX:g} degrees")
+            matches = spatial_index.bbox(south, west, north, east, **filters)
+        elif 'k' in args:
+            k = _row_count_arg(args, 'k')
+            matches = spatial_index.nearest(_finite_arg(args, 'lat'), _finite_arg(args, 'lon'), k,
+                                            max_radius=COMPARABLES_MAX_RADIUS, **filters)
+        else:
+            radius = _finite_arg(args, 'radius', 500)
+            if not 0 <= radius <= COMPARABLES_MAX_RADIUS:
+                raise ValueError(f"radius must be between 0 and {COMPARABLES_MAX_RADIUS:g} meters")
+            matches = spatial_index.radius(_finite_arg(args, 'lat'), _finite_arg(args, 'lon'), radius, **filters)
+    except (KeyError, ValueError) as e:
+        return flask.jsonify({'error': f"Invalid query: {e}"}), 400
+    rows = matches.head(limit).assign(date_transaction=lambda df: df['date_transaction'].dt.strftime('%Y-%m-%d'))
+    rows = rows.astype(object).where(rows.notna(), None)
+    return flask.jsonify({**summary(matches), 'matches': rows.to_dict('records')})
+
+# Latency and throughput counters of this worker's predictor
+@server.route('/api/predict/stats')
+def prediction_stats():
+    predictor = get_predictor()
+    return flask.jsonify({'columns': predictor.columns, **predictor.stats()})
+
+# Notebook page, rendered to HTML once in the background and served from the rendered file
+notebook = http_cache.RenderedNotebook('notebooks/carto.ipynb')
+notebook.warm()
+
+
+@server.route('/notebook.html')
+def notebook_page():
+    try:
+        page = notebook.page()
+    except OSError:
+        flask.abort(404)
+    return flask.Response(page, mimetype='text/html')
+
+# Data version served by this worker and its latest refresh; "degraded" when the latest refresh failed
+@server.route('/health')
+def health():
+    state = store.health()
+    error, check = state['last_error'], state['last_check']
+    status = 'degraded' if error and (check is None or error['at'] >= check) else 'ok'
+    response = flask.jsonify({'status': status, **state})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Call counts and durations of the instrumented stages of this worker, callbacks included
+@server.route('/api/metrics')
+def stage_metrics():
+    return flask.jsonify(instrumentation.totals)
 
 # Dash App Init
 app = Dash(__name__, server=server, external_stylesheets=[dbc.themes.BOOTSTRAP])
-app.layout = html.Div(className='content', children=[
-    html.Div(className='header', children=[
-        html.H1(children='immoDB', style={'font': 'Roboto'})
-    ]),
-    html.Div(className='featured', children=[
-        html.Div(className='card', children=[
-            html.H3(children='Découvrez notre carte des prix'),
-            html.Img(src='assets/images/map.png', alt='map', style={'width': '90%', 'height': '75%', 'border-radius': '10px'}),
-            html.A(html.Button('Voir la carte', className='btn', style={'font': 'Roboto'}), href='#map')
-        ], style={'font': 'Roboto'}),
-        html.Div(className='card', children=[
-            html.H3(children='Suivez l\'évolution des prix', id='line'),
-            html.Img(src='assets/images/line-chart.png', alt='map', style={'width': '90%', 'height': '75%', 'border-radius': '10px'}),
-            html.A(html.Button('Voir l\'evolution', className='btn', style={'font': 'Roboto'}), href='#line')
-        ], style={'font': 'Roboto'}),
-        html.Div(className='card', children=[
-            html.H3(children='Voir nos prévisions'),
-            html.Img(src='assets/images/previsions.png', alt='map', style={'width': '90%', 'height': '75%', 'border-radius': '10px'}),
-            html.A(html.Button('Voir nos prévsions', className='btn', style={'font': 'Roboto'}), href='#prevision')
-        ], style={'font': 'Roboto'})
-    ]),
-    html.Div(className='graph-box', children=[
-        html.H2(children='Prix moyen du m² par département et par année', id='map'),
-        dcc.Dropdown(df['year'].unique(), 2014, id='dropdown-map', className='map-selector'),
-        dcc.Graph(id='graph-content', className='map')
-    ]),
-    html.Div(className='graph-box', children=[
-        html.H2(children='Évolution des prix par département'),
-        dcc.Dropdown(df['departement'].unique(), "01", id='line-selection', className='map-selector'),
-        dcc.Graph(id='line-graph', className='map')
-    ]),
-    html.Div(className='graph-box', children=[
-        html.H2(children='Répartition des types de bâtiments par département'),
-        dcc.Dropdown(df['departement'].unique(), "01", id='pie-selection', className='map-selector'),
-        dcc.Graph(id='pie-chart', className='map')
-    ]),
-    html.Div(className='graph-box', children=[
-        html.H2(children='Prevision du prix des transactions par departement', id='prevision'),
-        dcc.Dropdown(df_prevision['departement'].unique(), 1, id='prevision-selection', className='map-selector'),
-        dcc.Graph(id='prevision-chart', className='map')
-    ]),
-
-    dcc.Location(id='url', refresh=False),
-    html.Div(id='page-content')
-])
-
-# Update map by filtering the dataframe by year
-@callback(
-    Output('graph-content', 'figure'),
-    Input('dropdown-map', 'value')
-)
-def update_map(value):
-    df_by_year = df[df.year == value]
-    return px.choropleth_mapbox(df_by_year, geojson=zipcodes, locations='departement', color='prix_moyen',
+
+
+# The layout is built on each page load so that the data is only queried once a visitor arrives.
+# Dash also calls it once at startup to validate the layout, outside of any request: no data is loaded then.
+def serve_layout():
+    years, departements, prevision_departements, tile_years, types = [], [], [], [], []
+    if flask.has_request_context():
+        years = store.get('df')['year'].unique()
+        departements = store.get('df')['departement'].unique()
+        types = store.get('df')['type_batiment'].unique()
+        tile_years = price_tiles.years()
+        prevision_departements = store.get('df_prevision')['departement'].unique()
+        if FIGURE_CACHE_WARM:
+            figures.warm([(map_figure, years),
+                          (update_lineGraph, departements),
+                          (update_pieChart, departements),
+                          (update_quantiles, departements),
+                          (update_chart, prevision_departements)])
+    return html.Div(className='content', children=[
+        html.Div(className='header', children=[
+            html.H1(children='immoDB', style={'font': 'Roboto'})
+        ]),
+        html.Div(className='featured', children=[
+            html.Div(className='card', children=[
+                html.H3(children='Découvrez notre carte des prix'),
+                html.Img(src='assets/images/map.png', alt='map', style={'width': '90%', 'height': '75%', 'border-radius': '10px'}),
+                html.A(html.Button('Voir la carte', className='btn', style={'font': 'Roboto'}), href='#map')
+            ], style={'font': 'Roboto'}),
+            html.Div(className='card', children=[
+                html.H3(children='Suivez l\'évolution des prix', id='line'),
+                html.Img(src='assets/images/line-chart.png', alt='map', style={'width': '90%', 'height': '75%', 'border-radius': '10px'}),
+                html.A(html.Button('Voir l\'evolution', className='btn', style={'font': 'Roboto'}), href='#line')
+            ], style={'font': 'Roboto'}),
+            html.Div(className='card', children=[
+                html.H3(children='Voir nos prévisions'),
+                html.Img(src='assets/images/previsions.png', alt='map', style={'width': '90%', 'height': '75%', 'border-radius': '10px'}),
+                html.A(html.Button('Voir nos prévsions', className='btn', style={'font': 'Roboto'}), href='#prevision')
+            ], style={'font': 'Roboto'})
+        ]),
+        html.Div(className='graph-box', children=[
+            html.H2(children='Prix moyen du m² par département et par année', id='map'),
+            dcc.Dropdown(years, 2014, id='dropdown-map', className='map-selector'),
+            dcc.Graph(id='graph-content', className='map')
+        ]),
+        html.Div(className='graph-box', children=[
+            html.H2(children='Prix moyen du m² par quartier', id='tiles'),
+            dcc.Dropdown(tile_years, tile_years[-1] if len(tile_years) else None, id='tiles-year',
+                         className='map-selector'),
+            dcc.Dropdown(types, None, id='tiles-type', className='map-selector', placeholder='Tous les biens'),
+            dcc.Graph(id='tiles-map', className='map')
+        ]),
+        html.Div(className='graph-box', children=[
+            html.H2(children='Évolution des prix par département'),
+            dcc.Dropdown(departements, "01", id='line-selection', className='map-selector'),
+            dcc.Graph(id='line-graph', className='map')
+        ]),
+        html.Div(className='graph-box', children=[
+            html.H2(children='Répartition des types de bâtiments par département'),
+            dcc.Dropdown(departements, "01", id='pie-selection', className='map-selector'),
+            dcc.Graph(id='pie-chart', className='map')
+        ]),
+        html.Div(className='graph-box', children=[
+            html.H2(children='Distribution du prix au m² par département'),
+            dcc.Dropdown(departements, "01", id='quantiles-selection', className='map-selector'),
+            dcc.Graph(id='quantiles-chart', className='map')
+        ]),
+        html.Div(className='graph-box', children=[
+            html.H2(children='Prevision du prix des transactions par departement', id='prevision'),
+            dcc.Dropdown(prevision_departements, "01", id='prevision-selection', className='map-selector'),
+            dcc.Graph(id='prevision-chart', className='map')
+        ]),
+
+        dcc.Location(id='url', refresh=False),
+        html.Div(id='page-content')
+    ])
+
+
+app.layout = serve_layout
+
+# Full map figure for a year, the GeoJSON is referenced by URL rather than embedded
+@figures.memoize
+def map_figure(value):
+    df_by_year = select('df_by_year', 'df', value)
+    return px.choropleth_mapbox(df_by_year, geojson=geojson_url, locations='departement', color='prix_moyen',
                                 featureidkey="properties.code",
                                 color_continuous_scale="Viridis",
-                                range_color=(0, df['prix_moyen'].max()),
+                                range_color=(0, store.get('prix_max')),
                                 mapbox_style="carto-positron",
                                 zoom=5, center={"lat": 46.40338, "lon": 2.17403},
                                 opacity=0.5,
                                 labels={'prix_moyen': 'Prix moyen des transactions'}
                                 )
 
+# Update map by filtering the dataframe by year: the first call sends the figure,
+# later year changes only patch the departments and their prices
+@callback(
+    Output('graph-content', 'figure'),
+    Input('dropdown-map', 'value')
+)
+@timed_callback
+def update_map(value):
+    if ctx.triggered_id is None:
+        return map_figure(value)
+    df_by_year = select('df_by_year', 'df', value)
+    patch = Patch()
+    patch['data'][0]['locations'] = df_by_year['departement'].tolist()
+    patch['data'][0]['z'] = df_by_year['prix_moyen'].tolist()
+    return patch
+
+# Price per m² cells of the precomputed pyramid (scripts/price_tiles.py) visible in the map viewport.
+# The grid level follows the zoom and the number of cells is bounded, so the payload stays small at any zoom.
+price_tiles = PriceTiles()
+TILES_DEFAULT_VIEW = (41.3, -5.2, 51.1, 9.6, 5)
+
+
+def viewport(relayout):
+    # South, west, north, east and zoom of the map from its relayout event, None when the event has no bounds
+    if not relayout:
+        return TILES_DEFAULT_VIEW
+    corners = relayout.get('mapbox._derived', {}).get('coordinates')
+    if not corners:
+        return None
+    lons, lats = [c[0] for c in corners], [c[1] for c in corners]
+    return min(lats), min(lons), max(lats), max(lons), relayout.get('mapbox.zoom', TILES_DEFAULT_VIEW[4])
+
+
+@callback(
+    Output('tiles-map', 'figure'),
+    Input('tiles-map', 'relayoutData'),
+    Input('tiles-year', 'value'),
+    Input('tiles-type', 'value')
+)
+@timed_callback
+def update_tiles(relayout, year, type_batiment):
+    # The last relayout event holds the current viewport; the first call draws the figure, later calls patch it
+    view = viewport(relayout)
+    if view is None:
+        if ctx.triggered_id == 'tiles-map':
+            return no_update
+        view = TILES_DEFAULT_VIEW
+    cells, _ = price_tiles.viewport(*view, year=year, type_batiment=type_batiment)
+    if ctx.triggered_id is None:
+        fig = px.scatter_mapbox(cells, lat='latitude', lon='longitude', color='prix_m2', hover_data=['n'],
+                                color_continuous_scale="Viridis", mapbox_style="carto-positron",
+                                zoom=view[4], center={"lat": 46.40338, "lon": 2.17403}, opacity=0.7,
+                                labels={'prix_m2': 'Prix moyen du m²', 'n': 'Ventes'})
+        # Keep the user's pan and zoom across updates
+        fig.update_layout(uirevision='tiles')
+        return fig
+    patch = Patch()
+    patch['data'][0]['lat'] = cells['latitude'].tolist()
+    patch['data'][0]['lon'] = cells['longitude'].tolist()
+    patch['data'][0]['marker']['color'] = cells['prix_m2'].tolist()
+    patch['data'][0]['customdata'] = cells[['n']].to_numpy().tolist()
+    return patch
+
 # Update line graph by filtering the dataframe by departement
 @callback(
     Output('line-graph', 'figure'),
     Input('line-selection', 'value')
 )
+@timed_callback
+@figures.memoize
 def update_lineGraph(value):
-    df_by_departement = df[df.departement == value]
+    df_by_departement = select('df_by_departement', 'df', value)
     return px.line(df_by_departement, x='year', y='prix_moyen', color='type_batiment')
 
 # Update pie chart by filtering the dataframe by departement
@@ -131,31 +394,56 @@ def update_lineGraph(value):
     Output('pie-chart', 'figure'),
     Input('pie-selection', 'value')
 )
+@timed_callback
+@figures.memoize
 def update_pieChart(value):
-    df_by_departement = df[df.departement == value]
+    df_by_departement = select('df_by_departement', 'df', value)
     return px.pie(df_by_departement, names='type_batiment', values='prix_moyen')
 
+# Price per m² bands of a departement: p10 to p90 per building type around the median
+@callback(
+    Output('quantiles-chart', 'figure'),
+    Input('quantiles-selection', 'value')
+)
+@timed_callback
+@figures.memoize
+def update_quantiles(value):
+    df_quantiles = select('quantiles_by_departement', 'df_sketches', value)
+    fig = go.Figure()
+    for (type_batiment, rows), color in zip(df_quantiles.groupby('type_batiment'), px.colors.qualitative.Plotly):
+        fig.add_trace(go.Scatter(x=rows['year'], y=rows['p10'], mode='lines', line={'width': 0, 'color': color},
+                                 legendgroup=type_batiment, showlegend=False, hoverinfo='skip'))
+        fig.add_trace(go.Scatter(x=rows['year'], y=rows['p90'], mode='lines', line={'width': 0, 'color': color},
+                                 fill='tonexty', legendgroup=type_batiment, showlegend=False,
+                                 customdata=rows[['p10', 'n']],
+                                 hovertemplate='p10 %{customdata[0]:.0f} - p90 %{y:.0f} € (%{customdata[1]} ventes)'))
+        fig.add_trace(go.Scatter(x=rows['year'], y=rows['p50'], mode='lines+markers', line={'color': color},
+                                 name=type_batiment, legendgroup=type_batiment))
+    fig.update_layout(xaxis_title='year', yaxis_title='Prix au m² (p10, médiane, p90)')
+    return fig
+
 
 @app.callback(
     Output('prevision-chart', 'figure'),
     Input('prevision-selection', 'value')
 )
+@timed_callback
+@figures.memoize
 def update_chart(selected_departement):
-    filtered_df = df_prevision[df_prevision['departement'] == selected_departement]
+    filtered_df = select('df_prevision_by_departement', 'df_prevision', selected_departement)
     fig = px.line(filtered_df, x='month', y='prix_moyen',
                   title=f'Prix Moyens Mensuels pour le Département {selected_departement}')
     return fig
 
-# Display notebook page
+# Display notebook page, the iframe loads the rendered page so that the browser caches it
 @app.callback(Output('page-content', 'children'),
               [Input('url', 'pathname')])
+@timed_callback
 def display_page(pathname):
     if pathname == '/notebook':
-        with open('notebooks/carto.ipynb', 'r') as f:
-            notebook_html = f.read()
         return html.Div([
             html.H2("Notebook Carto"),
-            html.Iframe(srcDoc=notebook_html, style={"width": "100%", "height": "1000px"})
+            html.Iframe(src='/notebook.html', style={"width": "100%", "height": "1000px"})
         ])
     else:
         return html.Div()
@@ -0,0 +1,194 @@
+import os
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.pipeline import Pipeline
+from sklearn.ensemble import RandomForestRegressor
+
+# Version of the artifact layout written by save_artifact
+ARTIFACT_FORMAT = 'immodb-model/1'
+# Batches with at most this many (row, tree) pairs walk all the trees at once, larger ones tree by tree
+JOINT_TRAVERSAL_PAIRS = 1 << 16
+
+
+def _float32_below(values):
+    # Largest float32 not above each value: for float32 inputs, x <= t holds exactly when x <= t32
+    values32 = values.astype(np.float32)
+    return np.where(values32.astype(np.float64) > values, np.nextafter(values32, np.float32(-np.inf)), values32)
+
+
+def _flatten_tree(tree, max_depth=None):
+    # Nodes reachable within `max_depth`, renumbered in id order so that the root stays at 0.
+    # The value of a regression node is the mean target of its samples, so cut nodes become leaves as is.
+    left, right = tree.children_left, tree.children_right
+    keep = np.zeros(tree.node_count, dtype=bool)
+    cut = np.zeros(tree.node_count, dtype=bool)
+    frontier, depth = np.array([0]), 0
+    while len(frontier):
+        keep[frontier] = True
+        if max_depth is not None and depth == max_depth:
+            cut[frontier] = True
+            break
+        internal = frontier[left[frontier] >= 0]
+        frontier = np.concatenate([left[internal], right[internal]])
+        depth += 1
+    nodes = np.flatnonzero(keep)
+    new_id = np.full(tree.node_count, -1, dtype=np.int64)
+    new_id[nodes] = np.arange(len(nodes))
+    leaf = (left[nodes] < 0) | cut[nodes]
+    return {
+        'left': np.where(leaf, -1, new_id[left[nodes]]),
+        'right': np.where(leaf, -1, new_id[right[nodes]]),
+        'feature': np.where(leaf, 0, tree.feature[nodes]),
+        'threshold': np.where(leaf, 0, tree.threshold[nodes]),
+        'value': tree.value[nodes, 0, 0],
+        'depth': depth - 1 if not len(frontier) else depth,
+    }
+
+
+def flatten_forest(forest, max_depth=None, float32=False):
+    # Every tree of a fitted single-output forest concatenated into flat arrays
+    if forest.n_outputs_ != 1:
+        raise ValueError('Only single-output forests can be flattened')
+    trees = [_flatten_tree(estimator.tree_, max_depth) for estimator in forest.estimators_]
+    sizes = np.array([len(tree['value']) for tree in trees])
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+    def children(key):
+        return np.concatenate([np.where(tree[key] >= 0, tree[key] + offset, -1)
+                               for tree, offset in zip(trees, offsets)]).astype(np.int32)
+
+    threshold = np.concatenate([tree['threshold'] for tree in trees])
+    value = np.concatenate([tree['value'] for tree in trees])
+    return {
+        'roots': offsets.astype(np.int32),
+        'left': children('left'),
+        'right': children('right'),
+        'feature': np.concatenate([tree['feature'] for tree in trees]).astype(
+            np.int16 if forest.n_features_in_ < 2 ** 15 else np.int32),
+        'threshold': _float32_below(threshold) if float32 else threshold,
+        'value': value.astype(np.float32) if float32 else value,
+        'max_depth': max(tree['depth'] for tree in trees),
+        'n_features': forest.n_features_in_,
+    }
+
+
+class FlatForest:
+    # Forest prediction over the flat arrays, which may be read-only memory maps shared between processes
+    def __init__(self, roots, left, right, feature, threshold, value, max_depth, n_features):
+        self.roots = roots
+        self.left = left
+        self.right = right
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.max_depth = max_depth
+        self.n_features = n_features
+
+    def _predict_joint(self, X):
+        # Small batches: every (row, tree) pair advances together, one numpy pass per level
+        node = np.repeat(self.roots[None, :], len(X), axis=0).ravel()
+        row = np.repeat(np.arange(len(X)), len(self.roots))
+        active = np.arange(len(node))
+        for _ in range(self.max_depth):
+            current = node[active]
+            left = self.left[current]
+            internal = left >= 0
+            active, current, left = active[internal], current[internal], left[internal]
+            if not len(active):
+                break
+            go_left = X[row[active], self.feature[current]] <= self.threshold[current]
+            node[active] = np.where(go_left, left, self.right[current])
+        return self.value[node].reshape(len(X), -1).mean(axis=1, dtype=np.float64)
+
+    def _predict_per_tree(self, X):
+        # Large batches: one tree at a time, so that its nodes stay in cache
+        X_columns = np.ascontiguousarray(X.T)
+        total = np.zeros(len(X))
+        for root in self.roots:
+            node = np.full(len(X), root, dtype=np.int64)
+            active = np.arange(len(X))
+            for _ in range(self.max_depth):
+                current = node[active]
+                left = self.left[current]
+                internal = left >= 0
+                active, current, left = active[internal], current[internal], left[internal]
+                if not len(active):
+                    break
+                go_left = X_columns[self.feature[current], active] <= self.threshold[current]
+                node[active] = np.where(go_left, left, self.right[current])
+            total += self.value[node]
+        return total / len(self.roots)
+
+    def predict(self, X):
+        # Same comparison as scikit-learn: float32 features against the split thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if len(X) * len(self.roots) <= JOINT_TRAVERSAL_PAIRS:
+            return self._predict_joint(X)
+        return self._predict_per_tree(X)
+
+
+def prepare_features(X, date_columns=(), string_columns=()):
+    # First step of the training pipeline, so that models take raw rows as stored in the database or sent to
+    # /api/predict: dates become julian days, categories strings (booleans as 0/1, as read from the database)
+    X = X.copy()
+    for column in date_columns:
+        dates = pd.to_datetime(X[column]).to_numpy('datetime64[ns]').astype(np.int64)
+        X[column] = dates / 86400e9 + 2440587.5
+    for column in string_columns:
+        if X[column].dtype == bool:
+            X[column] = X[column].astype(int)
+        X[column] = X[column].astype(str)
+    return X
+
+
+class ArtifactModel:
+    # Preprocessing pipeline followed by a flat forest, or by the original estimator for other models
+    def __init__(self, bundle):
+        self.preprocessor = bundle['preprocessor']
+        self.estimator = bundle['estimator']
+        self.forest = FlatForest(**bundle['forest']) if bundle['forest'] is not None else None
+        self.columns = bundle['columns']
+        self.feature_names_in_ = np.asarray(bundle['feature_names_in'], dtype=object)
+
+    def predict(self, X):
+        if self.preprocessor is not None:
+            X = self.preprocessor.transform(X)
+        if self.forest is None:
+            return self.estimator.predict(X)
+        if hasattr(X, 'toarray'):
+            X = X.toarray()
+        return self.forest.predict(X)
+
+
+def save_artifact(model, path, columns=None, max_depth=None, float32=False):
+    # Write the model as an uncompressed joblib file whose arrays can be memory-mapped on load.
+    # `columns` are the feature names produced by the preprocessing (models/columns.pkl).
+    if isinstance(model, Pipeline):
+        preprocessor, estimator = (model[:-1] if len(model.steps) > 1 else None), model.steps[-1][1]
+    else:
+        preprocessor, estimator = None, model
+    forest = None
+    if isinstance(estimator, RandomForestRegressor):
+        forest, estimator = flatten_forest(estimator, max_depth, float32), None
+    bundle = {
+        'format': ARTIFACT_FORMAT,
+        'preprocessor': preprocessor,
+        'estimator': estimator,
+        'forest': forest,
+        'columns': list(columns) if columns is not None else None,
+        'feature_names_in': list(getattr(model, 'feature_names_in_', [])),
+    }
+    # Written aside then renamed: workers that memory-mapped the previous file keep reading it until they reload
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(bundle, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_artifact(path, mmap=True):
+    # The forest arrays stay in the page cache and are shared by every worker mapping the same file
+    bundle = joblib.load(path, mmap_mode='r' if mmap else None)
+    if bundle.get('format') != ARTIFACT_FORMAT:
+        raise ValueError(f"{path} is not a {ARTIFACT_FORMAT} artifact")
+    return ArtifactModel(bundle)
@@ -0,0 +1,213 @@
+import os
+import time
+import queue
+import pickle
+import threading
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+from model_artifact import load_artifact, prepare_features
+
+# Pickled scikit-learn pipeline and the feature names produced by its preprocessing.
+# A .joblib artifact written by scripts/export_model.py is memory-mapped and already bundles the feature names.
+PREDICTION_MODEL = os.getenv('PREDICTION_MODEL', './models/model_transaction_meanMonth5.pkl')
+PREDICTION_COLUMNS = os.getenv('PREDICTION_COLUMNS', './models/columns.pkl')
+# Concurrent requests are grouped into one `predict` call of at most this many rows...
+PREDICTION_MAX_BATCH = int(os.getenv('PREDICTION_MAX_BATCH', 4096))
+# ...waiting at most this many milliseconds for other requests to join the batch (0 disables batching)
+PREDICTION_MAX_WAIT_MS = float(os.getenv('PREDICTION_MAX_WAIT_MS', 2))
+# Number of recent request latencies kept for the percentiles
+PREDICTION_LATENCY_WINDOW = 10000
+
+
+def raw_column_types(model):
+    # Date and text columns declared by the prepare_features step that opens the model's pipeline,
+    # None when the model does not start with it
+    pipeline = getattr(model, 'preprocessor', model)
+    if not isinstance(pipeline, Pipeline):
+        return None
+    step = pipeline.steps[0][1]
+    if getattr(step, 'func', None) is not prepare_features:
+        return None
+    kw_args = step.kw_args or {}
+    return list(kw_args.get('date_columns', ())), list(kw_args.get('string_columns', ()))
+
+
+class Predictor:
+    # Model loaded once, with a background thread merging concurrent requests into vectorized batches
+    def __init__(self, model_path=PREDICTION_MODEL, columns_path=PREDICTION_COLUMNS,
+                 max_batch=PREDICTION_MAX_BATCH, max_wait_ms=PREDICTION_MAX_WAIT_MS):
+        start = time.perf_counter()
+        self.model_path = model_path
+        self.columns_path = columns_path
+        self.model_mtime = os.path.getmtime(model_path)
+        self.features = None
+        if model_path.endswith('.joblib'):
+            self.model = load_artifact(model_path)
+            self.features = self.model.columns
+        else:
+            with open(model_path, 'rb') as f:
+                self.model = pickle.load(f)
+        self.columns = list(getattr(self.model, 'feature_names_in_', []))
+        if self.features is None and columns_path and os.path.exists(columns_path):
+            with open(columns_path, 'rb') as f:
+                self.features = list(pickle.load(f))
+        self.column_types = raw_column_types(self.model)
+        self.load_seconds = time.perf_counter() - start
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._batcher = None
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=PREDICTION_LATENCY_WINDOW)
+        self.counters = {'requests': 0, 'rows': 0, 'batches': 0, 'errors': 0, 'predict_seconds': 0.0}
+
+    def frame(self, rows):
+        # Accept a DataFrame, a single row as a dict or a list of rows
+        if isinstance(rows, pd.DataFrame):
+            frame = rows
+        elif isinstance(rows, dict):
+            frame = pd.DataFrame([rows])
+        else:
+            frame = pd.DataFrame(list(rows))
+        if self.columns:
+            missing = [column for column in self.columns if column not in frame.columns]
+            if missing:
+                raise ValueError(f"Missing columns: {', '.join(missing)}")
+            frame = frame[self.columns]
+        if self.column_types is not None:
+            frame = self.coerce(frame)
+        return frame
+
+    def coerce(self, frame):
+        # Give every request the same column types before it joins a batch, so that a bad value is reported to
+        # its own request and does not fail the batch: dates parsed, booleans of text columns as 0/1, then text,
+        # other columns numeric
+        date_columns, string_columns = self.column_types
+        frame = frame.copy()
+        for column in frame.columns:
+            if column in date_columns:
+                frame[column] = pd.to_datetime(frame[column])
+            elif column in string_columns:
+                if frame[column].dtype == bool:
+                    frame[column] = frame[column].astype(int)
+                frame[column] = frame[column].astype(str)
+            else:
+                frame[column] = pd.to_numeric(frame[column])
+        return frame
+
+    def _predict(self, frame):
+        start = time.perf_counter()
+        predictions = np.asarray(self.model.predict(frame))
+        with self._lock:
+            self.counters['batches'] += 1
+            self.counters['predict_seconds'] += time.perf_counter() - start
+        return predictions
+
+    def predict(self, rows):
+        # Predict `rows`, sharing a `predict` call with the requests that arrive at the same time
+        start = time.perf_counter()
+        try:
+            frame = self.frame(rows)
+            if len(frame) >= self.max_batch or self.max_wait <= 0:
+                predictions = self._predict(frame)
+            else:
+                future = Future()
+                self._queue.put((frame, future))
+                self._start_batcher()
+                predictions = future.result()
+        except Exception:
+            with self._lock:
+                self.counters['errors'] += 1
+            raise
+        with self._lock:
+            self.counters['requests'] += 1
+            self.counters['rows'] += len(predictions)
+            self._latencies.append(time.perf_counter() - start)
+        return predictions
+
+    def _start_batcher(self):
+        if self._batcher is None:
+            with self._lock:
+                if self._batcher is None:
+                    self._batcher = threading.Thread(target=self._run, name='prediction-batcher', daemon=True)
+                    self._batcher.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            n_rows = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while n_rows < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                n_rows += len(batch[-1][0])
+            try:
+                predictions = self._predict(pd.concat([frame for frame, _ in batch], ignore_index=True))
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                # One request is invalid: each one is predicted alone so that only the failing ones get the error
+                for frame, future in batch:
+                    try:
+                        future.set_result(self._predict(frame))
+                    except Exception as error:
+                        future.set_exception(error)
+                continue
+            offset = 0
+            for frame, future in batch:
+                future.set_result(predictions[offset:offset + len(frame)])
+                offset += len(frame)
+
+    def stats(self):
+        # Counters since startup and latency percentiles over the recent requests
+        with self._lock:
+            stats = dict(self.counters)
+            latencies = np.array(self._latencies)
+        stats['load_seconds'] = self.load_seconds
+        stats['model_mtime'] = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.model_mtime))
+        stats['rows_per_batch'] = stats['rows'] / stats['batches'] if stats['batches'] else 0.0
+        stats['rows_per_second'] = stats['rows'] / stats['predict_seconds'] if stats['predict_seconds'] else 0.0
+        for name, q in [('latency_p50_ms', 50), ('latency_p99_ms', 99)]:
+            stats[name] = float(np.percentile(latencies, q) * 1000) if len(latencies) else None
+        return stats
+
+
+_predictor = None
+_predictor_lock = threading.Lock()
+
+
+def get_predictor():
+    # One model per process, loaded on first use
+    global _predictor
+    if _predictor is None:
+        with _predictor_lock:
+            if _predictor is None:
+                _predictor = Predictor()
+    return _predictor
+
+
+def reload_predictor():
+    # Load the model again if its file changed since it was loaded, off the request path, and swap it in:
+    # requests already queued on the previous model finish on it
+    global _predictor
+    predictor = _predictor
+    if predictor is None or os.path.getmtime(predictor.model_path) == predictor.model_mtime:
+        return False
+    reloaded = Predictor(predictor.model_path, predictor.columns_path, predictor.max_batch,
+                         predictor.max_wait * 1000)
+    with _predictor_lock:
+        _predictor = reloaded
+    return True
+
+
+def predict(rows):
+    return get_predictor().predict(rows)
@@ -0,0 +1,58 @@
+import os
+import gzip
+import json
+import numpy as np
+import pandas as pd
+import plotly.express as px
+from dash import Patch
+from dotenv import load_dotenv
+from simplify_geojson import simplify_geojson, TOLERANCES
+
+# Charger les variables d'environnement
+load_dotenv()
+
+
+def sizes(payload):
+    # Taille brute et compressée (gzip) d'une charge utile JSON
+    raw = payload.encode('utf-8') if isinstance(payload, str) else payload
+    return len(raw), len(gzip.compress(raw))
+
+
+def map_figure(df_by_year, geojson):
+    # Mêmes paramètres que la carte de App/main.py
+    return px.choropleth_mapbox(df_by_year, geojson=geojson, locations='departement', color='prix_moyen',
+                                featureidkey="properties.code", color_continuous_scale="Viridis",
+                                range_color=(0, df_by_year['prix_moyen'].max()), mapbox_style="carto-positron",
+                                zoom=5, center={"lat": 46.40338, "lon": 2.17403}, opacity=0.5,
+                                labels={'prix_moyen': 'Prix moyen des transactions'})
+
+
+def benchmark(source, directory):
+    with open(source) as f:
+        geojson = json.load(f)
+    codes = [feature['properties']['code'] for feature in geojson['features']]
+    df_by_year = pd.DataFrame({'departement': codes,
+                               'prix_moyen': np.random.default_rng(0).uniform(1e5, 5e5, len(codes))})
+    rows = []
+    # Avant : le GeoJSON complet est intégré à chaque figure, à chaque changement d'année
+    before = sizes(map_figure(df_by_year, geojson).to_json())
+    rows.append(('avant : figure par changement d\'année', *before))
+    # Après : la figure référence le GeoJSON par URL, téléchargé une seule fois puis mis en cache
+    simplify_geojson(source, directory)
+    for tolerance in TOLERANCES:
+        with open(os.path.join(directory, f"departements-{tolerance}.json"), 'rb') as f:
+            rows.append((f"après : GeoJSON {tolerance} (une fois)", *sizes(f.read())))
+    rows.append(('après : figure initiale', *sizes(map_figure(df_by_year, '/geo/departements.json').to_json())))
+    patch = Patch()
+    patch['data'][0]['locations'] = df_by_year['departement'].tolist()
+    patch['data'][0]['z'] = df_by_year['prix_moyen'].tolist()
+    rows.append(('après : patch par changement d\'année', *sizes(json.dumps(patch.to_plotly_json()))))
+    print(f"{'payload':<45} {'octets':>12} {'gzip':>12}")
+    for name, raw, compressed in rows:
+        print(f"{name:<45} {raw:>12} {compressed:>12}")
+    return rows
+
+
+if __name__ == '__main__':
+    directory = os.getenv('SOURCES_DIRECTORY', './data')
+    benchmark(os.path.join(directory, 'departements.geojson'), os.path.join(directory, 'geo'))
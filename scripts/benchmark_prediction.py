@@ -0,0 +1,89 @@
+import os
+import sys
+import time
+import threading
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'App'))
+from prediction import Predictor, PREDICTION_MODEL, PREDICTION_COLUMNS  # noqa: E402
+
+# Charger les variables d'environnement
+load_dotenv()
+
+BATCH_SIZES = [1, 10, 100, 1000, 10000]
+REPEATS = 200
+CONCURRENCY = [1, 8, 32]
+
+
+def sample_rows(n, rng):
+    # Lignes d'entrée plausibles pour le modèle mensuel : un département et un mois
+    months = pd.period_range('2015-01', '2024-12', freq='M').astype(str)
+    return pd.DataFrame({'month': rng.choice(months, n), 'departement': rng.integers(1, 96, n)})
+
+
+def percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def bench_batches(predictor, rng):
+    # Un appel par lot : latence selon la taille du lot
+    rows = []
+    for size in BATCH_SIZES:
+        frame = sample_rows(size, rng)
+        latencies = []
+        for _ in range(max(3, REPEATS // max(1, size // 100))):
+            start = time.perf_counter()
+            predictor.predict(frame)
+            latencies.append(time.perf_counter() - start)
+        p50, p99 = percentiles(latencies)
+        rows.append((f"lot de {size}", p50, p99, size / np.median(latencies)))
+    return rows
+
+
+def bench_concurrent(predictor, rng, threads):
+    # `threads` clients envoient chacun des requêtes d'une ligne en parallèle
+    latencies = []
+    lock = threading.Lock()
+    frames = [sample_rows(1, rng) for _ in range(REPEATS)]
+
+    def client():
+        local = []
+        for frame in frames:
+            start = time.perf_counter()
+            predictor.predict(frame)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=client) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    p50, p99 = percentiles(latencies)
+    return p50, p99, len(latencies) / elapsed
+
+
+def benchmark(model_path=PREDICTION_MODEL, columns_path=PREDICTION_COLUMNS):
+    rng = np.random.default_rng(0)
+    direct = Predictor(model_path, columns_path, max_wait_ms=0)
+    print(f"Modèle chargé en {direct.load_seconds * 1000:.1f} ms")
+    rows = bench_batches(direct, rng)
+    for threads in CONCURRENCY:
+        rows.append((f"{threads} clients, sans regroupement", *bench_concurrent(direct, rng, threads)))
+        batched = Predictor(model_path, columns_path)
+        rows.append((f"{threads} clients, avec regroupement", *bench_concurrent(batched, rng, threads)))
+        print(f"{threads} clients : {batched.stats()['rows_per_batch']:.1f} lignes par appel à predict")
+    print(f"{'scénario':<35} {'p50 (ms)':>10} {'p99 (ms)':>10} {'lignes/s':>12}")
+    for name, p50, p99, throughput in rows:
+        print(f"{name:<35} {p50:>10.2f} {p99:>10.2f} {throughput:>12.0f}")
+    return rows
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,187 @@
+import os
+import re
+import sys
+import json
+import gzip
+import math
+import time
+import plotly
+from dotenv import load_dotenv
+from benchmark_suite import BENCH_DIR, BENCH_SIZES, sqlite_engine
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Réseau simulé pour estimer le temps jusqu'à l'interactivité : débit, aller-retour et connexions simultanées
+BENCH_BANDWIDTH_MBPS = float(os.getenv('BENCH_BANDWIDTH_MBPS', 10))
+BENCH_RTT_MS = float(os.getenv('BENCH_RTT_MS', 50))
+BENCH_CONNECTIONS = 6
+NOTEBOOK_PATH = 'notebooks/carto.ipynb'
+
+
+class Browser:
+    # Client qui garde, comme un navigateur, les réponses encore fraîches et les ETag à revalider.
+    # `optimized=False` reproduit les échanges d'avant : ni compression ni revalidation.
+    def __init__(self, client, optimized):
+        self.client = client
+        self.optimized = optimized
+        self.fresh = set()
+        self.etags = {}
+        # Dernière page et dernier layout reçus, relus quand le serveur répond 304
+        self.index = ''
+        self.layout = None
+
+    def request(self, method, url, payload=None):
+        # Octets reçus (en-têtes compris), durée côté serveur et corps décompressé, None si la réponse en cache
+        # suffit
+        if method == 'GET' and url in self.fresh:
+            return None
+        headers = {}
+        if self.optimized:
+            headers['Accept-Encoding'] = 'br, gzip'
+            if method == 'GET' and url in self.etags:
+                headers['If-None-Match'] = self.etags[url]
+        start = time.perf_counter()
+        response = self.client.open(url, method=method, json=payload, headers=headers)
+        elapsed = time.perf_counter() - start
+        if response.status_code not in (200, 204, 304):
+            raise RuntimeError(f"{method} {url} : HTTP {response.status_code}")
+        body = response.get_data()
+        if method == 'GET':
+            if response.cache_control.max_age and not response.cache_control.no_cache:
+                self.fresh.add(url)
+            if self.optimized and response.headers.get('ETag'):
+                self.etags[url] = response.headers['ETag']
+        size = len(body) + sum(len(k) + len(v) + 4 for k, v in response.headers.items())
+        encoding = response.headers.get('Content-Encoding')
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'br':
+            body = brotli.decompress(body)
+        return size, elapsed, body
+
+
+def phase(results):
+    # Requêtes parallèles d'une étape du chargement : la plus lente côté serveur, un aller-retour par vague
+    # de connexions, et le transfert de tous les octets
+    results = [r for r in results if r is not None]
+    if not results:
+        return 0, 0, 0.0
+    size = sum(r[0] for r in results)
+    seconds = max(r[1] for r in results) + BENCH_RTT_MS / 1000 * math.ceil(len(results) / BENCH_CONNECTIONS) \
+        + size * 8 / (BENCH_BANDWIDTH_MBPS * 1e6)
+    return len(results), size, seconds
+
+
+def find_props(node, found):
+    # Propriétés de chaque composant du layout par identifiant
+    if isinstance(node, dict):
+        props = node.get('props', {})
+        if 'id' in props:
+            found[props['id']] = props
+        for value in props.values():
+            find_props(value, found)
+    elif isinstance(node, list):
+        for value in node:
+            find_props(value, found)
+    return found
+
+
+def callback(output, inputs):
+    component, prop = output.split('.')
+    return {'output': output, 'outputs': {'id': component, 'property': prop},
+            'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs], 'changedPropIds': []}
+
+
+def old_notebook_request(main):
+    # Avant : le callback lisait le notebook brut et l'intégrait à l'iframe dans la réponse
+    start = time.perf_counter()
+    with open(NOTEBOOK_PATH) as f:
+        raw = f.read()
+    children = main.html.Div([main.html.H2("Notebook Carto"),
+                              main.html.Iframe(srcDoc=raw, style={"width": "100%", "height": "1000px"})])
+    body = json.dumps({'multi': True, 'response': {'page-content': {'children': children}}},
+                      cls=plotly.utils.PlotlyJSONEncoder).encode('utf-8')
+    return len(body), time.perf_counter() - start, body
+
+
+def dashboard_visit(browser, main):
+    # Page, scripts et styles, layout, callbacks initiaux puis GeoJSON de la carte
+    steps = []
+    index = browser.request('GET', '/')
+    steps.append(phase([index]))
+    if index and index[2]:
+        browser.index = index[2].decode('utf-8')
+    assets = [url for url in re.findall(r'(?:src|href)="([^"]+)"', browser.index)
+              if url.startswith(('/_dash-component-suites/', '/assets/'))]
+    steps.append(phase([browser.request('GET', url) for url in assets]))
+    layout = browser.request('GET', '/_dash-layout')
+    steps.append(phase([layout, browser.request('GET', '/_dash-dependencies')]))
+    if layout and layout[2]:
+        browser.layout = json.loads(layout[2])
+    props = find_props(browser.layout, {})
+    requests = [
+        ('graph-content.figure', [('dropdown-map', 'value', props['dropdown-map'].get('value'))]),
+        ('tiles-map.figure', [('tiles-map', 'relayoutData', None),
+                              ('tiles-year', 'value', props['tiles-year'].get('value')),
+                              ('tiles-type', 'value', None)]),
+        ('line-graph.figure', [('line-selection', 'value', props['line-selection'].get('value'))]),
+        ('pie-chart.figure', [('pie-selection', 'value', props['pie-selection'].get('value'))]),
+        ('quantiles-chart.figure', [('quantiles-selection', 'value', props['quantiles-selection'].get('value'))]),
+        ('prevision-chart.figure', [('prevision-selection', 'value', props['prevision-selection'].get('value'))]),
+        ('page-content.children', [('url', 'pathname', '/')]),
+    ]
+    steps.append(phase([browser.request('POST', '/_dash-update-component', callback(output, inputs))
+                        for output, inputs in requests]))
+    steps.append(phase([browser.request('GET', main.geojson_url)]))
+    return steps
+
+
+def notebook_visit(browser, main):
+    # Ouverture de /notebook : callback de la page puis, après, chargement de la page rendue
+    if not browser.optimized:
+        return [phase([old_notebook_request(main)])]
+    return [phase([browser.request('POST', '/_dash-update-component',
+                                   callback('page-content.children', [('url', 'pathname', '/notebook')]))]),
+            phase([browser.request('GET', '/notebook.html')])]
+
+
+def benchmark(main):
+    rows = []
+    for optimized in (False, True):
+        browser = Browser(main.server.test_client(), optimized)
+        for visit in ('première visite', 'visite suivante'):
+            label = f"{'après' if optimized else 'avant'}, {visit}"
+            for page, run in (('dashboard', dashboard_visit), ('notebook', notebook_visit)):
+                steps = run(browser, main)
+                rows.append((f"{label} : {page}", sum(s[0] for s in steps), sum(s[1] for s in steps),
+                             sum(s[2] for s in steps)))
+    print(f"Réseau simulé : {BENCH_BANDWIDTH_MBPS:g} Mbit/s, aller-retour {BENCH_RTT_MS:g} ms, "
+          f"{BENCH_CONNECTIONS} connexions")
+    print(f"{'chargement':<40} {'requêtes':>9} {'octets':>12} {'interactif':>11}")
+    for name, count, size, seconds in rows:
+        print(f"{name:<40} {count:>9} {size:>12} {seconds:>10.3f}s")
+    return rows
+
+
+if __name__ == '__main__':
+    # python scripts/benchmark_responses.py [taille] : dashboard branché sur la base SQLite d'une taille
+    # du banc d'essai (scripts/benchmark_suite.py), lancé à la racine du projet
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else BENCH_SIZES[0]
+    workdir = os.path.join(BENCH_DIR, str(n))
+    database = os.path.join(workdir, 'immodb.db')
+    if not os.path.exists(database):
+        sys.exit(f"{database} introuvable : lancer d'abord python scripts/benchmark_suite.py {n}")
+    os.environ.update({
+        'SPATIAL_INDEX_DIR': os.path.join(workdir, 'spatial'), 'TILES_DIR': os.path.join(workdir, 'tiles'),
+        'DATA_CACHE_DIR': os.path.join(workdir, 'cache'), 'DATA_REFRESH_INTERVAL': '0', 'METRICS_FILE': '',
+    })
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'App'))
+    import main
+    main.store.engine = sqlite_engine(database)
+    benchmark(main)
@@ -0,0 +1,315 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import event
+from dotenv import load_dotenv
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Dossier de travail du banc d'essai : fichiers générés, bases SQLite, index et résultats
+BENCH_DIR = os.path.abspath(os.getenv('BENCH_DIR', './bench'))
+# Nombres de transactions générées, chaque taille est mesurée dans un processus séparé
+BENCH_SIZES = [int(n) for n in os.getenv('BENCH_SIZES', '100000,1000000,10000000').split(',')]
+# Historique des mesures, une ligne JSON par (exécution, taille, étape)
+BENCH_RESULTS = os.getenv('BENCH_RESULTS', os.path.join(BENCH_DIR, 'results.jsonl'))
+# Ralentissement relatif signalé comme régression, et écart absolu en dessous duquel on l'ignore
+BENCH_TOLERANCE = float(os.getenv('BENCH_TOLERANCE', 0.2))
+BENCH_MIN_DELTA = float(os.getenv('BENCH_MIN_DELTA', 0.05))
+# Nombre de valeurs différentes envoyées à chaque callback du dashboard
+BENCH_CALLBACK_CALLS = int(os.getenv('BENCH_CALLBACK_CALLS', 20))
+
+# Codes de département du fichier DVF : la Corse sous 2A et 2B, zéros en tête, outre-mer sur trois chiffres
+DEPARTEMENTS = ([f"{i:02d}" for i in range(1, 20)] + ['2A', '2B'] + [f"{i:02d}" for i in range(21, 96)]
+                + ['971', '972', '973', '974', '976'])
+# Version du générateur, dans le nom des fichiers générés : une nouvelle version les regénère
+BENCH_DATA_VERSION = 2
+TYPES_BATIMENT = ['Appartement', 'Maison']
+FIRST_DAY, DAYS = np.datetime64('2014-01-01', 'ns'), 3652
+STREETS = ['rue de la République', 'avenue Jean Jaurès', 'rue Victor Hugo', 'place de l\'Église', 'chemin des Vignes',
+           'boulevard Gambetta', 'rue du Moulin', 'allée des Tilleuls', 'rue Pasteur', 'impasse des Lilas']
+
+
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+
+
+def _blob(pool, idx, chunksize=1_000_000):
+    # Colonne texte au format du fichier de transactions : chaînes UTF-8 séparées par un octet nul.
+    # Les chaînes du `pool` sont recopiées aux positions `idx` sans passer par des objets Python, par blocs
+    # pour borner la mémoire des index intermédiaires.
+    encoded = [s.encode('utf-8') + b'\x00' for s in pool]
+    lengths = np.array([len(s) for s in encoded], dtype=np.int64)
+    source = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    parts = []
+    for i in range(0, len(idx), chunksize):
+        block = idx[i:i + chunksize]
+        sizes = lengths[block]
+        out_starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        parts.append(source[np.repeat(starts[block] - out_starts, sizes) + np.arange(int(sizes.sum()))])
+    # Pas de séparateur après la dernière chaîne
+    return np.concatenate(parts)[:-1]
+
+
+def generate_transactions(path, n, seed=42):
+    # Transactions réalistes dans la disposition du fichier DVF : 20 colonnes, textes en uint8 séparés par des
+    # octets nuls. Prix au m² par département et type de bâtiment, environ 1 % de prix absurdes.
+    rng = np.random.default_rng(seed)
+    n_dep = len(DEPARTEMENTS)
+    weights = rng.pareto(1.5, n_dep) + 1
+    dep = rng.choice(n_dep, n, p=weights / weights.sum())
+    centers = rng.uniform([43.0, -1.5], [50.5, 7.0], (n_dep, 2))
+    villes = [f"{d}-Commune {i}" for d in DEPARTEMENTS for i in range(40)]
+    ville = dep * 40 + np.minimum(rng.geometric(0.08, n) - 1, 39)
+    maison = rng.random(n) < 0.45
+    surface = np.where(maison, rng.normal(105, 35, n), rng.normal(58, 25, n)).clip(9, 400).astype(np.int32)
+    prix_m2 = rng.lognormal(np.log(rng.uniform(1500, 6000, n_dep))[dep] - 0.2 * maison, 0.35)
+    prix = (surface * prix_m2).round(-2)
+    outliers = rng.choice(n, n // 100, replace=False)
+    prix[outliers] *= rng.uniform(20, 100, len(outliers))
+    addresses = [f"{i} {street}" for i in range(1, 301) for street in STREETS]
+    parcelles = [f"{i:05d}000{chr(65 + i % 26)}{chr(65 + i // 26 % 26)}{i % 9973:04d}" for i in range(50000)]
+    surfaces = [str(i) for i in range(0, 2000, 5)]
+    arrays = {
+        'id_transaction': np.arange(n, dtype=np.int32),
+        'date_transaction': FIRST_DAY + rng.integers(0, DAYS, n).astype('timedelta64[D]').astype('timedelta64[ns]'),
+        'prix': prix,
+        'departement': _blob(DEPARTEMENTS, dep),
+        'id_ville': ville.astype(np.int32),
+        'ville': _blob(villes, ville),
+        # Codes postaux de la Corse en 20xxx
+        'code_postal': (np.array([int(d[:2]) if d.isdigit() else 20 for d in DEPARTEMENTS])[dep] * 1000
+                        + ville % 40 * 10).astype(np.int32),
+        'adresse': _blob(addresses, rng.integers(0, len(addresses), n)),
+        'type_batiment': _blob(TYPES_BATIMENT, maison.astype(np.int64)),
+        'vefa': rng.random(n) < 0.05,
+        'n_pieces': np.maximum(surface // 22, 1).astype(np.int32),
+        'surface_habitable': surface,
+        'id_parcelle_cadastre': _blob(parcelles, rng.integers(0, len(parcelles), n)),
+        'latitude': centers[dep, 0] + rng.normal(0, 0.15, n),
+        'longitude': centers[dep, 1] + rng.normal(0, 0.2, n),
+    }
+    for column in ['surface_dependances', 'surface_locaux_industriels', 'surface_terrains_agricoles',
+                   'surface_terrains_sols', 'surface_terrains_nature']:
+        arrays[column] = _blob(surfaces, np.where(rng.random(n) < 0.8, 0, rng.integers(0, len(surfaces), n)))
+    np.savez(path, **arrays)
+    return path
+
+
+def generate_loyers(directory, seed=42):
+    # Loyers au m² par commune : plusieurs lignes par (année, département), comme les CSV d'origine
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    years = np.arange(2014, 2024)
+    rows = len(years) * len(DEPARTEMENTS) * 20
+    appartement = rng.lognormal(np.log(12), 0.3, rows)
+    pd.DataFrame({
+        'date': np.repeat(years, len(DEPARTEMENTS) * 20),
+        'departement': np.tile(np.repeat(DEPARTEMENTS, 20), len(years)),
+        'loyer_m2_appartement': appartement,
+        'loyer_m2_maison': appartement * rng.uniform(0.7, 0.95, rows),
+    }).to_csv(os.path.join(directory, 'loyers.csv'), index=False)
+    return directory
+
+
+def sqlite_engine(path):
+    # Base locale à la place de MySQL ; elle est aussi attachée sous le nom `immodb` lu par le dashboard
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, 'connect')
+    def attach(connection, record):
+        connection.execute(f"ATTACH DATABASE '{path}' AS immodb")
+
+    return engine
+
+
+def commit_label():
+    # Commit mesuré, suffixé de -dirty si l'arbre de travail a des modifications
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def dash_request(client, output, inputs, changed):
+    # Appel d'un callback comme le fait le navigateur ; `changed` vide correspond au premier affichage
+    component, prop = output.split('.')
+    start = time.perf_counter()
+    response = client.post('/_dash-update-component', json={
+        'output': output, 'outputs': {'id': component, 'property': prop},
+        'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+        'changedPropIds': changed,
+    })
+    elapsed = time.perf_counter() - start
+    if response.status_code not in (200, 204):
+        raise RuntimeError(f"{output} : HTTP {response.status_code}")
+    return elapsed
+
+
+def bench_callbacks(main, calls=BENCH_CALLBACK_CALLS):
+    # Premier appel de chaque callback (chargement des données compris), puis latence médiane sur des valeurs
+    # différentes (figures calculées) et sur les mêmes valeurs (figures en cache)
+    client = main.server.test_client()
+    start = time.perf_counter()
+    client.get('/')
+    results = [('callback/layout', time.perf_counter() - start)]
+    df, df_prevision = main.store.get('df'), main.store.get('df_prevision')
+    years = sorted(df['year'].unique().tolist())
+    departements = df['departement'].unique().tolist()[:calls]
+    tile_years = main.price_tiles.years()
+    views = [{'mapbox.zoom': zoom, 'mapbox._derived': {'coordinates': [
+        [lon - span, lat + span], [lon + span, lat + span], [lon + span, lat - span], [lon - span, lat - span]]}}
+             for zoom, span in [(6, 4.0), (8, 1.0), (10, 0.25), (12, 0.06)]
+             for lat, lon in [(48.85, 2.35), (45.76, 4.83), (43.3, 5.37)]]
+    callbacks = [
+        ('update_map', 'graph-content.figure', lambda v: [('dropdown-map', 'value', v)], years),
+        ('update_tiles', 'tiles-map.figure',
+         lambda v: [('tiles-map', 'relayoutData', v), ('tiles-year', 'value', tile_years[-1] if tile_years else None),
+                    ('tiles-type', 'value', None)], views),
+        ('update_lineGraph', 'line-graph.figure', lambda v: [('line-selection', 'value', v)], departements),
+        ('update_pieChart', 'pie-chart.figure', lambda v: [('pie-selection', 'value', v)], departements),
+        ('update_quantiles', 'quantiles-chart.figure', lambda v: [('quantiles-selection', 'value', v)], departements),
+        ('update_chart', 'prevision-chart.figure', lambda v: [('prevision-selection', 'value', v)],
+         df_prevision['departement'].unique().tolist()[:calls]),
+        ('display_page', 'page-content.children', lambda v: [('url', 'pathname', v)], ['/', '/notebook']),
+    ]
+    for name, output, inputs, values in callbacks:
+        values = values[:calls]
+        if not values:
+            continue
+        first = dash_request(client, output, inputs(values[0]), [])
+        changed = [f"{component}.{prop}" for component, prop, _ in inputs(values[0])[:1]]
+        computed = [dash_request(client, output, inputs(v), changed) for v in values]
+        cached = [dash_request(client, output, inputs(v), changed) for v in values]
+        results += [(f"callback/{name}/premier appel", first),
+                    (f"callback/{name}", float(np.median(computed))),
+                    (f"callback/{name}/cache", float(np.median(cached)))]
+    return results
+
+
+def run_size(n, run_id):
+    # Toutes les étapes pour `n` transactions, dans ce processus : le pic de mémoire mesuré est celui de cette taille.
+    # Les dossiers de l'index spatial, de la pyramide et du cache sont propres à la taille mesurée.
+    workdir = os.path.join(BENCH_DIR, str(n))
+    os.makedirs(workdir, exist_ok=True)
+    os.environ.update({
+        'SPATIAL_INDEX_DIR': os.path.join(workdir, 'spatial'), 'TILES_DIR': os.path.join(workdir, 'tiles'),
+        'DATA_CACHE_DIR': os.path.join(workdir, 'cache'), 'DATA_REFRESH_INTERVAL': '0',
+        'METRICS_FILE': os.path.join(BENCH_DIR, 'metrics.jsonl'), 'RUN_ID': run_id,
+        'IMPORT_INCREMENTAL': '0', 'FORECAST_INCREMENTAL': '0',
+    })
+    # Import après la configuration : ces modules lisent leurs réglages au chargement
+    import import_transactions
+    import import_other_tables
+    from instrumentation import stage
+    from rollups import refresh_rollups
+    from spatial_index import refresh_spatial_index
+    from price_tiles import refresh_price_tiles
+    from script_model_transaction_meanMonth import run_forecasts
+    from schema import create_transactions_table
+
+    source = os.path.join(BENCH_DIR, f"transactions-{n}-v{BENCH_DATA_VERSION}.npz")
+    loyers = os.path.join(BENCH_DIR, f"csv-v{BENCH_DATA_VERSION}")
+    if not os.path.exists(source):
+        print(f"{_now()} - [BENCH]: génération de {n} transactions dans {source}")
+        generate_transactions(source, n)
+    if not os.path.exists(os.path.join(loyers, 'loyers.csv')):
+        generate_loyers(loyers)
+    database = os.path.join(workdir, 'immodb.db')
+    if os.path.exists(database):
+        os.remove(database)
+    engine = sqlite_engine(database)
+    import_transactions.engine = engine
+    import_other_tables.engine = engine
+    create_transactions_table(engine)
+
+    records = []
+
+    def measure(name, func, *args, rows=n):
+        # `rows` : transactions traitées par l'étape, None pour les étapes qui n'en dépendent pas directement
+        with stage(f"bench/{name}", tag='BENCH') as s:
+            result = func(*args)
+        wall = s.record['wall_s']
+        records.append({'step': name, 'seconds': wall, 'cpu_s': s.record['cpu_s'], 'rows': rows,
+                        'rows_per_s': round(rows / wall) if rows and wall else None,
+                        'peak_rss_mb': s.record['peak_rss_mb']})
+        return result
+
+    df = measure('read_transactions', import_transactions.read_transactions, source)
+    df = measure('clean_transactions_absurd', import_transactions.clean_transactions_absurd,
+                 import_transactions.drop_unused_columns(df))
+    measure('write_to_db', import_transactions.write_to_db, df, 'transactions')
+    del df
+    measure('refresh_rollups', refresh_rollups, engine)
+    measure('refresh_spatial_index', refresh_spatial_index, engine)
+    measure('refresh_price_tiles', refresh_price_tiles)
+    measure('import_loyers', import_other_tables.process_csv_files, loyers, 1, rows=None)
+    measure('run_forecasts', run_forecasts, engine, False, rows=None)
+
+    # Le dashboard lit la base SQLite ; il a besoin du GeoJSON des départements (./data)
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'App'))
+    try:
+        import main
+    except OSError as e:
+        print(f"{_now()} - [BENCH]: callbacks du dashboard ignorés ({e})")
+    else:
+        main.store.engine = engine
+        for name, seconds in bench_callbacks(main):
+            records.append({'step': name, 'seconds': round(seconds, 4), 'rows': None, 'rows_per_s': None})
+
+    label = commit_label()
+    with open(BENCH_RESULTS, 'a') as f:
+        for record in records:
+            f.write(json.dumps({'run': run_id, 'commit': label, 'ts': _now(), 'size': n, **record}) + '\n')
+    return records
+
+
+def compare(path=BENCH_RESULTS, tolerance=BENCH_TOLERANCE, min_delta=BENCH_MIN_DELTA):
+    # Chaque mesure de la dernière exécution comparée à la plus récente faite sur un autre commit
+    # (à défaut, à la plus récente des exécutions précédentes)
+    runs = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            run = runs.setdefault(record['run'], {'commit': record['commit'], 'steps': {}})
+            run['steps'][(record['size'], record['step'])] = record['seconds']
+    order = list(runs)
+    current = runs[order[-1]]
+    previous = [runs[r] for r in reversed(order[:-1])]
+    previous = [r for r in previous if r['commit'] != current['commit']] + \
+        [r for r in previous if r['commit'] == current['commit']]
+    print(f"{'taille':>10} {'étape':<42} {'commit':>14} {'avant (s)':>10} {'après (s)':>10} {'écart':>8}")
+    regressions = []
+    for key in sorted(current['steps']):
+        base = next((r for r in previous if key in r['steps']), None)
+        if base is None:
+            continue
+        before, after = base['steps'][key], current['steps'][key]
+        change = (after - before) / before if before else 0.0
+        flag = change > tolerance and after - before > min_delta
+        if flag:
+            regressions.append((*key, before, after))
+        print(f"{key[0]:>10} {key[1]:<42} {base['commit'][:14]:>14} {before:>10.3f} {after:>10.3f} "
+              f"{change:>+7.0%}{' <- régression' if flag else ''}")
+    print(f"{current['commit']} : {len(regressions)} régression(s) au-delà de {tolerance:.0%}")
+    return regressions
+
+
+if __name__ == '__main__':
+    # python scripts/benchmark_suite.py [taille ...] : chaque taille dans un processus, puis comparaison
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    if len(sys.argv) > 2 and sys.argv[1] == '--size':
+        run_size(int(sys.argv[2]), os.environ['RUN_ID'])
+        sys.exit(0)
+    run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    for n in [int(a) for a in sys.argv[1:]] or BENCH_SIZES:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--size', str(n)],
+                       env={**os.environ, 'RUN_ID': run_id}, check=True)
+    sys.exit(1 if compare() else 0)
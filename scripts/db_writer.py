@@ -0,0 +1,139 @@
+import os
+import csv
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+# Stratégies d'écriture disponibles : 'executemany' (INSERT multi-lignes) ou 'load_data' (LOAD DATA LOCAL INFILE)
+STRATEGIES = ('executemany', 'load_data')
+# Erreurs MySQL de LOAD DATA LOCAL désactivé : 1148 (commande interdite), 3948 (local_infile désactivé côté
+# serveur), 2068 (fichier refusé par le client). Les autres erreurs sont de vraies erreurs d'écriture.
+LOAD_DATA_DISABLED_ERRORS = (1148, 3948, 2068)
+
+
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+
+
+def _rows(chunk):
+    # Convertir un bloc en tuples de scalaires Python compris par tous les pilotes DB-API
+    columns = []
+    for col in chunk.columns:
+        serie = chunk[col]
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            values = pd.Series(np.asarray(serie.dt.to_pydatetime(), dtype=object), index=serie.index, dtype=object)
+        else:
+            values = serie.astype(object)
+        columns.append(values.where(serie.notna(), None).tolist())
+    return list(zip(*columns))
+
+
+def _insert_sql(engine, table, columns):
+    # Requête INSERT paramétrée avec le style de paramètres du pilote
+    quote = engine.dialect.identifier_preparer.quote
+    placeholder = '?' if engine.dialect.paramstyle == 'qmark' else '%s'
+    return (f"INSERT INTO {quote(table)} ({', '.join(quote(c) for c in columns)}) "
+            f"VALUES ({', '.join([placeholder] * len(columns))})")
+
+
+def _write_executemany(engine, chunk, table):
+    # Un seul executemany par bloc : mysql-connector le réécrit en INSERT multi-lignes
+    with engine.begin() as conn:
+        conn.exec_driver_sql(_insert_sql(engine, table, chunk.columns), _rows(chunk))
+
+
+def _write_load_data(engine, chunk, table):
+    # Écrire le bloc dans un CSV temporaire puis le charger côté serveur avec LOAD DATA LOCAL INFILE
+    quote = engine.dialect.identifier_preparer.quote
+    chunk = chunk.copy()
+    for col in chunk.columns:
+        if pd.api.types.is_bool_dtype(chunk[col]):
+            chunk[col] = chunk[col].astype('int8')
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8', newline='') as file:
+        chunk.to_csv(file, index=False, header=False, na_rep='NULL', quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+    try:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                f"LOAD DATA LOCAL INFILE '{file.name}' INTO TABLE {quote(table)} CHARACTER SET utf8mb4 "
+                f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' LINES TERMINATED BY '\\n' "
+                f"({', '.join(quote(c) for c in chunk.columns)})")
+    finally:
+        os.remove(file.name)
+
+
+class BulkWriter:
+    # Écriture en masse d'un DataFrame dans une table, éventuellement répartie sur plusieurs connexions
+    def __init__(self, engine, strategy='executemany', chunksize=10000, workers=1):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Stratégie d'écriture inconnue : {strategy} (attendu : {', '.join(STRATEGIES)})")
+        self.engine = engine
+        self.strategy = strategy
+        self.chunksize = chunksize
+        self.workers = max(int(workers), 1)
+        self._load_engine = None
+        # Tables déjà créées par ce writer : la création n'est tentée qu'au premier write de chaque table
+        self._tables = set()
+        if strategy == 'load_data':
+            if engine.dialect.name != 'mysql':
+                print(f"{_now()} - [INIT]: LOAD DATA indisponible pour {engine.dialect.name}, repli sur executemany")
+                self.strategy = 'executemany'
+            else:
+                self._load_engine = sqlalchemy.create_engine(engine.url, connect_args={'allow_local_infile': True},
+                                                             pool_size=self.workers)
+        # LOAD DATA n'est tenté sur plusieurs connexions qu'une fois accepté par le serveur
+        self._load_data_checked = False
+
+    def _write_chunk(self, chunk, table):
+        if self.strategy == 'load_data':
+            return _write_load_data(self._load_engine, chunk, table)
+        _write_executemany(self.engine, chunk, table)
+
+    def _check_load_data(self, chunk, table):
+        # Premier bloc écrit seul, avant le pool de threads : le repli sur executemany est décidé ici une fois pour toutes
+        self._load_data_checked = True
+        try:
+            _write_load_data(self._load_engine, chunk, table)
+        except sqlalchemy.exc.DBAPIError as e:
+            errno = getattr(e.orig, 'errno', None)
+            if errno is None and e.orig is not None and e.orig.args:
+                errno = e.orig.args[0]
+            if errno not in LOAD_DATA_DISABLED_ERRORS:
+                raise
+            # local_infile désactivé côté serveur ou client : on bascule définitivement
+            print(f"{_now()} - [INIT]: LOAD DATA refusé ({e.orig}), repli sur executemany")
+            self.strategy = 'executemany'
+            _write_executemany(self.engine, chunk, table)
+
+    def _write_slice(self, dataframe, table):
+        for i in range(0, len(dataframe), self.chunksize):
+            self._write_chunk(dataframe.iloc[i:i + self.chunksize], table)
+        return len(dataframe)
+
+    def write(self, dataframe, table):
+        start = time.time()
+        # Créer la table à partir des colonnes du DataFrame si elle n'existe pas encore
+        if table not in self._tables:
+            dataframe.head(0).to_sql(name=table, con=self.engine, if_exists='append', index=False)
+            self._tables.add(table)
+        rows = 0
+        if self.strategy == 'load_data' and not self._load_data_checked and len(dataframe):
+            first = dataframe.iloc[:self.chunksize]
+            self._check_load_data(first, table)
+            rows, dataframe = len(first), dataframe.iloc[len(first):]
+        if self.workers == 1 or len(dataframe) <= self.chunksize:
+            rows += self._write_slice(dataframe, table)
+        else:
+            # Chaque connexion possède une tranche contiguë du DataFrame
+            bounds = [len(dataframe) * i // self.workers for i in range(self.workers + 1)]
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                rows += sum(pool.map(lambda b: self._write_slice(dataframe.iloc[b[0]:b[1]], table),
+                                     zip(bounds[:-1], bounds[1:])))
+        elapsed = time.time() - start
+        stats = {'table': table, 'rows': rows, 'seconds': elapsed, 'rows_per_sec': rows / elapsed if elapsed else 0.0,
+                 'strategy': self.strategy, 'workers': self.workers}
+        print(f"{_now()} - [INIT]: {rows} rows written to {table} in {elapsed:.1f}s "
+              f"({stats['rows_per_sec']:.0f} rows/s, {self.strategy} x{self.workers})")
+        return stats
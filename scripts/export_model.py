@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import pickle
+import tempfile
+import numpy as np
+from sqlalchemy import create_engine
+from sklearn.model_selection import train_test_split
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'App'))
+from model_artifact import save_artifact, load_artifact  # noqa: E402
+
+# Charger les variables d'environnement
+load_dotenv()
+
+MODEL_PATH = os.getenv('MODEL_PATH', 'model.pkl')
+# Noms des variables produites par le prétraitement, déduits du modèle si le fichier n'est pas donné
+MODEL_COLUMNS = os.getenv('MODEL_COLUMNS')
+MODEL_ARTIFACT = os.getenv('MODEL_ARTIFACT', os.path.splitext(MODEL_PATH)[0] + '.joblib')
+# Compactage optionnel de la forêt : profondeur maximale et seuils/valeurs en float32
+ARTIFACT_MAX_DEPTH = int(os.getenv('ARTIFACT_MAX_DEPTH')) if os.getenv('ARTIFACT_MAX_DEPTH') else None
+ARTIFACT_FLOAT32 = os.getenv('ARTIFACT_FLOAT32', '0') == '1'
+# Nombre de transactions de test utilisées pour le rapport
+ARTIFACT_EVAL_ROWS = int(os.getenv('ARTIFACT_EVAL_ROWS', 100000))
+
+# Variantes comparées dans le rapport : (nom, profondeur maximale, float32)
+VARIANTS = [
+    ('complet', None, False),
+    ('float32', None, True),
+    ('profondeur 20, float32', 20, True),
+    ('profondeur 15, float32', 15, True),
+    ('profondeur 10, float32', 10, True),
+]
+
+
+def feature_columns(model, columns_path=MODEL_COLUMNS):
+    # Noms des variables après prétraitement (models/columns.pkl pour le modèle livré)
+    if columns_path:
+        with open(columns_path, 'rb') as f:
+            return list(pickle.load(f))
+    try:
+        return list(model[:-1].get_feature_names_out())
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def report(model, X, y, variants=VARIANTS):
+    # Taille, temps de chargement, écart au modèle d'origine et erreur de chaque variante
+    reference = model.predict(X)
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'model.pkl')
+        with open(path, 'wb') as f:
+            pickle.dump(model, f)
+        start = time.perf_counter()
+        with open(path, 'rb') as f:
+            pickle.load(f)
+        rows.append(('pickle', os.path.getsize(path), time.perf_counter() - start, 0.0,
+                     np.mean((reference - y) ** 2)))
+        for name, max_depth, float32 in variants:
+            path = os.path.join(directory, f"model-{len(rows)}.joblib")
+            save_artifact(model, path, max_depth=max_depth, float32=float32)
+            start = time.perf_counter()
+            artifact = load_artifact(path)
+            load_seconds = time.perf_counter() - start
+            predictions = artifact.predict(X)
+            rows.append((name, os.path.getsize(path), load_seconds, np.max(np.abs(predictions - reference)),
+                         np.mean((predictions - y) ** 2)))
+    print(f"{'format':<25} {'taille (MB)':>12} {'chargement (ms)':>16} {'écart max':>12} {'MSE':>16}")
+    for name, size, load_seconds, delta, mse in rows:
+        print(f"{name:<25} {size / 1e6:>12.2f} {load_seconds * 1000:>16.1f} {delta:>12.2f} {mse:>16.0f}")
+    return rows
+
+
+def export_model(model, path=MODEL_ARTIFACT, columns=None, X=None, y=None,
+                 max_depth=ARTIFACT_MAX_DEPTH, float32=ARTIFACT_FLOAT32):
+    # Écrire l'artefact projetable en mémoire, précédé du rapport de compactage si des données de test sont fournies
+    if X is not None:
+        report(model, X, np.asarray(y, dtype=np.float64))
+    if columns is None:
+        columns = feature_columns(model)
+    save_artifact(model, path, columns=columns, max_depth=max_depth, float32=float32)
+    print(f"Artefact enregistré sous '{path}' ({os.path.getsize(path) / 1e6:.2f} MB).")
+    return path
+
+
+if __name__ == '__main__':
+    with open(MODEL_PATH, 'rb') as f:
+        model = pickle.load(f)
+    X = y = None
+    # Le rapport utilise les transactions de test quand le modèle est la forêt de script_model_transactions.py
+    # (import local : ce script importe export_model)
+    from script_model_transactions import FEATURES, load_transactions, prepare
+    if set(getattr(model, 'feature_names_in_', [])) <= set(FEATURES):
+        engine = create_engine(f"mysql+mysqlconnector://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+                               f"@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}")
+        X, y = prepare(load_transactions(engine))
+        _, X, _, y = train_test_split(X, y, test_size=0.2, random_state=42)
+        X, y = X[:ARTIFACT_EVAL_ROWS], y[:ARTIFACT_EVAL_ROWS]
+    export_model(model, MODEL_ARTIFACT, feature_columns(model), X, y)
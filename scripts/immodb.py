@@ -0,0 +1,339 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import inspect
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+from dotenv import load_dotenv
+import import_transactions
+import import_other_tables
+import rollups
+import quantile_sketches
+import spatial_index
+import price_tiles
+import export_model
+import script_model_transaction_meanMonth as forecasts
+import script_model_transactions as training
+from watermarks import file_hash, create_watermark_table, set_watermark, drop_table, swap_staging
+import schema
+from instrumentation import stage
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Dossier des points de reprise (Parquet) et de l'état du pipeline
+PIPELINE_DIR = os.getenv('PIPELINE_DIR', './data/pipeline')
+# Nombre d'étapes indépendantes exécutées en parallèle
+PIPELINE_WORKERS = int(os.getenv('PIPELINE_WORKERS', 2))
+STATE_FILE = 'state.json'
+
+# Base cible : la changer invalide les étapes qui y écrivent
+DATABASE = f"{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
+
+
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+
+
+def _slices(df, size):
+    for start in range(0, len(df), size):
+        yield df.iloc[start:start + size]
+
+
+def csv_sources():
+    directory = os.getenv('SOURCES_DIRECTORYCSV')
+    if not directory or not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith('.csv')]
+
+
+def load_transactions_table(df, source, table='transactions'):
+    # Rechargement complet : table de staging typée, échangée avec la table finale puis indexée.
+    # Le filigrane de la table est mis à jour comme par import_transactions_incremental, pour qu'un import
+    # incrémental ultérieur reparte de ce fichier.
+    engine = import_transactions.engine
+    staging = f"{table}_staging"
+    drop_table(engine, staging)
+    schema.create_transactions_table(engine, staging, indexes=False)
+    written = import_transactions.write_to_db(df, staging)['rows']
+    swap_staging(engine, staging, table)
+    schema.create_transactions_indexes(engine, table)
+    set_watermark(engine, table, file_hash(source), pd.to_datetime(df['date_transaction']).max(), written)
+    return {'rows': written}
+
+
+def build_rollups(df):
+    accumulator = rollups.RollupAccumulator()
+    for chunk in _slices(df, rollups.ROLLUP_CHUNKSIZE):
+        accumulator.update(chunk)
+    monthly, yearly = rollups.replace_rollups(import_transactions.engine, accumulator)
+    return {'monthly': len(monthly), 'yearly': len(yearly)}
+
+
+def build_spatial_index(df):
+    accumulator = spatial_index.SpatialAccumulator()
+    for chunk in _slices(df, spatial_index.SPATIAL_CHUNKSIZE):
+        accumulator.update(chunk)
+    manifest = spatial_index.replace_spatial_index(accumulator)
+    return {'years': len(manifest['partitions'])}
+
+
+def training_frame(df):
+    # Mêmes colonnes et mêmes types que la lecture en base de script_model_transactions.load_transactions
+    df = df.loc[pd.to_datetime(df['date_transaction']) >= training.TRAIN_SINCE, training.FEATURES + ['prix']]
+    return df.assign(vefa=df['vefa'].astype(int)).reset_index(drop=True)
+
+
+def train_model(df):
+    _, mse = training.train(import_transactions.engine, df=training_frame(df))
+    return {'mse': float(mse), 'model': training.MODEL_PATH, 'artifact': training.MODEL_ARTIFACT}
+
+
+class Task:
+    # Étape du pipeline. Sa clé est l'empreinte de son code, de ses paramètres, de ses fichiers sources et des clés
+    # des étapes dont elle dépend : elle ne change que si l'un d'eux change. `func` reçoit les DataFrame des étapes
+    # `deps` qui en produisent ; un DataFrame renvoyé est enregistré en Parquet, un dictionnaire dans l'état.
+    def __init__(self, name, func, deps=(), params=None, sources=None, modules=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.params = params or {}
+        self.sources = sources or (lambda: [])
+        self.modules = modules
+
+
+TASKS = {task.name: task for task in [
+    Task('read', lambda: import_transactions.read_transactions(os.getenv('SOURCES_TRANSACTIONS')),
+         sources=lambda: [os.getenv('SOURCES_TRANSACTIONS')], modules=[import_transactions]),
+    Task('clean', lambda read: import_transactions.clean_transactions(read, import_transactions.MIN_PRICE,
+                                                                      import_transactions.MAX_PRICE),
+         deps=['read'],
+         params={'MIN_PRICE': import_transactions.MIN_PRICE, 'MAX_PRICE': import_transactions.MAX_PRICE},
+         modules=[import_transactions]),
+    Task('write', lambda clean: load_transactions_table(clean, os.getenv('SOURCES_TRANSACTIONS')), deps=['clean'],
+         params={'DATABASE': DATABASE, 'TRANSACTIONS_PARTITIONED': schema.TRANSACTIONS_PARTITIONED},
+         modules=[import_transactions, schema]),
+    Task('rollups', lambda clean: build_rollups(clean), deps=['clean'], params={'DATABASE': DATABASE},
+         modules=[rollups, quantile_sketches]),
+    Task('spatial', lambda clean: build_spatial_index(clean), deps=['clean'],
+         params={'SPATIAL_INDEX_DIR': spatial_index.SPATIAL_INDEX_DIR,
+                 'SPATIAL_CELL_SIZE': spatial_index.SPATIAL_CELL_SIZE},
+         modules=[spatial_index]),
+    Task('tiles', lambda: price_tiles.refresh_price_tiles(), deps=['spatial'],
+         params={'TILES_DIR': price_tiles.TILES_DIR, 'zooms': price_tiles.pyramid_zooms()}, modules=[price_tiles]),
+    Task('loyers', lambda: {'files': len(import_other_tables.process_csv_files(os.getenv('SOURCES_DIRECTORYCSV')))},
+         params={'DATABASE': DATABASE}, sources=csv_sources, modules=[import_other_tables]),
+    Task('forecast', lambda: forecasts.run_forecasts(import_transactions.engine, incremental=False)[1],
+         deps=['rollups'],
+         params={'DATABASE': DATABASE, 'FORECAST_START': forecasts.FORECAST_START,
+                 'FORECAST_PERIODS': forecasts.FORECAST_PERIODS, 'FORECAST_MODEL': forecasts.FORECAST_MODEL},
+         modules=[forecasts]),
+    Task('train', lambda clean: train_model(clean), deps=['clean'],
+         params={'TRAIN_SINCE': training.TRAIN_SINCE, 'TRAIN_SEARCH': training.TRAIN_SEARCH,
+                 'TRAIN_CANDIDATES': training.TRAIN_CANDIDATES, 'TRAIN_MIN_SAMPLES': training.TRAIN_MIN_SAMPLES,
+                 'MODEL_PATH': training.MODEL_PATH, 'MODEL_ARTIFACT': training.MODEL_ARTIFACT},
+         modules=[training, export_model]),
+]}
+
+
+def read_state(directory=PIPELINE_DIR):
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(state, directory=PIPELINE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, STATE_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def source_hashes(paths, previous):
+    # Empreinte de chaque fichier source, recalculée seulement si sa taille ou sa date de modification a changé.
+    # Un fichier absent est ignoré ici : l'étape échouera en le lisant.
+    hashes = {}
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        info = os.stat(path)
+        known = previous.get(path)
+        if known and known['size'] == info.st_size and known['mtime_ns'] == info.st_mtime_ns:
+            hashes[path] = known
+        else:
+            hashes[path] = {'size': info.st_size, 'mtime_ns': info.st_mtime_ns, 'sha256': file_hash(path)}
+    return hashes
+
+
+def task_key(task, upstream_keys, sources):
+    digest = hashlib.sha256(task.name.encode('utf-8'))
+    digest.update(inspect.getsource(task.func).encode('utf-8'))
+    for module in task.modules:
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    digest.update(json.dumps(task.params, sort_keys=True, default=str).encode('utf-8'))
+    for dep in task.deps:
+        digest.update(upstream_keys[dep].encode('utf-8'))
+    for path, info in sorted(sources.items()):
+        digest.update(f"{os.path.basename(path)}:{info['sha256']}".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def selection(names):
+    # Étapes demandées et toutes celles dont elles dépendent, dans l'ordre du graphe
+    if not names:
+        return list(TASKS)
+    unknown = sorted(set(names) - set(TASKS))
+    if unknown:
+        raise ValueError(f"Étapes inconnues : {', '.join(unknown)} (disponibles : {', '.join(TASKS)})")
+    selected = set()
+
+    def visit(name):
+        if name not in selected:
+            selected.add(name)
+            for dep in TASKS[name].deps:
+                visit(dep)
+
+    for name in names:
+        visit(name)
+    return [name for name in TASKS if name in selected]
+
+
+def checkpoint_path(name, key, directory=PIPELINE_DIR):
+    return os.path.join(directory, f"{name}-{key[:16]}.parquet")
+
+
+def plan(names=None, force=(), directory=PIPELINE_DIR):
+    # Clé de chaque étape sélectionnée et étapes à exécuter : clé changée, point de reprise absent ou forcée
+    state = read_state(directory)
+    keys, sources, stale = {}, {}, []
+    for name in selection(names):
+        task = TASKS[name]
+        previous = state.get(name, {})
+        sources[name] = source_hashes(task.sources(), previous.get('sources', {}))
+        keys[name] = task_key(task, keys, sources[name])
+        up_to_date = previous.get('key') == keys[name] and \
+            (previous.get('checkpoint') is None or os.path.exists(previous['checkpoint']))
+        if not up_to_date or name in force or '*' in force:
+            stale.append(name)
+    return keys, sources, stale, state
+
+
+def run(names=None, force=(), workers=PIPELINE_WORKERS, directory=PIPELINE_DIR):
+    keys, sources, stale, state = plan(names, force, directory)
+    skipped = [name for name in keys if name not in stale]
+    for name in skipped:
+        print(f"{_now()} - [PIPELINE]: {name} up to date ({keys[name][:12]}), skipped")
+    if any('DATABASE' in TASKS[name].params for name in stale):
+        # Créée avant de lancer les étapes en parallèle, qui y enregistrent leur filigrane
+        create_watermark_table(import_transactions.engine)
+    frames = {}
+    failed = []
+    pending = list(stale)
+
+    def needed(name, running):
+        # Une étape restante ou en cours a encore besoin du DataFrame de `name`
+        return any(name in TASKS[p].deps for p in pending + list(running.values()))
+
+    def inputs(name):
+        # DataFrame des dépendances : gardés en mémoire s'ils viennent d'être calculés, sinon relus en Parquet
+        for dep in TASKS[name].deps:
+            if dep not in frames and state[dep].get('checkpoint'):
+                frames[dep] = pd.read_parquet(state[dep]['checkpoint'])
+        return [frames[dep] for dep in TASKS[name].deps if dep in frames]
+
+    def execute(name, frames_in):
+        with stage(f"pipeline/{name}", tag='PIPELINE') as s:
+            result = TASKS[name].func(*frames_in)
+        entry = {'key': keys[name], 'finished_at': _now(), 'seconds': s.record['wall_s'], 'checkpoint': None,
+                 'sources': sources[name]}
+        if isinstance(result, pd.DataFrame):
+            path = checkpoint_path(name, keys[name], directory)
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            result.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+            entry.update(checkpoint=path, rows=len(result))
+        elif result is not None:
+            entry['summary'] = json.loads(json.dumps(result, default=str))
+        if 'DATABASE' in TASKS[name].params:
+            # Filigrane de l'étape : le jeton de fraîcheur lu par le dashboard change avec les tables écrites
+            rows = entry.get('rows') or (result.get('rows', 0) if isinstance(result, dict) else 0)
+            set_watermark(import_transactions.engine, f"pipeline/{name}", keys[name], None, rows)
+        return result, entry
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        running = {}
+        while pending or running:
+            # Soumettre les étapes dont toutes les dépendances sont terminées
+            for name in [p for p in pending if not any(dep in pending for dep in TASKS[p].deps)
+                         and not any(dep in running.values() for dep in TASKS[p].deps)]:
+                pending.remove(name)
+                running[pool.submit(execute, name, inputs(name))] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    result, entry = future.result()
+                except Exception as e:
+                    print(f"{_now()} - [PIPELINE]: {name} failed: {e}")
+                    # Les étapes qui en dépendent ne sont pas exécutées
+                    blocked = [p for p in pending if name in selection([p])]
+                    failed += [name] + blocked
+                    pending = [p for p in pending if p not in blocked]
+                    continue
+                previous = state.get(name, {}).get('checkpoint')
+                state[name] = entry
+                write_state(state, directory)
+                if previous and previous != entry['checkpoint'] and os.path.exists(previous):
+                    os.remove(previous)
+                if isinstance(result, pd.DataFrame):
+                    frames[name] = result
+            # Libérer les DataFrame dont plus aucune étape n'a besoin
+            for name in [f for f in frames if not needed(f, running)]:
+                del frames[name]
+    if failed:
+        print(f"{_now()} - [PIPELINE]: failed or not run: {', '.join(failed)}")
+    return stale, failed
+
+
+def status(names=None, directory=PIPELINE_DIR):
+    keys, _, stale, state = plan(names, (), directory)
+    print(f"{'étape':<10} {'dépend de':<18} {'état':<12} {'clé':<14} {'dernière exécution':<20} {'durée':>9}")
+    for name, key in keys.items():
+        entry = state.get(name, {})
+        seconds = f"{entry['seconds']:.1f}s" if 'seconds' in entry else '-'
+        print(f"{name:<10} {','.join(TASKS[name].deps) or '-':<18} {'à exécuter' if name in stale else 'à jour':<12} "
+              f"{key[:12]:<14} {entry.get('finished_at', '-'):<20} {seconds:>9}")
+    return stale
+
+
+if __name__ == '__main__':
+    # python scripts/immodb.py run [étape ...] [--force étape] | status [étape ...]
+    parser = argparse.ArgumentParser(prog='immodb', description="Pipeline d'import, d'agrégats et d'entraînement")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help="exécuter les étapes (toutes par défaut) et leurs dépendances")
+    run_parser.add_argument('stages', nargs='*', metavar='étape')
+    run_parser.add_argument('--force', action='append', default=[], metavar='étape',
+                            help="exécuter l'étape même si elle est à jour ('*' : toutes)")
+    run_parser.add_argument('--workers', type=int, default=PIPELINE_WORKERS)
+    status_parser = commands.add_parser('status', help="clé et état de chaque étape")
+    status_parser.add_argument('stages', nargs='*', metavar='étape')
+    args = parser.parse_args()
+    try:
+        if args.command == 'status':
+            status(args.stages)
+        else:
+            _, failed = run(args.stages, args.force, args.workers)
+            sys.exit(1 if failed else 0)
+    except ValueError as e:
+        parser.error(str(e))
@@ -1,10 +1,21 @@
 import time
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import sqlalchemy
-from sqlalchemy.orm import sessionmaker
-import configparser
 import os
 from dotenv import load_dotenv
+from db_writer import BulkWriter
+from watermarks import file_hash, create_watermark_table, get_watermark, set_watermark, drop_table, swap_staging
+from rollups import refresh_loyers_rollup
+from instrumentation import log_in_out
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa_csv = None
 
 
 # Read the configuration file
@@ -13,28 +24,116 @@ load_dotenv()
 # Définir la connexion MySQL en utilisant SQLAlchemy
 db_url = f"mysql+mysqlconnector://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
 engine = sqlalchemy.create_engine(db_url)
-Session = sessionmaker(bind=engine)
+
+# Only reload CSVs whose content changed since the last import
+IMPORT_INCREMENTAL = os.getenv('IMPORT_INCREMENTAL', '0') == '1'
+
+# Parallel ingestion: number of files processed at once (each worker process holds at most one DB connection)
+# and number of workers writing to the database at the same time
+CSV_WORKERS = int(os.getenv('CSV_WORKERS', 1))
+CSV_DB_CONNECTIONS = int(os.getenv('CSV_DB_CONNECTIONS', 2))
+# Rows per chunk when streaming a CSV (0 reads each file at once) and CSV parser ('c' or 'pyarrow')
+CSV_CHUNKSIZE = int(os.getenv('CSV_CHUNKSIZE', 0))
+CSV_ENGINE = os.getenv('CSV_ENGINE', 'c')
+# Rows sampled to infer a schema, cached next to the CSVs so later runs skip inference
+CSV_SCHEMA_SAMPLE = 10000
+CSV_SCHEMA_CACHE = '.schemas.json'
+
+# Declared column dtypes per table, they take precedence over the inferred schema.
+# Codes are text: '2A'/'2B' for Corsica, leading zeros for the other departements.
+CSV_SCHEMAS = {
+    'loyers': {'departement': 'str'},
+}
 
 _start = time.time()
 
 
-def log_in_out(func):
-    # Decorator to log function calls
-    def decorated_func(*args, **kwargs):
-        start = time.time()
-        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))} - [INIT]: Enter {func.__name__}")
-        result = func(*args, **kwargs)
-        end = time.time()
-        print(
-            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(end))} - [INIT]: {func.__name__} done in {round(end - start)}s")
-        return result
-    return decorated_func
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+
+
+def _read_schema_cache(directory):
+    cache_path = os.path.join(directory, CSV_SCHEMA_CACHE)
+    if not os.path.exists(cache_path):
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+
+def store_schema(directory, table_name, schema):
+    cache = _read_schema_cache(directory)
+    cache[table_name] = schema
+    with open(os.path.join(directory, CSV_SCHEMA_CACHE), 'w') as f:
+        json.dump(cache, f, indent=2)
+
+
+def load_schema(directory, file_path, table_name):
+    # Column dtypes for a CSV: declared schema first, then the cache, then inference on a sample
+    cache = _read_schema_cache(directory)
+    if table_name not in cache:
+        sample = pd.read_csv(file_path, nrows=CSV_SCHEMA_SAMPLE)
+        # Numbers written with leading zeros are codes and stay text
+        text = pd.read_csv(file_path, nrows=CSV_SCHEMA_SAMPLE, dtype=str)
+        codes = {col for col in text.columns if text[col].str.match(r'0\d').any()}
+        # Integer columns become nullable so that a missing value further down the file does not break parsing
+        schema = {col: 'str' if col in codes else
+                  'Int64' if pd.api.types.is_integer_dtype(dtype) else
+                  'float64' if pd.api.types.is_float_dtype(dtype) else
+                  'boolean' if pd.api.types.is_bool_dtype(dtype) else 'str'
+                  for col, dtype in sample.dtypes.items()}
+        store_schema(directory, table_name, schema)
+        cache[table_name] = schema
+    return {**cache[table_name], **CSV_SCHEMAS.get(table_name, {})}
+
+
+def repair_schema(file_path, schema):
+    # The schema was inferred on a sample: the columns whose values do not all fit their dtype are read as text
+    repaired = dict(schema)
+    for column, dtype in schema.items():
+        if dtype == 'str':
+            continue
+        try:
+            pd.read_csv(file_path, usecols=[column], dtype={column: dtype})
+        except ValueError:
+            repaired[column] = 'str'
+    return repaired
+
+
+class SchemaError(ValueError):
+    # A value of the CSV does not fit the dtype given for its column
+    pass
+
+
+def _arrow_types(schema):
+    types = {'Int64': pa.int64(), 'float64': pa.float64(), 'boolean': pa.bool_(), 'str': pa.string()}
+    return {col: types[dtype] for col, dtype in schema.items() if dtype in types}
+
+
+def iter_csv(file_path, schema, chunksize=CSV_CHUNKSIZE, engine_name=CSV_ENGINE):
+    # Yield the CSV as DataFrames, in chunks of `chunksize` rows when it is set.
+    # Parse errors of both parsers are raised as SchemaError.
+    try:
+        yield from _iter_csv(file_path, schema, chunksize, engine_name)
+    except ValueError as e:
+        raise SchemaError(str(e)) from e
+
+
+def _iter_csv(file_path, schema, chunksize, engine_name):
+    if engine_name == 'pyarrow' and pa_csv is not None:
+        convert_options = pa_csv.ConvertOptions(column_types=_arrow_types(schema))
+        if not chunksize:
+            yield pa_csv.read_csv(file_path, convert_options=convert_options).to_pandas()
+            return
+        # The streaming reader works on byte blocks: assume about 128 bytes per row
+        read_options = pa_csv.ReadOptions(block_size=max(chunksize * 128, 1 << 20))
+        for batch in pa_csv.open_csv(file_path, read_options=read_options, convert_options=convert_options):
+            yield batch.to_pandas()
+        return
+    if not chunksize:
+        yield pd.read_csv(file_path, dtype=schema)
+        return
+    yield from pd.read_csv(file_path, dtype=schema, chunksize=chunksize)
 
-@log_in_out
-def read_csv(file_path):
-    # Read the CSV file and convert it to a DataFrame
-    df = pd.read_csv(file_path)
-    return df
 
 @log_in_out
 def clean_data(df):
@@ -42,30 +141,106 @@ def clean_data(df):
     # Implement any specific data cleaning here
     return df
 
-@log_in_out
-def write_to_db(dataframe, table_name):
-    session = Session()
+# Semaphore bounding the number of workers writing to the database at the same time
+_db_slots = None
+
+
+def _init_worker(db_slots):
+    global _db_slots, engine
+    _db_slots = db_slots
+    # Connections inherited from the parent process must not be reused,
+    # and the worker's own engine keeps a single connection
+    engine.dispose(close=False)
+    engine = sqlalchemy.create_engine(engine.url, pool_size=1, max_overflow=0)
+
+
+def import_csv_file(directory, file_name, schema):
+    # Read, clean and write one CSV through a staging table, returning its throughput figures
+    start = time.time()
+    file_path = os.path.join(directory, file_name)
+    table_name = os.path.splitext(file_name)[0]  # Use the file name (without extension) as table name
+    # Skip CSVs whose content has not changed since the last import
+    digest = file_hash(file_path)
+    watermark = get_watermark(engine, file_name) if IMPORT_INCREMENTAL else None
+    if watermark is not None and watermark['file_hash'] == digest:
+        print(f"{_now()} - [INIT]: {file_name} unchanged, skipped")
+        return {'file': file_name, 'rows': 0, 'bytes': 0, 'seconds': time.time() - start, 'skipped': True}
+    staging = f"{table_name}_staging"
+    repaired = None
     try:
-        dataframe.to_sql(name=table_name, con=engine, if_exists='replace', index=False)
-        session.commit()
+        try:
+            rows = _load_csv(file_path, schema, staging)
+        except SchemaError as e:
+            # The cached schema does not fit a value further down the file: retry with those columns as text
+            repaired = repair_schema(file_path, schema)
+            print(f"{_now()} - [INIT]: {file_name}: {e}, reading "
+                  f"{', '.join(c for c in schema if schema[c] != repaired[c])} as text")
+            rows = _load_csv(file_path, repaired, staging)
+        swap_staging(engine, staging, table_name)
     except Exception as e:
-        session.rollback()
+        drop_table(engine, staging)
         print(f"Error: {e}")
         raise
-    finally:
-        session.close()
+    set_watermark(engine, file_name, digest, None, rows)
+    return {'file': file_name, 'rows': rows, 'bytes': os.path.getsize(file_path),
+            'seconds': time.time() - start, 'skipped': False, 'schema': repaired}
+
+
+def _load_csv(file_path, schema, staging):
+    # Write the whole CSV to an empty staging table, returning the number of rows
+    drop_table(engine, staging)
+    writer = BulkWriter(engine, chunksize=10000)
+    rows = 0
+    for chunk in iter_csv(file_path, schema):
+        chunk = clean_data(chunk)
+        if _db_slots is not None:
+            with _db_slots:
+                writer.write(chunk, staging)
+        else:
+            writer.write(chunk, staging)
+        rows += len(chunk)
+    return rows
+
+
+def print_summary(results):
+    # Per-file throughput summary
+    print(f"{_now()} - [INIT]: CSV import summary")
+    print(f"{'file':<40} {'rows':>12} {'MB':>10} {'seconds':>10} {'rows/s':>12} {'MB/s':>8}")
+    for r in results:
+        if r['skipped']:
+            print(f"{r['file']:<40} {'skipped':>12}")
+            continue
+        seconds = max(r['seconds'], 1e-9)
+        mb = r['bytes'] / 1e6
+        print(f"{r['file']:<40} {r['rows']:>12} {mb:>10.1f} {r['seconds']:>10.1f} "
+              f"{r['rows'] / seconds:>12.0f} {mb / seconds:>8.1f}")
+
 
 @log_in_out
-def process_csv_files(directory):
-    for file_name in os.listdir(directory):
-        if file_name.endswith(".csv"):
-            file_path = os.path.join(directory, file_name)
-            table_name = os.path.splitext(file_name)[0]  # Use the file name (without extension) as table name
-            df = read_csv(file_path)
-            df = clean_data(df)
-            write_to_db(df, table_name)
-
-process_csv_files(config["sources"]["directorycsv"])
-
-print(
-    f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))} - [END INIT]: Data Import done in {round(time.time() - _start)}")
+def process_csv_files(directory, workers=CSV_WORKERS):
+    file_names = sorted(f for f in os.listdir(directory) if f.endswith(".csv"))
+    # Schemas are resolved up front so that workers never race on the cache file
+    schemas = [load_schema(directory, os.path.join(directory, f), os.path.splitext(f)[0]) for f in file_names]
+    if workers > 1 and len(file_names) > 1:
+        create_watermark_table(engine)
+        db_slots = multiprocessing.Semaphore(CSV_DB_CONNECTIONS)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_slots,)) as pool:
+            results = list(pool.map(import_csv_file, [directory] * len(file_names), file_names, schemas))
+    else:
+        results = [import_csv_file(directory, f, schema) for f, schema in zip(file_names, schemas)]
+    print_summary(results)
+    # Schemas repaired during the import replace their cached entry, so the next run parses at once
+    for r, file_name in zip(results, file_names):
+        if r.get('schema'):
+            store_schema(directory, os.path.splitext(file_name)[0], r['schema'])
+    # Rebuild the rents rollup read by the dashboard when the loyers table was reloaded
+    if any(os.path.splitext(r['file'])[0] == 'loyers' and not r['skipped'] for r in results):
+        refresh_loyers_rollup(engine)
+    return results
+
+
+if __name__ == '__main__':
+    process_csv_files(os.getenv('SOURCES_DIRECTORYCSV'))
+
+    print(
+        f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))} - [END INIT]: Data Import done in {round(time.time() - _start)}")
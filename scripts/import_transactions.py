@@ -1,61 +1,214 @@
 import time
 import os
+import struct
+import zipfile
 import numpy as np
 import pandas as pd
 import sqlalchemy
-from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
+from db_writer import BulkWriter
+from watermarks import file_hash, get_watermark, set_watermark, drop_table, swap_staging
+from rollups import RollupAccumulator, replace_rollups, refresh_rollups
+from spatial_index import SpatialAccumulator, replace_spatial_index, refresh_spatial_index
+from price_tiles import refresh_price_tiles
+from instrumentation import log_in_out
+from quantile_sketches import sketch_counts, merge_counts, quantiles
+from schema import TRANSACTIONS_COLUMNS, create_transactions_table, create_transactions_indexes
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
 
 # Charger les variables d'environnement
 load_dotenv()
 
 # Définir la connexion MySQL en utilisant SQLAlchemy
 db_url = f"mysql+mysqlconnector://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
-engine = sqlalchemy.create_engine(db_url)
-Session = sessionmaker(bind=engine)
+engine = sqlalchemy.create_engine(db_url, pool_size=int(os.getenv('WRITE_WORKERS', 1)))
 
 _start = time.time()
 
 
-def log_in_out(func):
-    # Décorateur pour enregistrer les appels de fonction
-    def decorated_func(*args, **kwargs):
-        start = time.time()
-        print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))} - [INIT]: Enter {func.__name__}")
-        result = func(*args, **kwargs)
-        end = time.time()
-        print(
-            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(end))} - [INIT]: {func.__name__} done in {round(end - start)}s")
-        return result
+# Colonnes texte à faible cardinalité décodées directement en catégories pandas
+CATEGORY_COLUMNS = ['ville', 'departement', 'type_batiment']
+# Nombre de lignes par bloc lors de la lecture en flux du fichier de transactions
+TRANSACTIONS_CHUNKSIZE = int(os.getenv('TRANSACTIONS_CHUNKSIZE', 1_000_000))
+# Paramètres de l'écriture en base : stratégie, taille des lots et nombre de connexions parallèles
+WRITE_STRATEGY = os.getenv('WRITE_STRATEGY', 'executemany')
+WRITE_CHUNKSIZE = int(os.getenv('WRITE_CHUNKSIZE', 10000))
+WRITE_WORKERS = int(os.getenv('WRITE_WORKERS', 1))
+# Nettoyage et écriture bloc par bloc, sans charger toutes les transactions en mémoire
+IMPORT_CHUNKED = os.getenv('IMPORT_CHUNKED', '0') == '1'
+# Import incrémental à partir du dernier filigrane, avec une marge pour les mutations publiées en retard
+IMPORT_INCREMENTAL = os.getenv('IMPORT_INCREMENTAL', '0') == '1'
+INCREMENTAL_OVERLAP_DAYS = int(os.getenv('INCREMENTAL_OVERLAP_DAYS', 180))
+# Seuils de l'import par blocs tirés de sketches de quantiles, en mémoire bornée quel que soit le volume
+OUTLIER_SKETCH = os.getenv('OUTLIER_SKETCH', '0') == '1'
+
+# Bornes des prix conservés par les imports lancés en script, appliquées avant le calcul des seuils
+# de valeurs absurdes (aucune par défaut)
+MIN_PRICE = float(os.getenv('MIN_PRICE', 0))
+MAX_PRICE = float(os.getenv('MAX_PRICE', 'inf'))
+
+# Colonnes inutiles supprimées avant l'écriture en base
+COLUMNS_TO_DROP = ['id_transaction', 'id_ville', 'code_postal', 'adresse', 'id_parcelle_cadastre',
+                   'surface_dependances', 'surface_locaux_industriels', 'surface_terrains_agricoles',
+                   'surface_terrains_sols', 'surface_terrains_nature']
+# Colonnes nécessaires au calcul des seuils de valeurs absurdes
+OUTLIER_COLUMNS = ['date_transaction', 'departement', 'prix', 'surface_habitable']
+
+
+def _open_npz(file):
+    # Projeter en mémoire (mmap) chaque tableau stocké sans compression dans le .npz,
+    # les autres tableaux sont chargés normalement
+    arrays = {}
+    with zipfile.ZipFile(file) as archive, open(file, 'rb') as raw:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            array = None
+            if info.compress_type == zipfile.ZIP_STORED:
+                # En-tête local du zip : 30 octets fixes + nom + champ extra
+                raw.seek(info.header_offset)
+                header = raw.read(30)
+                name_len, extra_len = struct.unpack('<HH', header[26:30])
+                raw.seek(info.header_offset + 30 + name_len + extra_len)
+                version = np.lib.format.read_magic(raw)
+                if version in ((1, 0), (2, 0)):
+                    read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) \
+                        else np.lib.format.read_array_header_2_0
+                    shape, fortran_order, dtype = read_header(raw)
+                    if not dtype.hasobject and np.prod(shape) > 0:
+                        array = np.memmap(file, dtype=dtype, mode='r', offset=raw.tell(), shape=shape,
+                                          order='F' if fortran_order else 'C')
+            if array is None:
+                with archive.open(info) as member:
+                    array = np.lib.format.read_array(member)
+            arrays[name] = array
+    return arrays
+
+
+class _StringColumn:
+    # Tableau uint8 de chaînes séparées par des octets nuls, décodé bloc par bloc
+    def __init__(self, blob, categorical):
+        self.blob = blob
+        self.categorical = categorical
+        self.pos = 0
+        self.avg_len = 16
+        self.categories = []
+        self.codes = {}
+
+    def take(self, n):
+        # Chercher les n prochains séparateurs en agrandissant la fenêtre si besoin
+        size = max(int(n * (self.avg_len + 1) * 1.25), 64)
+        while True:
+            window = np.asarray(self.blob[self.pos:self.pos + size])
+            seps = np.flatnonzero(window == 0)
+            if len(seps) >= n or self.pos + size >= len(self.blob):
+                break
+            size *= 2
+        if len(seps) >= n:
+            ends = seps[:n]
+            consumed = ends[-1] + 1
+        elif len(seps) == n - 1:
+            # Dernière chaîne du fichier, sans séparateur final
+            ends = np.append(seps, len(window))
+            consumed = len(window)
+        else:
+            raise ValueError(f"Colonne texte trop courte : {len(seps) + 1} valeurs restantes, {n} attendues")
+        starts = np.empty(n, dtype=np.int64)
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+        lengths = ends - starts
+        data = window[:consumed]
+        self.pos += consumed
+        self.avg_len = max(int(lengths.mean()), 1)
+        if self.categorical or pa is None:
+            return self._to_categorical(data, starts, lengths)
+        return self._to_arrow(data, starts, lengths)
+
+    def _to_categorical(self, data, starts, lengths):
+        # Matrice à largeur fixe complétée par des zéros, vue comme des bytes numpy 'S'
+        width = max(int(lengths.max()), 1)
+        if len(data) == 0:
+            data = np.zeros(1, dtype=np.uint8)
+        positions = starts[:, None] + np.arange(width)
+        padded = np.where(np.arange(width) < lengths[:, None],
+                          data[np.minimum(positions, len(data) - 1)], 0).astype(np.uint8)
+        uniques, inverse = np.unique(padded.view(f'S{width}').ravel(), return_inverse=True)
+        # Codes stables d'un bloc à l'autre : les nouvelles catégories sont ajoutées à la fin
+        lookup = np.empty(len(uniques), dtype=np.int32)
+        for i, value in enumerate(uniques):
+            value = value.decode('utf-8')
+            if value not in self.codes:
+                self.codes[value] = len(self.categories)
+                self.categories.append(value)
+            lookup[i] = self.codes[value]
+        return pd.Categorical.from_codes(lookup[inverse.ravel()], categories=list(self.categories))
+
+    def _to_arrow(self, data, starts, lengths):
+        # Supprimer les séparateurs : la chaîne i est décalée des i octets nuls qui la précèdent
+        offsets = np.empty(len(starts) + 1, dtype=np.int64)
+        offsets[:-1] = starts - np.arange(len(starts))
+        offsets[-1] = offsets[-2] + lengths[-1]
+        values = data[data != 0]
+        array = pa.LargeStringArray.from_buffers(len(starts), pa.py_buffer(offsets), pa.py_buffer(values))
+        array.validate(full=True)
+        return pd.arrays.ArrowExtensionArray(array)
 
-    return decorated_func
+
+def iter_transactions(file, chunksize=TRANSACTIONS_CHUNKSIZE, columns=None):
+    # Lire le fichier de transactions par blocs de lignes sans le charger entièrement en mémoire
+    arrays = _open_npz(file)
+    n_rows_array = next((v for v in arrays.values() if v.dtype != np.uint8), None)
+    if columns is not None:
+        # Seules les colonnes demandées sont décodées
+        arrays = {k: v for k, v in arrays.items() if k in columns}
+    strings = {k: _StringColumn(v, k in CATEGORY_COLUMNS) for k, v in arrays.items() if v.dtype == np.uint8}
+    numerics = {k: v for k, v in arrays.items() if v.dtype != np.uint8}
+    if n_rows_array is not None:
+        n_rows = len(n_rows_array)
+    else:
+        n_rows = int(np.count_nonzero(np.asarray(next(iter(strings.values()))) == 0)) + 1
+    for start in range(0, n_rows, chunksize):
+        n = min(chunksize, n_rows - start)
+        data = {k: strings[k].take(n) if k in strings else np.array(numerics[k][start:start + n])
+                for k in arrays}
+        yield pd.DataFrame(data, copy=False)
 
 
 @log_in_out
-def read_transactions(file):
+def read_transactions(file, chunksize=TRANSACTIONS_CHUNKSIZE):
     # Ouvrir le fichier de transactions et le convertir en DataFrame
-    arrays = dict(np.load(file))
-    data = {k: [s.decode("utf-8") for s in v.tobytes().split(b"\x00")] if v.dtype == np.uint8 else v for k, v in
-            arrays.items()}
-    df_trans = pd.DataFrame.from_dict(data)
+    chunks = list(iter_transactions(file, chunksize))
+    # Les catégories des premiers blocs sont un préfixe de celles du dernier : on les aligne avant de concaténer
+    for col in CATEGORY_COLUMNS:
+        if col in chunks[-1] and isinstance(chunks[-1][col].dtype, pd.CategoricalDtype):
+            categories = chunks[-1][col].cat.categories
+            for chunk in chunks[:-1]:
+                chunk[col] = chunk[col].cat.set_categories(categories)
+    df_trans = pd.concat(chunks, ignore_index=True)
     return df_trans
 
 
+def drop_unused_columns(df_transactions):
+    return df_transactions.drop(columns=[col for col in COLUMNS_TO_DROP if col in df_transactions.columns])
+
+
 @log_in_out
-def clean_transactions(df_transactions):
+def clean_transactions(df_transactions, min_price=0, max_price=np.inf):
     # Afficher les colonnes avant le nettoyage
     print("Colonnes avant le nettoyage: ", df_transactions.columns.tolist())
 
     # Supprimer les colonnes inutiles
-    columns_to_drop = ['id_transaction', 'id_ville', 'code_postal', 'adresse', 'id_parcelle_cadastre',
-                       'surface_dependances', 'surface_locaux_industriels', 'surface_terrains_agricoles',
-                       'surface_terrains_sols', 'surface_terrains_nature']
-    df_transactions = df_transactions.drop(columns=[col for col in columns_to_drop if col in df_transactions.columns])
+    df_transactions = drop_unused_columns(df_transactions)
 
     # Afficher les colonnes après la suppression des colonnes inutiles
     print("Colonnes après suppression des colonnes inutiles: ", df_transactions.columns.tolist())
 
     initial_len = len(df_transactions)
+    # Bornes de prix d'abord : les seuils de valeurs absurdes sont calculés sur les prix conservés
+    df_transactions = in_price_range(df_transactions, min_price, max_price)
     df_transactions = clean_transactions_absurd(df_transactions)
 
     # Vérifier les colonnes après le nettoyage des valeurs absurdes
@@ -66,46 +219,205 @@ def clean_transactions(df_transactions):
     return df_transactions
 
 
+def in_price_range(df_trans, min_price, max_price):
+    # Sans bornes, le DataFrame est renvoyé tel quel, sans copie
+    if min_price <= 0 and max_price == np.inf:
+        return df_trans
+    return df_trans[df_trans['prix'].between(min_price, max_price)]
+
+
+def _outlier_keys(df_trans):
+    # Prix au m² et clés de groupe (année, département), avec une seule conversion des dates
+    price_m2 = df_trans['prix'] / df_trans['surface_habitable']
+    year = pd.to_datetime(df_trans['date_transaction']).dt.year
+    return price_m2, year, df_trans['departement']
+
+
 @log_in_out
 def clean_transactions_absurd(df_trans):
-    # Calculer les statistiques moyennes
-    grouped_stats = df_trans.groupby([pd.to_datetime(df_trans['date_transaction']).dt.year, 'departement'])[
-        ['prix', 'surface_habitable']].apply(
-        lambda x: (x['prix'] / x['surface_habitable']).agg(['median', 'std'])).reset_index(drop=False)
-    # Créer une colonne year pour joindre `grouped_stats` et le DataFrame initial
-    df_trans['year'] = pd.to_datetime(df_trans['date_transaction']).dt.year
-    # Fusionner `grouped_stats` et le DataFrame initial
-    to_clean_df = pd.merge(df_trans, grouped_stats, left_on=['year', 'departement'],
-                           right_on=['date_transaction', 'departement'], suffixes=('', '_stats'))
-    # Supprimer les valeurs absurdes où le prix/m² est 3 fois plus que l'écart type
-    filtered_df = to_clean_df[
-        (to_clean_df['prix'] / to_clean_df['surface_habitable']) < to_clean_df['median'] + 3 * to_clean_df['std']]
-    # Supprimer les colonnes temporaires
-    filtered_df = filtered_df.drop(columns=['median', 'std', 'year', 'date_transaction_stats'])
-    return filtered_df
+    # Supprimer les valeurs absurdes où le prix/m² dépasse la médiane plus 3 fois l'écart type
+    # de son année et de son département, sans fusion ni copie intermédiaire
+    price_m2, year, departement = _outlier_keys(df_trans)
+    grouped = price_m2.groupby([year, departement], observed=True, sort=False)
+    threshold = grouped.transform('median') + 3 * grouped.transform('std')
+    return df_trans[price_m2 < threshold]
+
+
+class OutlierStats:
+    # Accumulateur fusionnable des prix au m² par (année, département) pour nettoyer bloc par bloc.
+    # Seuls les prix au m² sont conservés, la médiane et l'écart type restent donc exacts.
+    def __init__(self):
+        self.values = {}
+
+    def update(self, df_trans):
+        price_m2, year, departement = _outlier_keys(df_trans)
+        values = price_m2.to_numpy(dtype=np.float64)
+        for key, idx in price_m2.groupby([year, departement], observed=True).indices.items():
+            self.values.setdefault(key, []).append(values[idx])
+        return self
+
+    def merge(self, other):
+        for key, parts in other.values.items():
+            self.values.setdefault(key, []).extend(parts)
+        return self
+
+    def thresholds(self):
+        # Seuil par groupe : médiane + 3 écarts types (NaN pour un groupe d'une seule valeur)
+        keys, thresholds = [], []
+        for key, parts in self.values.items():
+            values = np.concatenate(parts)
+            values = values[~np.isnan(values)]
+            std = values.std(ddof=1) if len(values) > 1 else np.nan
+            keys.append(key)
+            thresholds.append(np.median(values) + 3 * std if len(values) else np.nan)
+        return pd.Series(thresholds, index=pd.MultiIndex.from_tuples(keys), dtype=np.float64)
+
+    def filter(self, df_trans, thresholds=None):
+        if thresholds is None:
+            thresholds = self.thresholds()
+        price_m2, year, departement = _outlier_keys(df_trans)
+        rows = pd.MultiIndex.from_arrays([year.to_numpy(), departement.to_numpy()])
+        return df_trans[price_m2.to_numpy() < thresholds.reindex(rows).to_numpy()]
+
+
+class OutlierSketches(OutlierStats):
+    # Variante à mémoire bornée : la médiane vient d'un sketch de quantiles (à SKETCH_RELATIVE_ACCURACY près
+    # en relatif), l'écart type reste exact grâce aux comptes, sommes et sommes des carrés
+    KEYS = ['year', 'departement']
+
+    def __init__(self):
+        self.counts = []
+        self.moments = []
+
+    def update(self, df_trans):
+        price_m2, year, departement = _outlier_keys(df_trans)
+        keys = pd.DataFrame({'year': year.to_numpy(), 'departement': departement.to_numpy()})
+        values = price_m2.to_numpy(dtype=np.float64)
+        self.counts.append(sketch_counts(keys, values))
+        valid = ~np.isnan(values)
+        moments = pd.DataFrame({'n': valid.astype(np.int64), 'sum': np.where(valid, values, 0),
+                                'sumsq': np.where(valid, values ** 2, 0)})
+        self.moments.append(moments.groupby([keys['year'], keys['departement']], observed=True).sum())
+        if len(self.counts) > 16:
+            self.counts = [merge_counts(self.counts, self.KEYS)]
+            self.moments = [pd.concat(self.moments).groupby(level=[0, 1]).sum()]
+        return self
+
+    def merge(self, other):
+        self.counts.extend(other.counts)
+        self.moments.extend(other.moments)
+        return self
+
+    def thresholds(self):
+        moments = pd.concat(self.moments).groupby(level=[0, 1]).sum()
+        n = moments['n']
+        std = np.sqrt(((moments['sumsq'] - moments['sum'] ** 2 / n) / (n - 1)).clip(lower=0)).where(n > 1)
+        median = quantiles(merge_counts(self.counts, self.KEYS), self.KEYS, (0.5,)).set_index(self.KEYS)['p50']
+        return (median.reindex(moments.index) + 3 * std).astype(np.float64)
 
 
 @log_in_out
-def write_to_db(dataframe, table, chunksize=10000):
-    session = Session()
-    try:
-        for i in range(0, len(dataframe), chunksize):
-            chunk = dataframe.iloc[i:i + chunksize]
-            chunk.to_sql(name=table, con=engine, if_exists='append', index=False)
-            session.commit()
-    except Exception as e:
-        session.rollback()
-        print(f"Error: {e}")
-        raise
-    finally:
-        session.close()
-
-
-# Chemin du fichier transactions
-transactions_file = os.getenv('SOURCES_TRANSACTIONS')
-df = read_transactions(transactions_file)
-df = clean_transactions(df)
-write_to_db(df, "transactions")
-
-print(
-    f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))} - [END INIT]: Data Import done in {round(time.time() - _start)}")
+def write_to_db(dataframe, table, chunksize=WRITE_CHUNKSIZE, strategy=WRITE_STRATEGY, workers=WRITE_WORKERS):
+    # Écriture en masse : INSERT multi-lignes ou LOAD DATA, sur une ou plusieurs connexions
+    writer = BulkWriter(engine, strategy=strategy, chunksize=chunksize, workers=workers)
+    return writer.write(dataframe, table)
+
+
+@log_in_out
+def import_transactions_chunked(file, table, chunksize=TRANSACTIONS_CHUNKSIZE, since=None, rollups=None, spatial=None,
+                                min_price=0, max_price=np.inf):
+    # Première passe : seuils par (année, département) à partir des seules colonnes utiles
+    stats = OutlierSketches() if OUTLIER_SKETCH else OutlierStats()
+    max_date, n_rows = None, 0
+    for chunk in iter_transactions(file, chunksize, columns=OUTLIER_COLUMNS):
+        stats.update(in_price_range(chunk, min_price, max_price))
+        chunk_max = pd.to_datetime(chunk['date_transaction']).max()
+        max_date = chunk_max if max_date is None or chunk_max > max_date else max_date
+        n_rows += len(chunk)
+    thresholds = stats.thresholds()
+    # Seconde passe : nettoyage et écriture de chaque bloc dès qu'il est décodé.
+    # Avec `since`, seules les transactions à partir de cette date sont écrites.
+    # Avec `rollups` et `spatial`, les agrégats mensuels et l'index spatial des lignes écrites sont alimentés au passage.
+    writer = BulkWriter(engine, strategy=WRITE_STRATEGY, chunksize=WRITE_CHUNKSIZE, workers=WRITE_WORKERS)
+    initial_len, written = 0, 0
+    for chunk in iter_transactions(file, chunksize):
+        if since is not None:
+            chunk = chunk[pd.to_datetime(chunk['date_transaction']) >= since]
+        initial_len += len(chunk)
+        chunk = stats.filter(in_price_range(drop_unused_columns(chunk), min_price, max_price), thresholds)
+        if rollups is not None:
+            rollups.update(chunk)
+        if spatial is not None:
+            spatial.update(chunk)
+        written += writer.write(chunk, table)['rows']
+    print(
+        f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))} - [INIT]: {initial_len - written} row suppressed! That represents {((initial_len - written) / max(written, 1)) * 100:.2f}% of data")
+    return {'rows': n_rows, 'written': written, 'max_date': max_date}
+
+
+@log_in_out
+def import_transactions_incremental(file, table, chunksize=TRANSACTIONS_CHUNKSIZE, min_price=0, max_price=np.inf):
+    # Import idempotent : rien n'est fait si le fichier n'a pas changé depuis le dernier filigrane,
+    # sinon les années à partir du dernier filigrane (moins INCREMENTAL_OVERLAP_DAYS) sont rechargées.
+    # Les seuils de nettoyage étant calculés par année, le résultat est identique à un rechargement complet.
+    digest = file_hash(file)
+    watermark = get_watermark(engine, table)
+    if watermark is not None and watermark['file_hash'] == digest:
+        print(
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))} - [INIT]: {file} unchanged since {watermark['imported_at']}, skipped")
+        return None
+    since = None
+    if watermark is not None and watermark['max_date'] is not None:
+        since = pd.Timestamp(watermark['max_date']) - pd.Timedelta(days=INCREMENTAL_OVERLAP_DAYS)
+        since = pd.Timestamp(year=since.year, month=1, day=1)
+    staging = f"{table}_staging"
+    drop_table(engine, staging)
+    # La staging est chargée sans index ; ceux de la table finale sont créés une fois l'échange fait
+    create_transactions_table(engine, staging, indexes=False)
+    rollups = RollupAccumulator()
+    spatial = SpatialAccumulator()
+    result = import_transactions_chunked(file, staging, chunksize, since=since, rollups=rollups, spatial=spatial,
+                                         min_price=min_price, max_price=max_price)
+    if since is None:
+        swap_staging(engine, staging, table)
+    else:
+        swap_staging(engine, staging, table, where="date_transaction >= :since",
+                     params={'since': since.strftime('%Y-%m-%d')}, columns=TRANSACTIONS_COLUMNS)
+    create_transactions_indexes(engine, table)
+    # Seules les partitions rechargées sont recalculées : (mois, département) pour les agrégats,
+    # années pour l'index spatial et la pyramide de prix
+    replace_rollups(engine, rollups, since)
+    replace_spatial_index(spatial, since)
+    refresh_price_tiles(since)
+    set_watermark(engine, table, digest, result['max_date'], result['rows'])
+    return result
+
+
+if __name__ == '__main__':
+    # Chemin du fichier transactions
+    transactions_file = os.getenv('SOURCES_TRANSACTIONS')
+    # Table typée et indexée créée avant le chargement (voir scripts/schema.py)
+    if not IMPORT_INCREMENTAL:
+        create_transactions_table(engine, "transactions")
+    if IMPORT_INCREMENTAL:
+        import_transactions_incremental(transactions_file, "transactions", min_price=MIN_PRICE, max_price=MAX_PRICE)
+    elif IMPORT_CHUNKED:
+        result = import_transactions_chunked(transactions_file, "transactions", min_price=MIN_PRICE,
+                                             max_price=MAX_PRICE)
+        # Filigrane à jour : un import incrémental ultérieur repart de ce fichier
+        set_watermark(engine, "transactions", file_hash(transactions_file), result['max_date'], result['rows'])
+        refresh_rollups(engine)
+        refresh_spatial_index(engine)
+        refresh_price_tiles()
+    else:
+        df = read_transactions(transactions_file)
+        n_rows, max_date = len(df), pd.to_datetime(df['date_transaction']).max()
+        df = clean_transactions(df, MIN_PRICE, MAX_PRICE)
+        write_to_db(df, "transactions")
+        set_watermark(engine, "transactions", file_hash(transactions_file), max_date, n_rows)
+        refresh_rollups(engine)
+        refresh_spatial_index(engine)
+        refresh_price_tiles()
+
+    print(
+        f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))} - [END INIT]: Data Import done in {round(time.time() - _start)}")
@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import functools
+import threading
+import cProfile
+import pstats
+import tracemalloc
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Fichier JSON lines où chaque étape ajoute une ligne de mesures, à activer (vide par défaut : mesures seulement
+# affichées et cumulées en mémoire)
+METRICS_FILE = os.getenv('METRICS_FILE', '')
+# Étapes profilées à la demande, séparées par des virgules ('*' : toutes), et dossier des profils
+PROFILE_STAGES = os.getenv('PROFILE_STAGES', '')
+TRACEMALLOC_STAGES = os.getenv('TRACEMALLOC_STAGES', '')
+PROFILE_DIR = os.getenv('PROFILE_DIR', './profiles')
+# Identifiant commun à toutes les étapes d'une exécution, pour comparer les exécutions entre elles
+RUN_ID = os.getenv('RUN_ID', f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+_lock = threading.Lock()
+# Un seul profileur actif à la fois : les étapes imbriquées dans une étape profilée ne le sont pas
+_profiling = threading.Event()
+# Cumul en mémoire par étape, pour les processus longs (application)
+totals = {}
+
+
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+
+
+def peak_rss_mb():
+    # Pic de mémoire résidente du processus depuis son démarrage
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _selected(name, stages):
+    stages = [s.strip() for s in stages.split(',') if s.strip()]
+    return '*' in stages or name in stages
+
+
+def _rows(value):
+    # Nombre de lignes d'un résultat : DataFrame, tableau, ou compteur renvoyé par les fonctions d'import
+    if isinstance(value, dict):
+        return value.get('written', value.get('rows'))
+    if isinstance(value, tuple):
+        return _rows(value[0]) if value else None
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)) and value.ndim:
+        return len(value)
+    return None
+
+
+class Stage:
+    # Mesures d'une étape ; `rows_in`, `rows_out` et des champs libres peuvent être renseignés pendant l'étape.
+    # Avec `persist=False`, la mesure n'est gardée que dans le cumul en mémoire, jamais écrite dans METRICS_FILE.
+    def __init__(self, name, tag='INIT', quiet=False, persist=True, **fields):
+        self.name = name
+        self.tag = tag
+        self.quiet = quiet
+        self.persist = persist
+        self.rows_in = None
+        self.rows_out = None
+        self.fields = fields
+        self.record = None
+
+    def __enter__(self):
+        if not self.quiet:
+            print(f"{_now()} - [{self.tag}]: Enter {self.name}")
+        self._profile = None
+        if _selected(self.name, PROFILE_STAGES) and not _profiling.is_set():
+            _profiling.set()
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._tracemalloc = _selected(self.name, TRACEMALLOC_STAGES) and not tracemalloc.is_tracing()
+        if self._tracemalloc:
+            tracemalloc.start()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        rows = self.rows_out if self.rows_out is not None else self.rows_in
+        record = {
+            'ts': _now(), 'run': RUN_ID, 'script': os.path.basename(sys.argv[0]), 'pid': os.getpid(),
+            'stage': self.name, 'status': 'error' if exc_type else 'ok',
+            'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4),
+            'rows_in': self.rows_in, 'rows_out': self.rows_out,
+            'rows_per_s': round(rows / wall) if rows and wall > 0 else None,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        if exc_type:
+            record['error'] = f"{exc_type.__name__}: {exc}"
+        if self._profile is not None:
+            self._profile.disable()
+            _profiling.clear()
+            record['profile'] = self._dump_profile()
+        if self._tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            record['tracemalloc_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+            tracemalloc.stop()
+            record['top_allocations'] = [str(s) for s in snapshot.statistics('lineno')[:10]]
+        record.update(self.fields)
+        self.record = record
+        emit(record, quiet=self.quiet, tag=self.tag, persist=self.persist)
+        return False
+
+    def _dump_profile(self):
+        # Profil binaire (snakeviz, pstats) et les 30 fonctions les plus coûteuses en texte
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{self.name.replace('/', '_')}-{RUN_ID}.prof")
+        self._profile.dump_stats(path)
+        with open(os.path.splitext(path)[0] + '.txt', 'w') as f:
+            pstats.Stats(self._profile, stream=f).sort_stats('cumulative').print_stats(30)
+        return path
+
+
+def emit(record, quiet=False, tag='INIT', persist=True):
+    # Afficher l'étape, l'ajouter au fichier de mesures et au cumul en mémoire
+    with _lock:
+        total = totals.setdefault(record['stage'], {'count': 0, 'errors': 0, 'wall_s': 0.0, 'max_wall_s': 0.0})
+        total['count'] += 1
+        total['errors'] += record['status'] == 'error'
+        total['wall_s'] += record['wall_s']
+        total['max_wall_s'] = max(total['max_wall_s'], record['wall_s'])
+        if METRICS_FILE and persist:
+            with open(METRICS_FILE, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+    if quiet:
+        return
+    details = [f"cpu {record['cpu_s']:.1f}s"]
+    if record['rows_in'] is not None or record['rows_out'] is not None:
+        details.append(f"{record['rows_in'] if record['rows_in'] is not None else '?'} -> "
+                       f"{record['rows_out'] if record['rows_out'] is not None else '?'} rows")
+    if record['rows_per_s']:
+        details.append(f"{record['rows_per_s']} rows/s")
+    if record['peak_rss_mb'] is not None:
+        details.append(f"peak RSS {record['peak_rss_mb']} MB")
+    print(f"{_now()} - [{tag}]: {record['stage']} {'done' if record['status'] == 'ok' else 'failed'} in "
+          f"{record['wall_s']:.1f}s ({', '.join(details)})")
+
+
+def stage(name, tag='INIT', quiet=False, **fields):
+    # Contexte mesurant un bloc de code : `with stage('Lecture') as s: ...; s.rows_out = len(df)`
+    return Stage(name, tag=tag, quiet=quiet, **fields)
+
+
+def log_in_out(func=None, name=None, tag='INIT', quiet=False, persist=True):
+    # Décorateur mesurant chaque appel de la fonction. Les lignes en entrée sont déduites du premier
+    # argument, celles en sortie du résultat (DataFrame, tableau, entier ou dictionnaire {'rows', 'written'}).
+    if func is None:
+        return functools.partial(log_in_out, name=name, tag=tag, quiet=quiet, persist=persist)
+
+    @functools.wraps(func)
+    def decorated_func(*args, **kwargs):
+        with Stage(name or func.__name__, tag=tag, quiet=quiet, persist=persist) as s:
+            if args:
+                s.rows_in = _rows(args[0])
+            result = func(*args, **kwargs)
+            # Les fonctions d'écriture renvoient le nombre de lignes écrites
+            s.rows_out = result if type(result) is int else _rows(result)
+            if isinstance(result, dict) and 'rows' in result:
+                s.rows_in = result['rows']
+        return result
+
+    return decorated_func
+
+
+def timed_callback(func):
+    # Durée de chaque appel d'un callback Dash, cumulée en mémoire (GET /api/metrics) : ni affichée, ni écrite
+    # sur disque, pour que le fichier de mesures ne grossisse pas avec le trafic
+    return log_in_out(func, name=f"callback/{func.__name__}", tag='APP', quiet=True, persist=False)
+
+
+def _seconds(value):
+    return '-' if value is None else f"{value:.2f}s"
+
+
+def compare(path=METRICS_FILE, base=None, run=None):
+    # Durée de chaque étape entre deux exécutions (par défaut les deux dernières du fichier)
+    runs = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            stages = runs.setdefault(record['run'], {})
+            stages[record['stage']] = stages.get(record['stage'], 0.0) + record['wall_s']
+    order = list(runs)
+    if len(order) < 2 and (base is None or run is None):
+        print(f"{path} ne contient qu'une exécution.")
+        return []
+    base, run = base or order[-2], run or order[-1]
+    rows = []
+    print(f"{'étape':<45} {base[:18]:>18} {run[:18]:>18} {'écart':>8}")
+    for name in sorted(set(runs[base]) | set(runs[run])):
+        before, after = runs[base].get(name), runs[run].get(name)
+        change = (after - before) / before * 100 if before and after is not None else None
+        rows.append((name, before, after, change))
+        print(f"{name:<45} {_seconds(before):>18} {_seconds(after):>18} "
+              f"{'' if change is None else f'{change:+.0f}%':>8}")
+    return rows
+
+
+if __name__ == '__main__':
+    # Comparer les deux dernières exécutions, ou celles données en arguments
+    if not sys.argv[1:2] and not METRICS_FILE:
+        sys.exit("METRICS_FILE n'est pas défini : donner le fichier de mesures en argument")
+    compare(*sys.argv[1:2] or [METRICS_FILE], *sys.argv[2:4])
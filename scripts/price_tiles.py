@@ -0,0 +1,158 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from spatial_index import (SPATIAL_INDEX_DIR, MappedPartitions, SpatialIndex, read_manifest, write_manifest,
+                           write_partition)
+from instrumentation import log_in_out
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Pyramide de prix au m², une partition par année, calculée à partir de l'index spatial
+TILES_DIR = os.getenv('TILES_DIR', './data/tiles')
+# Niveaux de zoom de la carte couverts par la pyramide : un niveau de grille tous les TILE_ZOOM_STEP zooms,
+# qui sert tous les zooms jusqu'au niveau suivant
+TILE_MIN_ZOOM = int(os.getenv('TILE_MIN_ZOOM', 5))
+TILE_MAX_ZOOM = int(os.getenv('TILE_MAX_ZOOM', 16))
+TILE_ZOOM_STEP = int(os.getenv('TILE_ZOOM_STEP', 2))
+# Nombre maximal de cellules renvoyées pour une vue : au-delà, un niveau plus grossier est utilisé
+TILE_MAX_CELLS = int(os.getenv('TILE_MAX_CELLS', 4000))
+
+# Clé de tri d'une cellule : type de bâtiment dans les bits de poids fort, puis ligne et colonne de la grille
+TYPE_SHIFT = 48
+
+
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+
+
+def cell_size(zoom):
+    # Environ 32 cellules par tuile de carte de 256 pixels, soit une cellule de 8 pixels
+    return 360 / 2 ** (zoom + 5)
+
+
+def _grid(size):
+    return int(np.ceil(360 / size))
+
+
+def pyramid_zooms(min_zoom=TILE_MIN_ZOOM, max_zoom=TILE_MAX_ZOOM, step=TILE_ZOOM_STEP):
+    return list(range(min_zoom, max_zoom + 1, step))
+
+
+def build_pyramid(part, zooms=None):
+    # Nombre de ventes et prix moyen au m² par (niveau, type de bâtiment, cellule), pour une année
+    lat = np.asarray(part['lat'], dtype=np.float64)
+    lon = np.asarray(part['lon'], dtype=np.float64)
+    surface = np.asarray(part['surface'], dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prix_m2 = np.asarray(part['prix'], dtype=np.float64) / surface
+    valid = (surface > 0) & np.isfinite(prix_m2)
+    lat, lon, prix_m2 = lat[valid], lon[valid], prix_m2[valid]
+    types = np.asarray(part['type'], dtype=np.int64)[valid] << TYPE_SHIFT
+    zooms = pyramid_zooms() if zooms is None else zooms
+    keys, counts, means, levels = [], [], [], [0]
+    for zoom in zooms:
+        size = cell_size(zoom)
+        key = types + np.floor((lat + 90) / size).astype(np.int64) * _grid(size) \
+            + np.floor((lon + 180) / size).astype(np.int64)
+        unique, inverse = np.unique(key, return_inverse=True)
+        keys.append(unique)
+        count = np.bincount(inverse, minlength=len(unique))
+        counts.append(count.astype(np.int32))
+        means.append((np.bincount(inverse, weights=prix_m2, minlength=len(unique)) / count).astype(np.float32))
+        levels.append(levels[-1] + len(unique))
+    return {
+        'key': np.concatenate(keys), 'n': np.concatenate(counts), 'prix_m2': np.concatenate(means),
+        'levels': np.array(levels, dtype=np.int64), 'zooms': np.array(zooms, dtype=np.int64),
+        'types': np.asarray(part['types']),
+    }
+
+
+@log_in_out
+def refresh_price_tiles(since=None, spatial_dir=SPATIAL_INDEX_DIR, directory=TILES_DIR):
+    # Recalculer les années à partir de `since` (toutes si `since` vaut None) ; les autres sont conservées
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    if manifest is None or since is None:
+        partitions = {}
+    else:
+        partitions = {year: info for year, info in manifest['partitions'].items() if int(year) < since.year}
+    for year, part in sorted(SpatialIndex(spatial_dir).partitions().items()):
+        if since is not None and year < since.year:
+            continue
+        pyramid = build_pyramid(part)
+        folder = write_partition(directory, year, pyramid)
+        partitions[str(year)] = {'cells': int(pyramid['levels'][-1]), 'built_at': _now(), 'folder': folder}
+    manifest = write_manifest(directory, partitions)
+    print(f"{_now()} - [INIT]: price tiles updated ({sum(p['cells'] for p in partitions.values())} cells, "
+          f"{len(partitions)} years)")
+    return manifest
+
+
+class PriceTiles(MappedPartitions):
+    # Cellules de la pyramide visibles dans une vue de la carte
+    def __init__(self, directory=TILES_DIR):
+        super().__init__(directory)
+
+    def years(self):
+        return sorted(self.partitions())
+
+    def _cells(self, part, zoom, south, west, north, east, type_batiment):
+        # Lignes du niveau `zoom` dans le rectangle : une plage de clés par (type, ligne de la grille)
+        level = int(np.flatnonzero(part['zooms'] == zoom)[0])
+        lo, hi = part['levels'][level], part['levels'][level + 1]
+        keys = part['key'][lo:hi]
+        size = cell_size(zoom)
+        grid = _grid(size)
+        row_min, row_max = int(np.floor((south + 90) / size)), int(np.floor((north + 90) / size))
+        col_min, col_max = int(np.floor((west + 180) / size)), int(np.floor((east + 180) / size))
+        if type_batiment is None:
+            codes = np.arange(len(part['types']))
+        else:
+            codes = np.flatnonzero(np.isin(part['types'], np.atleast_1d(type_batiment)))
+        first = np.array([(code << TYPE_SHIFT) + row * grid + col_min for code in codes
+                          for row in range(row_min, row_max + 1)], dtype=np.int64)
+        if not len(first):
+            return np.array([], dtype=np.int64)
+        starts = np.searchsorted(keys, first, side='left')
+        ends = np.searchsorted(keys, first + (col_max - col_min), side='right')
+        return np.concatenate([np.arange(a, b) for a, b in zip(starts, ends)]) + lo
+
+    def viewport(self, south, west, north, east, zoom, year=None, type_batiment=None, max_cells=TILE_MAX_CELLS):
+        # Cellules du rectangle au niveau qui sert le zoom demandé, ou au premier niveau plus grossier qui tient
+        # dans `max_cells`. Les types de bâtiment et les années demandés sont fusionnés.
+        selected = [part for y, part in sorted(self.partitions().items())
+                    if year is None or y in np.atleast_1d(year)]
+        if not selected:
+            return pd.DataFrame(columns=['latitude', 'longitude', 'n', 'prix_m2']), None
+        zooms = sorted(set.intersection(*(set(part['zooms'].tolist()) for part in selected)))
+        candidates = [z for z in zooms if z <= zoom][::-1] or zooms[:1]
+        for level_zoom in candidates:
+            # Le nombre de lignes de la grille parcourues est borné avant de chercher les cellules
+            size = cell_size(level_zoom)
+            if (north - south) / size * len(selected) > max_cells and level_zoom != candidates[-1]:
+                continue
+            cells = [(part, self._cells(part, level_zoom, south, west, north, east, type_batiment))
+                     for part in selected]
+            if sum(len(rows) for _, rows in cells) <= max_cells:
+                break
+        grid = _grid(size)
+        frames = []
+        for part, rows in cells:
+            n = part['n'][rows]
+            frames.append(pd.DataFrame({'key': part['key'][rows] & ((1 << TYPE_SHIFT) - 1), 'n': n,
+                                        'prix_m2_sum': part['prix_m2'][rows] * n.astype(np.float64)}))
+        merged = pd.concat(frames).groupby('key', sort=False).sum().reset_index()
+        return pd.DataFrame({
+            'latitude': (merged['key'] // grid + 0.5) * size - 90,
+            'longitude': (merged['key'] % grid + 0.5) * size - 180,
+            'n': merged['n'],
+            'prix_m2': merged['prix_m2_sum'] / merged['n'],
+        }), level_zoom
+
+
+if __name__ == '__main__':
+    # Reconstruire toute la pyramide à partir de l'index spatial
+    refresh_price_tiles()
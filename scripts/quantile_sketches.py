@@ -0,0 +1,160 @@
+import os
+import sys
+import zlib
+import struct
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from dotenv import load_dotenv
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Sketches de quantiles fusionnables (à la DDSketch) : une valeur positive x est comptée dans le seau
+# i = ceil(log(x) / log(γ)), avec γ = (1 + α) / (1 - α). Tout quantile est alors connu à α près en relatif,
+# et fusionner deux sketches revient à additionner leurs comptes, seau par seau.
+SKETCH_RELATIVE_ACCURACY = float(os.getenv('SKETCH_RELATIVE_ACCURACY', 0.01))
+SKETCH_TABLE = 'transactions_sketches'
+SKETCH_KEYS = ['month', 'departement', 'type_batiment']
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+def _log_gamma(accuracy=SKETCH_RELATIVE_ACCURACY):
+    return np.log((1 + accuracy) / (1 - accuracy))
+
+
+def bucket_index(values, accuracy=SKETCH_RELATIVE_ACCURACY):
+    return np.ceil(np.log(values) / _log_gamma(accuracy)).astype(np.int32)
+
+
+def bucket_value(index, accuracy=SKETCH_RELATIVE_ACCURACY):
+    # Valeur représentative d'un seau, à α près en relatif de toutes celles qu'il contient
+    gamma = (1 + accuracy) / (1 - accuracy)
+    return 2 * gamma ** np.asarray(index, dtype=np.float64) / (gamma + 1)
+
+
+def sketch_counts(keys, values, accuracy=SKETCH_RELATIVE_ACCURACY):
+    # Comptes par (clés, seau) des valeurs strictement positives et finies : la forme fusionnable des sketches,
+    # qu'on additionne avec merge_counts
+    values = np.asarray(values, dtype=np.float64)
+    valid = np.isfinite(values) & (values > 0)
+    counts = keys[valid].reset_index(drop=True)
+    counts['bucket'] = bucket_index(values[valid], accuracy)
+    return counts.groupby(list(keys.columns) + ['bucket'], observed=True, sort=False).size() \
+        .rename('count').reset_index()
+
+
+def merge_counts(parts, keys):
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return pd.DataFrame(columns=list(keys) + ['bucket', 'count'])
+    return pd.concat(parts, ignore_index=True).groupby(list(keys) + ['bucket'], observed=True, sort=False)['count'] \
+        .sum().reset_index()
+
+
+def encode(buckets, counts):
+    # Seaux contigus du premier au dernier non vide : indice du premier seau, puis comptes compressés
+    buckets = np.asarray(buckets, dtype=np.int64)
+    first = int(buckets.min())
+    dense = np.zeros(int(buckets.max()) - first + 1, dtype='<u4')
+    np.add.at(dense, buckets - first, np.asarray(counts, dtype=np.uint32))
+    return struct.pack('<i', first) + zlib.compress(dense.tobytes())
+
+
+def decode(blob):
+    first, = struct.unpack('<i', blob[:4])
+    dense = np.frombuffer(zlib.decompress(blob[4:]), dtype='<u4')
+    buckets = np.flatnonzero(dense)
+    return buckets.astype(np.int32) + first, dense[buckets].astype(np.int64)
+
+
+def encode_frame(counts, keys=SKETCH_KEYS):
+    # Un sketch binaire par groupe, avec son nombre de valeurs : forme stockée en base.
+    # Les comptes denses de tous les groupes sont remplis en une fois, seule la compression reste par groupe.
+    counts = counts.sort_values(list(keys) + ['bucket'], kind='stable').reset_index(drop=True)
+    group = counts.groupby(list(keys), observed=True, sort=False).ngroup().to_numpy()
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]]) if len(group) else np.array([], dtype=np.int64)
+    buckets, values = counts['bucket'].to_numpy(dtype=np.int64), counts['count'].to_numpy(dtype=np.int64)
+    group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(group)]))
+    first = buckets[starts]
+    lengths = buckets[np.r_[starts[1:], len(buckets)] - 1] - first + 1 if len(starts) else first
+    offsets = np.r_[0, np.cumsum(lengths)]
+    dense = np.zeros(offsets[-1], dtype='<u4')
+    np.add.at(dense, offsets[group] + buckets - first[group], values.astype(np.uint32))
+    sketches = counts.iloc[starts][list(keys)].reset_index(drop=True)
+    sketches['n'] = np.add.reduceat(values, starts) if len(starts) else np.array([], dtype=np.int64)
+    sketches['sketch'] = [struct.pack('<i', int(f)) + zlib.compress(dense[a:b].tobytes())
+                          for f, a, b in zip(first, offsets[:-1], offsets[1:])]
+    return sketches
+
+
+def decode_frame(sketches, keys=SKETCH_KEYS):
+    # Comptes par (clés, seau) des sketches stockés, à fusionner selon n'importe quel regroupement
+    decoded = [decode(bytes(blob)) for blob in sketches['sketch']]
+    lengths = np.fromiter((len(b) for b, _ in decoded), dtype=np.int64, count=len(decoded))
+    counts = sketches[keys].iloc[np.repeat(np.arange(len(sketches)), lengths)].reset_index(drop=True)
+    counts['bucket'] = np.concatenate([b for b, _ in decoded]) if decoded else np.array([], dtype=np.int32)
+    counts['count'] = np.concatenate([c for _, c in decoded]) if decoded else np.array([], dtype=np.int64)
+    return counts
+
+
+def quantiles(counts, by, qs=QUANTILES, accuracy=SKETCH_RELATIVE_ACCURACY):
+    # Quantiles `qs` de chaque groupe `by`, après fusion des sketches du groupe : colonnes n, p10, p50...
+    merged = counts.groupby(list(by) + ['bucket'], observed=True, sort=True)['count'].sum().reset_index()
+    merged = merged[merged['count'] > 0].reset_index(drop=True)
+    # Les lignes sont triées par groupe : chaque groupe est une plage contiguë [first, last]
+    group = merged.groupby(list(by), observed=True, sort=True).ngroup().to_numpy()
+    first = np.flatnonzero(np.r_[True, group[1:] != group[:-1]]) if len(group) else np.array([], dtype=np.int64)
+    last = np.r_[first[1:] - 1, len(group) - 1] if len(group) else first
+    cumulative = merged['count'].to_numpy().cumsum()
+    base = np.where(first > 0, cumulative[first - 1], 0)
+    total = cumulative[last] - base
+    result = merged.iloc[first][list(by)].reset_index(drop=True)
+    result['n'] = total
+    values = bucket_value(merged['bucket'].to_numpy(), accuracy)
+    for q in qs:
+        # Valeurs de rangs floor et ceil de q * (n - 1), interpolées comme Series.quantile : chacune est
+        # à α près, l'interpolation aussi
+        rank = q * (total - 1)
+        lower = values[np.minimum(np.searchsorted(cumulative, base + np.floor(rank), side='right'), last)]
+        upper = values[np.minimum(np.searchsorted(cumulative, base + np.ceil(rank), side='right'), last)]
+        result[f"p{round(q * 100)}"] = lower + (rank - np.floor(rank)) * (upper - lower)
+    return result
+
+
+def read_sketches(engine, since=None, until=None, departements=None, types=None, table=SKETCH_TABLE):
+    # Sketches mensuels d'une période (mois 'AAAA-MM' inclus) et d'une sélection de départements et de types
+    conditions, params = [], {}
+    if since is not None:
+        conditions.append('month >= :since')
+        params['since'] = since
+    if until is not None:
+        conditions.append('month <= :until')
+        params['until'] = until
+    for column, values in (('departement', departements), ('type_batiment', types)):
+        if values:
+            names = [f"{column}{i}" for i in range(len(values))]
+            conditions.append(f"{column} IN ({', '.join(':' + n for n in names)})")
+            params.update(zip(names, values))
+    query = f"SELECT {', '.join(SKETCH_KEYS)}, n, sketch FROM {table}"
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    return pd.read_sql(sqlalchemy.text(query), engine, params=params)
+
+
+def yearly_quantiles(sketches, qs=QUANTILES):
+    # Quantiles du prix au m² par (année, département, type de bâtiment)
+    counts = decode_frame(sketches)
+    counts['year'] = counts['month'].str[:4].astype(int)
+    return quantiles(counts, ['year', 'departement', 'type_batiment'], qs)
+
+
+if __name__ == '__main__':
+    # python scripts/quantile_sketches.py [depuis AAAA-MM] [jusqu'à AAAA-MM] [département ...] :
+    # quantiles du prix au m² par type de bâtiment sur la sélection
+    engine = sqlalchemy.create_engine(f"mysql+mysqlconnector://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+                                      f"@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}")
+    args = sys.argv[1:]
+    sketches = read_sketches(engine, args[0] if len(args) > 0 else None, args[1] if len(args) > 1 else None,
+                             args[2:] or None)
+    print(quantiles(decode_frame(sketches), ['type_batiment'], (0.1, 0.25, 0.5, 0.75, 0.9)).to_string(index=False))
@@ -0,0 +1,169 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from watermarks import drop_table, swap_staging
+from instrumentation import log_in_out
+from quantile_sketches import SKETCH_TABLE, sketch_counts, merge_counts, encode_frame
+
+# Tables d'agrégats lues par le dashboard et les scripts d'entraînement
+MONTHLY_TABLE = 'transactions_monthly'
+YEARLY_TABLE = 'transactions_yearly'
+LOYERS_TABLE = 'loyers_yearly'
+
+ROLLUP_KEYS = ['departement', 'type_batiment']
+# Agrégats fusionnables : comptes, sommes, sommes des carrés, minimum et maximum
+ROLLUP_AGGREGATES = {
+    'n_transactions': 'sum',
+    'prix_sum': 'sum',
+    'prix_m2_count': 'sum',
+    'prix_m2_sum': 'sum',
+    'prix_m2_sumsq': 'sum',
+    'prix_m2_min': 'min',
+    'prix_m2_max': 'max',
+}
+ROLLUP_CHUNKSIZE = 500000
+# Clés des sketches de prix au m² tant qu'ils sont accumulés, le mois est formé à l'écriture
+SKETCH_PART_KEYS = ['year', 'month_num'] + ROLLUP_KEYS
+
+
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+
+
+def _with_ratios(rollup):
+    # Colonnes dérivées des agrégats : prix moyen, prix moyen au m² et écart type du prix au m²
+    rollup['prix_moyen'] = rollup['prix_sum'] / rollup['n_transactions']
+    rollup['prix_m2_moyen'] = rollup['prix_m2_sum'] / rollup['prix_m2_count']
+    variance = (rollup['prix_m2_sumsq'] - rollup['prix_m2_sum'] ** 2 / rollup['prix_m2_count']) \
+        / (rollup['prix_m2_count'] - 1)
+    rollup['prix_m2_std'] = np.sqrt(variance.clip(lower=0)).where(rollup['prix_m2_count'] > 1)
+    return rollup
+
+
+class RollupAccumulator:
+    # Agrégats mensuels par (mois, département, type de bâtiment), alimentés bloc par bloc
+    def __init__(self):
+        self.parts = []
+        self.sketch_parts = []
+
+    def update(self, df_trans):
+        date = pd.to_datetime(df_trans['date_transaction'])
+        prix = df_trans['prix'].astype(np.float64)
+        price_m2 = prix / df_trans['surface_habitable']
+        price_m2 = price_m2.where(np.isfinite(price_m2))
+        frame = pd.DataFrame({
+            'year': date.dt.year, 'month_num': date.dt.month,
+            'departement': df_trans['departement'], 'type_batiment': df_trans['type_batiment'],
+            'n_transactions': 1, 'prix_sum': prix,
+            'prix_m2_count': price_m2.notna().astype(np.int64), 'prix_m2_sum': price_m2.fillna(0),
+            'prix_m2_sumsq': (price_m2 ** 2).fillna(0), 'prix_m2_min': price_m2, 'prix_m2_max': price_m2,
+        })
+        part = frame.groupby(['year', 'month_num'] + ROLLUP_KEYS, observed=True).agg(ROLLUP_AGGREGATES)
+        part.index = part.index.set_levels([level.astype(str) for level in part.index.levels[2:]], level=[2, 3])
+        self.parts.append(part)
+        # Sketch de quantiles du prix au m², fusionnable comme les sommes
+        keys = frame[SKETCH_PART_KEYS].astype({'departement': str, 'type_batiment': str})
+        self.sketch_parts.append(sketch_counts(keys, price_m2.to_numpy(dtype=np.float64)))
+        if len(self.parts) > 16:
+            self.parts = [self._combined()]
+            self.sketch_parts = [merge_counts(self.sketch_parts, SKETCH_PART_KEYS)]
+        return self
+
+    def merge(self, other):
+        self.parts.extend(other.parts)
+        self.sketch_parts.extend(other.sketch_parts)
+        return self
+
+    def _combined(self):
+        if not self.parts:
+            return pd.DataFrame(columns=list(ROLLUP_AGGREGATES))
+        return pd.concat(self.parts).groupby(level=[0, 1, 2, 3]).agg(ROLLUP_AGGREGATES)
+
+    def monthly(self):
+        monthly = self._combined().reset_index()
+        monthly.insert(0, 'month', monthly['year'].astype(str) + '-' + monthly['month_num'].astype(str).str.zfill(2))
+        return _with_ratios(monthly)
+
+    def sketches(self):
+        # Un sketch par (mois, département, type de bâtiment), encodé pour la table SKETCH_TABLE
+        counts = merge_counts(self.sketch_parts, SKETCH_PART_KEYS)
+        counts.insert(0, 'month', counts['year'].astype(str) + '-' + counts['month_num'].astype(str).str.zfill(2))
+        return encode_frame(counts.drop(columns=['year', 'month_num']))
+
+
+def yearly_from_monthly(monthly):
+    yearly = monthly.groupby(['year'] + ROLLUP_KEYS).agg(ROLLUP_AGGREGATES).reset_index()
+    return _with_ratios(yearly)
+
+
+def _replace(engine, dataframe, table, where=None, params=None, dtype=None):
+    # Les nouvelles partitions passent par une table de staging puis remplacent les anciennes
+    staging = f"{table}_staging"
+    drop_table(engine, staging)
+    dataframe.to_sql(name=staging, con=engine, if_exists='replace', index=False, dtype=dtype)
+    swap_staging(engine, staging, table, where=where, params=params)
+
+
+@log_in_out
+def replace_rollups(engine, accumulator, since=None):
+    # Remplacer les partitions (mois, département) à partir de `since` (toutes si `since` vaut None).
+    # `since` doit être un 1er janvier pour que les agrégats annuels couvrent des années complètes.
+    monthly = accumulator.monthly()
+    yearly = yearly_from_monthly(monthly)
+    sketches = accumulator.sketches()
+    sketch_dtype = {'sketch': sqlalchemy.LargeBinary}
+    if since is None:
+        _replace(engine, monthly, MONTHLY_TABLE)
+        _replace(engine, yearly, YEARLY_TABLE)
+        _replace(engine, sketches, SKETCH_TABLE, dtype=sketch_dtype)
+    else:
+        month = {'month': since.strftime('%Y-%m')}
+        _replace(engine, monthly, MONTHLY_TABLE, where="month >= :month", params=month)
+        _replace(engine, yearly, YEARLY_TABLE, where="year >= :year", params={'year': since.year})
+        _replace(engine, sketches, SKETCH_TABLE, where="month >= :month", params=month, dtype=sketch_dtype)
+    print(f"{_now()} - [INIT]: rollups updated ({len(monthly)} monthly, {len(yearly)} yearly partitions, "
+          f"{len(sketches)} price sketches)")
+    return monthly, yearly
+
+
+@log_in_out
+def refresh_rollups(engine, since=None, table='transactions'):
+    # Recalculer les agrégats depuis la table des transactions, par blocs
+    query = f"SELECT date_transaction, departement, type_batiment, prix, surface_habitable FROM {table}"
+    params = {}
+    if since is not None:
+        query += " WHERE date_transaction >= :since"
+        params['since'] = since.strftime('%Y-%m-%d')
+    accumulator = RollupAccumulator()
+    for chunk in pd.read_sql(sqlalchemy.text(query), engine, params=params, chunksize=ROLLUP_CHUNKSIZE):
+        accumulator.update(chunk)
+    return replace_rollups(engine, accumulator, since)
+
+
+@log_in_out
+def refresh_loyers_rollup(engine, table='loyers'):
+    # Loyers moyens par année et département, calculés une fois à l'import
+    loyers = pd.read_sql(f"""
+    SELECT
+        date AS year,
+        departement,
+        AVG(loyer_m2_appartement) AS loyer_m2_appartement,
+        AVG(loyer_m2_maison) AS loyer_m2_maison
+    FROM {table}
+    GROUP BY date, departement
+    """, engine)
+    _replace(engine, loyers, LOYERS_TABLE)
+    return loyers
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    # Reconstruire tous les agrégats à partir des tables existantes
+    load_dotenv()
+    db_url = f"mysql+mysqlconnector://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
+    engine = sqlalchemy.create_engine(db_url)
+    refresh_rollups(engine)
+    refresh_loyers_rollup(engine)
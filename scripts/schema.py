@@ -0,0 +1,127 @@
+import os
+import time
+import datetime
+import sqlalchemy
+from sqlalchemy import Column, Index
+from dotenv import load_dotenv
+from watermarks import drop_table, swap_staging
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Partitionnement optionnel de la table des transactions par année (MySQL uniquement) : une partition par année
+# de TRANSACTIONS_PARTITION_FROM à TRANSACTIONS_PARTITION_TO, plus une partition pour les années suivantes
+TRANSACTIONS_PARTITIONED = os.getenv('TRANSACTIONS_PARTITIONED', '0') == '1'
+TRANSACTIONS_PARTITION_FROM = int(os.getenv('TRANSACTIONS_PARTITION_FROM', 2014))
+TRANSACTIONS_PARTITION_TO = int(os.getenv('TRANSACTIONS_PARTITION_TO', datetime.date.today().year + 1))
+
+TYPES_BATIMENT = ('Appartement', 'Maison')
+# Index composites : filtres par département sur une période, et filtres par date seule (entraînement, agrégats)
+TRANSACTIONS_INDEXES = {
+    'departement_date': ('departement', 'date_transaction'),
+    'date': ('date_transaction',),
+}
+
+
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+
+
+def transactions_table(name='transactions', partitioned=False, indexes=True):
+    # Colonnes écrites par les imports après nettoyage, avec des types compacts. Une clé primaire de table
+    # partitionnée doit contenir la colonne de partitionnement : la date y est alors ajoutée.
+    metadata = sqlalchemy.MetaData()
+    table = sqlalchemy.Table(
+        name, metadata,
+        Column('id', sqlalchemy.BigInteger().with_variant(sqlalchemy.Integer, 'sqlite'), primary_key=True,
+               autoincrement=True),
+        Column('date_transaction', sqlalchemy.Date, nullable=False, primary_key=partitioned),
+        Column('prix', sqlalchemy.Float(precision=53), nullable=False),
+        Column('departement', sqlalchemy.CHAR(3), nullable=False),
+        Column('ville', sqlalchemy.String(100)),
+        Column('type_batiment', sqlalchemy.Enum(*TYPES_BATIMENT, name='type_batiment'), nullable=False),
+        Column('vefa', sqlalchemy.Boolean),
+        Column('n_pieces', sqlalchemy.SmallInteger),
+        Column('surface_habitable', sqlalchemy.Integer),
+        Column('latitude', sqlalchemy.Float),
+        Column('longitude', sqlalchemy.Float),
+        mysql_engine='InnoDB', mysql_charset='utf8mb4',
+    )
+    if indexes:
+        for suffix, columns in TRANSACTIONS_INDEXES.items():
+            Index(f"ix_{name}_{suffix}", *columns, _table=table)
+    return table
+
+
+# Colonnes de données, recopiées d'une table à l'autre sans la clé générée
+TRANSACTIONS_COLUMNS = [column.name for column in transactions_table().columns if column.name != 'id']
+
+
+def partition_ddl(table, first_year=TRANSACTIONS_PARTITION_FROM, last_year=TRANSACTIONS_PARTITION_TO):
+    # RANGE par année : les requêtes filtrées sur date_transaction ne lisent que les partitions concernées
+    partitions = [f"PARTITION p{year} VALUES LESS THAN ({year + 1})" for year in range(first_year, last_year + 1)]
+    partitions.insert(0, f"PARTITION p_before VALUES LESS THAN ({first_year})")
+    partitions.append('PARTITION p_future VALUES LESS THAN MAXVALUE')
+    return f"ALTER TABLE `{table}` PARTITION BY RANGE (YEAR(date_transaction)) ({', '.join(partitions)})"
+
+
+def create_transactions_table(engine, name='transactions', partitioned=TRANSACTIONS_PARTITIONED, indexes=True):
+    # Créer la table typée avant le chargement ; une table existante est laissée telle quelle
+    if sqlalchemy.inspect(engine).has_table(name):
+        return False
+    partitioned = partitioned and engine.dialect.name == 'mysql'
+    table = transactions_table(name, partitioned, indexes)
+    table.metadata.create_all(engine)
+    if partitioned:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(partition_ddl(name))
+    print(f"{_now()} - [INIT]: table {name} created{' (partitioned by year)' if partitioned else ''}")
+    return True
+
+
+def create_transactions_indexes(engine, name='transactions'):
+    # Ajouter les index manquants, reconnus par leurs colonnes : une table de staging renommée garde les siens.
+    # Lecture et création sur la même connexion, qui voit ainsi le schéma à jour (SQLite garde un cache par
+    # connexion, périmé si une autre vient de supprimer la table).
+    created = []
+    with engine.begin() as conn:
+        existing = {tuple(index['column_names']) for index in sqlalchemy.inspect(conn).get_indexes(name)}
+        for index in transactions_table(name).indexes:
+            if tuple(column.name for column in index.columns) not in existing:
+                index.create(conn)
+                created.append(index.name)
+    return created
+
+
+def is_typed(engine, name='transactions'):
+    # Une table créée par to_sql n'a ni clé primaire ni index sur la date
+    inspector = sqlalchemy.inspect(engine)
+    return bool(inspector.get_pk_constraint(name)['constrained_columns']) and \
+        ('date_transaction',) in {tuple(index['column_names']) for index in inspector.get_indexes(name)}
+
+
+def migrate_transactions(engine, name='transactions', partitioned=TRANSACTIONS_PARTITIONED):
+    # Recopier une table créée implicitement par to_sql dans le schéma typé, puis l'échanger avec l'ancienne
+    if not sqlalchemy.inspect(engine).has_table(name):
+        return create_transactions_table(engine, name, partitioned)
+    if is_typed(engine, name):
+        print(f"{_now()} - [INIT]: table {name} already typed")
+        return False
+    staging = f"{name}_migration"
+    drop_table(engine, staging)
+    create_transactions_table(engine, staging, partitioned, indexes=False)
+    quote = engine.dialect.identifier_preparer.quote
+    columns = ', '.join(quote(c) for c in TRANSACTIONS_COLUMNS)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"INSERT INTO {quote(staging)} ({columns}) SELECT {columns} FROM {quote(name)}")
+    swap_staging(engine, staging, name)
+    create_transactions_indexes(engine, name)
+    print(f"{_now()} - [INIT]: table {name} migrated to the typed schema")
+    return True
+
+
+if __name__ == '__main__':
+    # Créer la table des transactions, ou migrer celle créée par une version précédente des imports
+    engine = sqlalchemy.create_engine(f"mysql+mysqlconnector://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+                                      f"@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}")
+    migrate_transactions(engine)
@@ -7,9 +7,14 @@ from sklearn.pipeline import Pipeline
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import mean_squared_error
 from sqlalchemy import create_engine
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import os
 from dotenv import load_dotenv
 import logging
+from db_writer import BulkWriter
+from watermarks import get_watermark, set_watermark, drop_table, swap_staging
+from instrumentation import stage
 
 # Configurer les logs
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,49 +27,137 @@ db_user = os.getenv('DB_USER')
 db_password = os.getenv('DB_PASSWORD')
 db_name = os.getenv('DB_NAME')
 
-# Charger les données
-logging.info("Chargement des données...")
-engine = create_engine(f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}/{db_name}")
-query = """
-SELECT 
-    DATE_FORMAT(date_transaction, '%Y-%m') AS month,
-    departement,
-    AVG(prix) AS prix_moyen
-FROM transactions
-GROUP BY month, departement
-"""
-df = pd.read_sql(query, engine)
-logging.info("Données chargées.")
-
-# Préparer les données
-logging.info("Préparation des données...")
-df['month'] = pd.to_datetime(df['month'])
-df['departement'] = df['departement'].astype(int)
-df['year'] = df['month'].dt.year
-df['month_num'] = df['month'].dt.month
-df['month'] = df['month'].dt.to_period('M').astype(str)
-
-# Générer les prédictions pour chaque département
-future_dates = pd.date_range(start='2024-01', periods=24, freq='M')
-future_months = future_dates.to_period('M').astype(str)
-departements = df['departement'].unique()
-all_predictions = []
-
-for dept in departements:
-    logging.info(f"Traitement du département {dept}...")
-    df_dept = df[df['departement'] == dept]
-
-    if len(df_dept) < 2:
-        logging.warning(f"Pas assez de données pour le département {dept}, ignoré.")
-        continue
-
-    X = df_dept[['year', 'month_num']]
+# Table lue par le dashboard pour les prévisions
+FORECAST_TABLE = 'prix_mensuel'
+# Horizon des prévisions
+FORECAST_START = os.getenv('FORECAST_START', '2024-01')
+FORECAST_PERIODS = int(os.getenv('FORECAST_PERIODS', 24))
+# 'linear' : moindres carrés vectorisés sur tous les départements ; 'pipeline' : pipeline sklearn par
+# département, réparti sur FORECAST_WORKERS processus
+FORECAST_MODEL = os.getenv('FORECAST_MODEL', 'linear')
+FORECAST_WORKERS = int(os.getenv('FORECAST_WORKERS', os.cpu_count() or 1))
+# Ne réentraîner que les départements dont les données mensuelles ont changé
+FORECAST_INCREMENTAL = os.getenv('FORECAST_INCREMENTAL', '0') == '1'
+
+FEATURES = ['year', 'month_num']
+
+
+def load_monthly(engine):
+    # Les agrégats mensuels sont maintenus à l'import dans transactions_monthly
+    query = """
+    SELECT
+        month,
+        departement,
+        SUM(prix_sum) / SUM(n_transactions) AS prix_moyen
+    FROM transactions_monthly
+    GROUP BY month, departement
+    """
+    df = pd.read_sql(query, engine)
+
+    # Préparer les données
+    df['month'] = pd.to_datetime(df['month'])
+    # Codes en texte : '2A'/'2B' pour la Corse, zéros en tête pour les autres départements
+    df['departement'] = df['departement'].astype(str)
+    df['year'] = df['month'].dt.year
+    df['month_num'] = df['month'].dt.month
+    df['month'] = df['month'].dt.to_period('M').astype(str)
+    return df
+
+
+def future_frame(departements):
+    # Mois à prévoir pour chaque département
+    future_periods = pd.period_range(start=FORECAST_START, periods=FORECAST_PERIODS, freq='M')
+    return pd.DataFrame({
+        'month': np.tile(future_periods.astype(str), len(departements)),
+        'year': np.tile(future_periods.year, len(departements)),
+        'month_num': np.tile(future_periods.month, len(departements)),
+        'departement': np.repeat(departements, len(future_periods)),
+    })
+
+
+def _r2(sse, sst, n):
+    # Coefficient de détermination avec les mêmes conventions que sklearn.metrics.r2_score
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r2 = 1 - sse / sst
+    r2 = np.where(sst == 0, np.where(sse == 0, 1.0, 0.0), r2)
+    return np.where(n < 2, np.nan, r2)
+
+
+def fit_linear_batched(df):
+    # StandardScaler + LinearRegression pour tous les départements à la fois : chaque département a sa
+    # propre standardisation et ses propres coefficients, obtenus par les équations normales empilées
+    df = df.sort_values('departement', kind='stable').reset_index(drop=True)
+    departements, g = np.unique(df['departement'].to_numpy(), return_inverse=True)
+    sizes = np.bincount(g)
+    position = np.arange(len(df)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+    # Même découpage entraînement/test que train_test_split(random_state=42) sur chaque département :
+    # il ne dépend que du nombre de lignes du département
+    is_test = np.zeros(len(df), dtype=bool)
+    row_sizes = sizes[g]
+    for n in np.unique(sizes[sizes >= 2]):
+        _, test_idx = train_test_split(np.arange(n), test_size=0.2, random_state=42)
+        test_mask = np.zeros(n, dtype=bool)
+        test_mask[test_idx] = True
+        rows = row_sizes == n
+        is_test[rows] = test_mask[position[rows]]
+    train = (~is_test).astype(np.float64)
+    fitted = sizes >= 2
+
+    def group_sum(values, weights=train):
+        return np.bincount(g, weights=values * weights, minlength=len(departements))
+
+    X = df[FEATURES].to_numpy(dtype=np.float64)
+    y = df['prix_moyen'].to_numpy(dtype=np.float64)
+    n_train = group_sum(np.ones(len(df)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.stack([group_sum(X[:, j]) / n_train for j in range(X.shape[1])], axis=1)
+        std = np.sqrt(np.stack([group_sum((X[:, j] - mean[g, j]) ** 2) / n_train for j in range(X.shape[1])], axis=1))
+        y_mean = group_sum(y) / n_train
+    std = np.where((std == 0) | ~np.isfinite(std), 1.0, std)
+
+    # Équations normales sur les variables centrées réduites : (Zᵀ Z) β = Zᵀ (y - ȳ)
+    Z = (X - mean[g]) / std[g]
+    yc = y - y_mean[g]
+    ZtZ = np.stack([np.stack([group_sum(Z[:, i] * Z[:, j]) for j in range(Z.shape[1])], axis=1)
+                    for i in range(Z.shape[1])], axis=1)
+    Zty = np.stack([group_sum(Z[:, i] * yc) for i in range(Z.shape[1])], axis=1)
+    coef = np.zeros_like(Zty)
+    coef[fitted] = np.einsum('gij,gj->gi', np.linalg.pinv(ZtZ[fitted]), Zty[fitted])
+
+    # Scores et erreur quadratique moyenne par département
+    pred = y_mean[g] + np.einsum('ij,ij->i', Z, coef[g])
+    test = 1 - train
+    n_test = group_sum(np.ones(len(df)), test)
+    metrics = pd.DataFrame({'departement': departements, 'n': sizes})
+    for name, weights, count in [('train_score', train, n_train), ('test_score', test, n_test)]:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_y = group_sum(y, weights) / count
+        sse = group_sum((y - pred) ** 2, weights)
+        sst = group_sum((y - mean_y[g]) ** 2, weights)
+        metrics[name] = _r2(sse, sst, count)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics['mse'] = group_sum((y - pred) ** 2, test) / n_test
+    metrics = metrics[fitted].reset_index(drop=True)
+
+    # Prévisions pour tous les départements en une seule opération
+    future = future_frame(departements[fitted])
+    fg = np.repeat(np.flatnonzero(fitted), FORECAST_PERIODS)
+    Zf = (future[FEATURES].to_numpy(dtype=np.float64) - mean[fg]) / std[fg]
+    future['prix_moyen'] = y_mean[fg] + np.einsum('ij,ij->i', Zf, coef[fg])
+    return metrics, future
+
+
+def fit_departement(df_dept):
+    # Pipeline sklearn d'origine pour un département, utilisé pour des modèles plus lourds
+    dept = df_dept['departement'].iloc[0]
+    X = df_dept[FEATURES]
     y = df_dept['prix_moyen']
 
     # Pipeline de prétraitement
     preprocessor = ColumnTransformer(
         transformers=[
-            ('num', StandardScaler(), ['year', 'month_num'])])
+            ('num', StandardScaler(), FEATURES)])
 
     pipeline = Pipeline(steps=[('preprocessor', preprocessor),
                                ('regressor', LinearRegression())])
@@ -76,37 +169,108 @@ for dept in departements:
     pipeline.fit(X_train, y_train)
 
     # Évaluation du modèle
-    train_score = pipeline.score(X_train, y_train)
-    test_score = pipeline.score(X_test, y_test)
-    mse = mean_squared_error(y_test, pipeline.predict(X_test))
-
-    logging.info(
-        f"Département {dept} - Train Score: {train_score}, Test Score: {test_score}, Mean Squared Error: {mse}")
-
-    # Préparation des données futures pour les prédictions
-    future_data = pd.DataFrame({
-        'month': future_months,
-        'year': future_dates.year,
-        'month_num': future_dates.month,
-        'departement': dept
-    })
+    metrics = {'departement': dept, 'n': len(df_dept),
+               'train_score': pipeline.score(X_train, y_train),
+               'test_score': pipeline.score(X_test, y_test),
+               'mse': mean_squared_error(y_test, pipeline.predict(X_test))}
 
     # Faire les prédictions
-    future_predictions = pipeline.predict(future_data[['year', 'month_num']])
-    future_data['prix_moyen'] = future_predictions
+    future_data = future_frame([dept])
+    future_data['prix_moyen'] = pipeline.predict(future_data[FEATURES])
+    return metrics, future_data
+
+
+def fit_pipelines(df, workers=FORECAST_WORKERS):
+    groups = [df_dept for _, df_dept in df.groupby('departement', sort=True) if len(df_dept) >= 2]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(fit_departement, groups))
+    metrics = pd.DataFrame([m for m, _ in results])
+    future = pd.concat([f for _, f in results], ignore_index=True) if results else future_frame([])
+    return metrics, future
+
+
+def input_hashes(df):
+    # Empreinte des données mensuelles et de l'horizon de prévision, par département
+    hashes = {}
+    for dept, df_dept in df.groupby('departement', sort=True):
+        digest = hashlib.sha256(f"{FORECAST_MODEL}|{FORECAST_START}|{FORECAST_PERIODS}".encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(df_dept[['month', 'prix_moyen']], index=False).to_numpy().tobytes())
+        hashes[dept] = digest.hexdigest()
+    return hashes
+
+
+def write_forecasts(engine, combined_df, departements=None):
+    # Écrire historique et prévisions dans prix_mensuel en une fois ; avec `departements`,
+    # seules les lignes de ces départements sont remplacées
+    staging = f"{FORECAST_TABLE}_staging"
+    drop_table(engine, staging)
+    BulkWriter(engine).write(combined_df, staging)
+    if departements is None:
+        swap_staging(engine, staging, FORECAST_TABLE)
+    else:
+        params = {f"d{i}": str(d) for i, d in enumerate(departements)}
+        swap_staging(engine, staging, FORECAST_TABLE,
+                     where=f"departement IN ({', '.join(':' + k for k in params)})", params=params)
+
+
+def run_forecasts(engine, incremental=FORECAST_INCREMENTAL):
+    # Charger les données
+    logging.info("Chargement des données...")
+    with stage('load_monthly', quiet=True) as s:
+        df = load_monthly(engine)
+        s.rows_out = len(df)
+    logging.info("Données chargées.")
+
+    # Départements dont les données ont changé depuis le dernier entraînement
+    hashes = input_hashes(df)
+    if incremental:
+        changed = [d for d, h in hashes.items()
+                   if (get_watermark(engine, f"{FORECAST_TABLE}/{d}") or {}).get('file_hash') != h]
+        logging.info(f"{len(changed)} départements sur {len(hashes)} à réentraîner.")
+        if not changed:
+            return None, None
+        df = df[df['departement'].isin(changed)]
+
+    # Générer les prédictions pour tous les départements
+    logging.info(f"Entraînement des modèles ({FORECAST_MODEL})...")
+    with stage(f"fit_forecasts ({FORECAST_MODEL})", quiet=True) as s:
+        s.rows_in = len(df)
+        metrics, future = fit_linear_batched(df) if FORECAST_MODEL == 'linear' else fit_pipelines(df)
+        s.rows_out = len(future)
+    for m in metrics.itertuples():
+        logging.info(
+            f"Département {m.departement} - Train Score: {m.train_score}, Test Score: {m.test_score}, Mean Squared Error: {m.mse}")
+    skipped = sorted(set(df['departement']) - set(metrics['departement']))
+    if skipped:
+        logging.warning(f"Pas assez de données pour les départements {skipped}, ignorés.")
+
+    # Combiner les prédictions avec les données historiques
+    combined_df = pd.concat([df, future], ignore_index=True)
+
+    logging.info(f"Écriture des données combinées dans la table {FORECAST_TABLE}...")
+    with stage('write_forecasts', quiet=True) as s:
+        write_forecasts(engine, combined_df, sorted(set(df['departement'])) if incremental else None)
+        s.rows_out = len(combined_df)
+    for dept in set(df['departement']):
+        df_dept = df[df['departement'] == dept]
+        set_watermark(engine, f"{FORECAST_TABLE}/{dept}", hashes[dept], pd.Timestamp(df_dept['month'].max()),
+                      len(df_dept))
+    logging.info(f"Données combinées écrites avec succès dans la table {FORECAST_TABLE}.")
+    return metrics, combined_df
 
-    # Ajouter les prédictions au dataframe
-    all_predictions.append(future_data)
 
-# Combiner les prédictions avec les données historiques
-combined_df = pd.concat([df] + all_predictions, ignore_index=True)
+if __name__ == '__main__':
+    engine = create_engine(f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}/{db_name}")
+    metrics, combined_df = run_forecasts(engine)
 
-# Sauvegarder les données combinées dans un fichier CSV
-logging.info("Sauvegarde des données combinées dans un fichier CSV...")
-combined_df.to_csv('historical_and_predictions_monthly.csv', index=False)
-logging.info("Données combinées sauvegardées avec succès dans 'historical_and_predictions_monthly.csv'.")
+    if combined_df is not None:
+        # Sauvegarder les données combinées dans un fichier CSV
+        logging.info("Sauvegarde des données combinées dans un fichier CSV...")
+        combined_df.to_csv('historical_and_predictions_monthly.csv', index=False)
+        logging.info("Données combinées sauvegardées avec succès dans 'historical_and_predictions_monthly.csv'.")
 
-# Afficher les scores du modèle pour le dernier département traité
-print(f"Train Score: {train_score}")
-print(f"Test Score: {test_score}")
-print(f"Mean Squared Error: {mse}")
+        # Afficher les scores du modèle pour le dernier département traité
+        last = metrics.iloc[-1]
+        print(f"Train Score: {last['train_score']}")
+        print(f"Test Score: {last['test_score']}")
+        print(f"Mean Squared Error: {last['mse']}")
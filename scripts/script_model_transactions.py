@@ -1,17 +1,26 @@
 import os
-import time
-import numpy as np
+import shutil
 import pandas as pd
+from contextlib import contextmanager
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
-from sklearn.model_selection import train_test_split, GridSearchCV
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import train_test_split, GridSearchCV, HalvingRandomSearchCV
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, FunctionTransformer
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error
 import pickle
+from export_model import export_model
+from model_artifact import prepare_features
+from watermarks import file_hash, set_watermark
+from instrumentation import Stage
+
+try:
+    from sklearn.preprocessing import TargetEncoder
+except ImportError:  # scikit-learn < 1.3
+    TargetEncoder = None
 
 # Charger les variables d'environnement depuis le fichier .env
 load_dotenv()
@@ -21,65 +30,162 @@ db_user = os.getenv('DB_USER')
 db_password = os.getenv('DB_PASSWORD')
 db_name = os.getenv('DB_NAME')
 
-# Charger les données
-engine = create_engine(f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}/{db_name}")
-query = "SELECT * FROM transactions WHERE date_transaction >= '2020-01-01'"
-df = pd.read_sql(query, engine)
-
-print("Données chargées.")
-
-# Préparer les données
-df['date_transaction'] = pd.to_datetime(df['date_transaction']).map(pd.Timestamp.to_julian_date)
-X = df[['date_transaction', 'departement', 'ville', 'type_batiment', 'vefa', 'n_pieces', 'surface_habitable', 'latitude', 'longitude']]
-y = df['prix']
-
-# Prétraitement des données
-numeric_features = ['date_transaction', 'n_pieces', 'surface_habitable', 'latitude', 'longitude', 'departement']
-categorical_features = ['type_batiment', 'vefa', 'ville']
-
-numeric_transformer = Pipeline(steps=[
-    ('scaler', StandardScaler())
-])
-
-categorical_transformer = Pipeline(steps=[
-    ('onehot', OneHotEncoder(handle_unknown='ignore'))
-])
-
-preprocessor = ColumnTransformer(
-    transformers=[
-        ('num', numeric_transformer, numeric_features),
-        ('cat', categorical_transformer, categorical_features)
-    ])
-
-# Créer le pipeline de prétraitement et de modèle
-model = Pipeline(steps=[
-    ('preprocessor', preprocessor),
-    ('regressor', RandomForestRegressor())
-])
-
-# Diviser les données en ensembles d'entraînement et de test
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-print("Données divisées en ensembles d'entraînement et de test.")
-
-# Définir les hyperparamètres pour la recherche en grille
-param_grid = {
+# Transactions utilisées pour l'entraînement
+TRAIN_SINCE = os.getenv('TRAIN_SINCE', '2020-01-01')
+# 'halving' : recherche aléatoire par élimination successive sur un échantillon qui grandit à chaque tour ;
+# 'grid' : recherche exhaustive en grille
+TRAIN_SEARCH = os.getenv('TRAIN_SEARCH', 'halving')
+# Nombre de candidats tirés au premier tour et taille de l'échantillon de départ
+TRAIN_CANDIDATES = int(os.getenv('TRAIN_CANDIDATES', 36))
+TRAIN_MIN_SAMPLES = int(os.getenv('TRAIN_MIN_SAMPLES', 20000))
+# Nombre de cœurs utilisés (-1 : tous)
+TRAIN_N_JOBS = int(os.getenv('TRAIN_N_JOBS', -1))
+# Cache des prétraitements ajustés, partagé par les candidats d'un même pli
+TRAIN_CACHE_DIR = os.getenv('TRAIN_CACHE_DIR', './.train_cache')
+MODEL_PATH = os.getenv('MODEL_PATH', 'model.pkl')
+# Artefact projetable en mémoire chargé par le service de prédiction
+MODEL_ARTIFACT = os.getenv('MODEL_ARTIFACT', os.path.splitext(MODEL_PATH)[0] + '.joblib')
+
+NUMERIC_FEATURES = ['date_transaction', 'n_pieces', 'surface_habitable', 'latitude', 'longitude']
+CATEGORICAL_FEATURES = ['type_batiment', 'vefa']
+# Variables à forte cardinalité : encodées sur une seule colonne au lieu d'un one-hot
+ORDINAL_FEATURES = ['departement']
+TARGET_FEATURES = ['ville']
+FEATURES = ['date_transaction', 'departement', 'ville', 'type_batiment', 'vefa', 'n_pieces', 'surface_habitable',
+            'latitude', 'longitude']
+
+# Hyperparamètres explorés
+PARAM_GRID = {
     'regressor__n_estimators': [100, 200, 300],
     'regressor__max_features': [1.0, 'sqrt', 'log2'],
     'regressor__max_depth': [10, 20, 30, None]
 }
 
-grid_search = GridSearchCV(estimator=model, param_grid=param_grid, cv=5, scoring='neg_mean_squared_error')
-print("Début de la recherche en grille des hyperparamètres...")
-grid_search.fit(X_train, y_train)
-
-# Évaluer le modèle
-best_model = grid_search.best_estimator_
-y_pred = best_model.predict(X_test)
-mse = mean_squared_error(y_test, y_pred)
-print(f"Mean Squared Error: {mse}")
-
-# Enregistrer le modèle
-with open('model.pkl', 'wb') as file:
-    pickle.dump(best_model, file)
-
-print("Modèle enregistré sous 'model.pkl'.")
+timings = {}
+
+
+@contextmanager
+def stage(name):
+    # Mesurer une étape de l'entraînement (durée, CPU, lignes, mémoire), enregistrée dans METRICS_FILE
+    with Stage(name, tag='TRAIN') as s:
+        yield s
+    timings[name] = s.record['wall_s']
+
+
+def load_transactions(engine, since=TRAIN_SINCE):
+    # Seules les colonnes utiles au modèle sont lues
+    query = f"SELECT {', '.join(FEATURES)}, prix FROM transactions WHERE date_transaction >= '{since}'"
+    return pd.read_sql(query, engine)
+
+
+def prepare(df):
+    # Variables brutes et cible : dates et catégories sont converties par la première étape du pipeline
+    return df[FEATURES], df['prix']
+
+
+def build_model(memory=None):
+    # Les arbres n'ont pas besoin de variables centrées réduites : les variables numériques passent telles quelles
+    if TargetEncoder is not None:
+        target_encoder = TargetEncoder(target_type='continuous')
+    else:
+        target_encoder = OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=-1)
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('num', 'passthrough', NUMERIC_FEATURES),
+            ('cat', OneHotEncoder(handle_unknown='ignore', sparse_output=False), CATEGORICAL_FEATURES),
+            ('ord', OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=-1), ORDINAL_FEATURES),
+            ('target', target_encoder, TARGET_FEATURES)
+        ])
+
+    # Conversion des lignes brutes (date en jour julien, catégories en texte) dans le pipeline lui-même :
+    # le modèle enregistré et l'artefact prédisent sur les colonnes reçues par /api/predict
+    features = FunctionTransformer(prepare_features, feature_names_out='one-to-one', kw_args={
+        'date_columns': ['date_transaction'],
+        'string_columns': ORDINAL_FEATURES + TARGET_FEATURES + CATEGORICAL_FEATURES})
+
+    # Le prétraitement ajusté est mis en cache : les candidats évalués sur le même pli le réutilisent
+    return Pipeline(steps=[
+        ('features', features),
+        ('preprocessor', preprocessor),
+        ('regressor', RandomForestRegressor(random_state=42))
+    ], memory=memory)
+
+
+def search(model, X_train, y_train, strategy=TRAIN_SEARCH, n_jobs=TRAIN_N_JOBS):
+    # Les candidats sont répartis sur les cœurs, chaque forêt reste sur un seul cœur pour éviter la sursouscription
+    if strategy == 'grid':
+        searcher = GridSearchCV(estimator=model, param_grid=PARAM_GRID, cv=5, scoring='neg_mean_squared_error',
+                                n_jobs=n_jobs, refit=False)
+    else:
+        searcher = HalvingRandomSearchCV(estimator=model, param_distributions=PARAM_GRID,
+                                         n_candidates=TRAIN_CANDIDATES, resource='n_samples', factor=3,
+                                         min_resources=min(TRAIN_MIN_SAMPLES, len(X_train) // 2), cv=5,
+                                         scoring='neg_mean_squared_error', n_jobs=n_jobs, refit=False,
+                                         random_state=42)
+    searcher.fit(X_train, y_train)
+    if strategy != 'grid':
+        for i, (n_candidates, n_resources) in enumerate(zip(searcher.n_candidates_, searcher.n_resources_)):
+            print(f"Tour {i} : {n_candidates} candidats sur {n_resources} transactions")
+    return searcher
+
+
+def train(engine, model_path=MODEL_PATH, cache_dir=TRAIN_CACHE_DIR, artifact_path=MODEL_ARTIFACT, df=None):
+    # `df` : transactions déjà chargées (colonnes FEATURES et prix), sinon lues en base
+    with stage('Chargement des données') as s:
+        if df is None:
+            df = load_transactions(engine)
+        s.rows_out = len(df)
+    print(f"{len(df)} transactions chargées.")
+
+    with stage('Préparation des données') as s:
+        s.rows_in = len(df)
+        X, y = prepare(df)
+        # Diviser les données en ensembles d'entraînement et de test
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+        s.rows_out = len(X_train)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        with stage(f"Recherche des hyperparamètres ({TRAIN_SEARCH})") as s:
+            s.rows_in = len(X_train)
+            searcher = search(build_model(memory=cache_dir), X_train, y_train)
+        print(f"Meilleurs hyperparamètres : {searcher.best_params_}")
+    finally:
+        # Le cache ne sert que pendant la recherche
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    with stage('Entraînement du modèle final') as s:
+        s.rows_in = len(X_train)
+        best_model = build_model()
+        best_model.set_params(**searcher.best_params_, regressor__n_jobs=TRAIN_N_JOBS)
+        best_model.fit(X_train, y_train)
+
+    # Évaluer le modèle
+    with stage('Évaluation') as s:
+        s.rows_in = len(X_test)
+        y_pred = best_model.predict(X_test)
+        mse = mean_squared_error(y_test, y_pred)
+    print(f"Mean Squared Error: {mse}")
+
+    # Enregistrer le modèle
+    with stage('Enregistrement'):
+        tmp_path = f"{model_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(best_model, file)
+        os.replace(tmp_path, model_path)
+    print(f"Modèle enregistré sous '{model_path}'.")
+    if artifact_path:
+        with stage('Export de l\'artefact'):
+            export_model(best_model, artifact_path, X=X_test, y=y_test)
+    # Filigrane du modèle : les workers du dashboard le rechargent quand le jeton de fraîcheur change
+    set_watermark(engine, 'model', file_hash(model_path), None, len(X))
+
+    for name, seconds in timings.items():
+        print(f"{name:<45} {seconds:>10.1f} s")
+    return best_model, mse
+
+
+if __name__ == '__main__':
+    # Charger les données
+    engine = create_engine(f"mysql+mysqlconnector://{db_user}:{db_password}@{db_host}/{db_name}")
+    train(engine)
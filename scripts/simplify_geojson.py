@@ -0,0 +1,83 @@
+import os
+import json
+import numpy as np
+from dotenv import load_dotenv
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Tolérances de simplification en degrés (~100 m, ~500 m, ~1 km)
+TOLERANCES = [0.001, 0.005, 0.01]
+# Nombre de décimales conservées pour les coordonnées (~10 m)
+PRECISION = 4
+
+
+def simplify_ring(ring, tolerance):
+    # Algorithme de Douglas-Peucker, itératif, sur un anneau fermé
+    points = np.asarray(ring, dtype=np.float64)
+    if len(points) <= 4:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    # Un anneau fermé a ses extrémités confondues : on le coupe au point le plus éloigné du départ
+    far = int(np.argmax(np.hypot(*(points - points[0]).T)))
+    keep[far] = True
+    stack = [(0, far), (far, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        inner = points[start + 1:end] - points[start]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(*inner.T)
+        else:
+            distances = np.abs(segment[0] * inner[:, 1] - segment[1] * inner[:, 0]) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            keep[start + 1 + i] = True
+            stack.append((start, start + 1 + i))
+            stack.append((start + 1 + i, end))
+    simplified = points[keep]
+    if len(simplified) < 4:
+        # Garder au moins un triangle fermé
+        simplified = points[np.linspace(0, len(points) - 1, 4).astype(int)]
+    return simplified
+
+
+def simplify_geometry(geometry, tolerance):
+    def polygon(rings):
+        return [np.round(simplify_ring(ring, tolerance), PRECISION).tolist() for ring in rings]
+    if geometry['type'] == 'Polygon':
+        return {'type': 'Polygon', 'coordinates': polygon(geometry['coordinates'])}
+    if geometry['type'] == 'MultiPolygon':
+        return {'type': 'MultiPolygon', 'coordinates': [polygon(p) for p in geometry['coordinates']]}
+    return geometry
+
+
+def simplify_geojson(source, directory, tolerances=TOLERANCES):
+    # Écrire une version simplifiée du GeoJSON par tolérance, sans propriétés inutiles à la carte
+    with open(source) as f:
+        geojson = json.load(f)
+    os.makedirs(directory, exist_ok=True)
+    name = os.path.splitext(os.path.basename(source))[0]
+    sizes = {}
+    for tolerance in tolerances:
+        simplified = {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {'code': feature['properties']['code']},
+             'geometry': simplify_geometry(feature['geometry'], tolerance)}
+            for feature in geojson['features']]}
+        path = os.path.join(directory, f"{name}-{tolerance}.json")
+        with open(path, 'w') as f:
+            json.dump(simplified, f, separators=(',', ':'))
+        sizes[tolerance] = os.path.getsize(path)
+        print(f"{path}: {sizes[tolerance] / 1e6:.2f} MB")
+    return sizes
+
+
+if __name__ == '__main__':
+    directory = os.getenv('SOURCES_DIRECTORY', './data')
+    print(f"{os.path.join(directory, 'departements.geojson')}: "
+          f"{os.path.getsize(os.path.join(directory, 'departements.geojson')) / 1e6:.2f} MB")
+    simplify_geojson(os.path.join(directory, 'departements.geojson'), os.path.join(directory, 'geo'))
@@ -0,0 +1,293 @@
+import os
+import json
+import time
+import shutil
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from dotenv import load_dotenv
+from instrumentation import log_in_out
+
+# Charger les variables d'environnement
+load_dotenv()
+
+# Index spatial des transactions, une partition par année, enregistré à côté des données
+SPATIAL_INDEX_DIR = os.getenv('SPATIAL_INDEX_DIR', './data/spatial')
+# Taille des cellules de la grille en degrés (~1 km)
+SPATIAL_CELL_SIZE = float(os.getenv('SPATIAL_CELL_SIZE', 0.01))
+# Rayon maximal exploré par la recherche des k plus proches voisins, en mètres
+SPATIAL_MAX_RADIUS = float(os.getenv('SPATIAL_MAX_RADIUS', 50000))
+SPATIAL_CHUNKSIZE = 500000
+# Rayon de départ de la recherche des plus proches voisins, en mètres
+SPATIAL_START_RADIUS = 250.0
+
+MANIFEST = 'manifest.json'
+EARTH_RADIUS = 6371008.8
+METERS_PER_DEGREE = np.pi * EARTH_RADIUS / 180
+INDEX_COLUMNS = ['date_transaction', 'latitude', 'longitude', 'type_batiment', 'prix', 'surface_habitable']
+# Tableaux d'une partition, triés par cellule
+ARRAYS = {'lat': np.float32, 'lon': np.float32, 'day': np.int32, 'type': np.uint8, 'prix': np.float32,
+          'surface': np.float32}
+
+
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time()))
+
+
+def _grid(cell_size):
+    return int(np.ceil(360 / cell_size))
+
+
+def _cell_rows(lat, cell_size):
+    return np.floor((np.asarray(lat, dtype=np.float64) + 90) / cell_size).astype(np.int64)
+
+
+def _cell_cols(lon, cell_size):
+    return np.floor((np.asarray(lon, dtype=np.float64) + 180) / cell_size).astype(np.int64)
+
+
+def haversine(lat, lon, lat0, lon0):
+    # Distance en mètres entre des points et un point de référence
+    lat, lon = np.radians(np.asarray(lat, dtype=np.float64)), np.radians(np.asarray(lon, dtype=np.float64))
+    lat0, lon0 = np.radians(lat0), np.radians(lon0)
+    a = np.sin((lat - lat0) / 2) ** 2 + np.cos(lat) * np.cos(lat0) * np.sin((lon - lon0) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+class SpatialAccumulator:
+    # Transactions géolocalisées regroupées par année, alimentées bloc par bloc pendant l'import
+    def __init__(self):
+        self.parts = {}
+        self.types = {}
+
+    def update(self, df_trans):
+        date = pd.to_datetime(df_trans['date_transaction'])
+        located = (df_trans['latitude'].notna() & df_trans['longitude'].notna()).to_numpy()
+        if not located.any():
+            return self
+        date = date[located]
+        types = df_trans['type_batiment'][located].astype(str)
+        for name in types.unique():
+            self.types.setdefault(name, len(self.types))
+        frame = pd.DataFrame({
+            'lat': df_trans['latitude'][located].to_numpy(dtype=np.float32),
+            'lon': df_trans['longitude'][located].to_numpy(dtype=np.float32),
+            'day': (date.to_numpy('datetime64[D]').astype(np.int64)).astype(np.int32),
+            'type': types.map(self.types).to_numpy(dtype=np.uint8),
+            'prix': df_trans['prix'][located].to_numpy(dtype=np.float32),
+            'surface': df_trans['surface_habitable'][located].to_numpy(dtype=np.float32),
+        })
+        for year, part in frame.groupby(date.dt.year.to_numpy(), sort=False):
+            self.parts.setdefault(int(year), []).append(part)
+        return self
+
+    def partitions(self):
+        names = np.array(sorted(self.types, key=self.types.get))
+        for year, parts in sorted(self.parts.items()):
+            yield year, pd.concat(parts, ignore_index=True), names
+
+
+def write_partition(directory, name, arrays):
+    # Écrire une partition (un fichier .npy par tableau) dans un nouveau dossier, à côté de l'ancienne : le
+    # manifeste désigne ensuite le dossier de chaque partition, l'ancien n'est supprimé qu'une fois remplacé.
+    # Renvoie le nom du dossier.
+    folder = f"{name}-{time.time_ns()}"
+    tmp = os.path.join(directory, f"{folder}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for key, array in arrays.items():
+        np.save(os.path.join(tmp, f"{key}.npy"), array)
+    os.replace(tmp, os.path.join(directory, folder))
+    return folder
+
+
+def _partition_folder(name, info):
+    # Dossier d'une partition ; les manifestes antérieurs aux dossiers versionnés n'ont pas de clé `folder`
+    return info.get('folder', str(name))
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(directory, partitions):
+    # Le manifeste est remplacé atomiquement, puis les dossiers de partition qu'il ne désigne plus sont supprimés :
+    # à tout instant, le manifeste en place ne désigne que des dossiers complets
+    manifest = {'partitions': partitions}
+    tmp = os.path.join(directory, f"{MANIFEST}.{os.getpid()}.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(directory, MANIFEST))
+    folders = {_partition_folder(name, info) for name, info in partitions.items()}
+    for name in os.listdir(directory):
+        if name.split('-')[0].split('.')[0].isdigit() and '.tmp-' not in name and name not in folders:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return manifest
+
+
+class MappedPartitions:
+    # Partitions annuelles projetées en mémoire, rechargées dès que le manifeste change
+    def __init__(self, directory):
+        self.directory = directory
+        self._mtime = None
+        self._partitions = {}
+
+    def partitions(self, attempts=3):
+        path = os.path.join(self.directory, MANIFEST)
+        for attempt in range(attempts):
+            mtime = os.path.getmtime(path) if os.path.exists(path) else None
+            if mtime == self._mtime:
+                break
+            manifest = read_manifest(self.directory) or {'partitions': {}}
+            try:
+                self._partitions, self._mtime = self._load(manifest), mtime
+            except FileNotFoundError:
+                # Dossier supprimé entre la lecture du manifeste et celle des tableaux : un nouveau manifeste
+                # est en place, on le relit
+                if attempt == attempts - 1:
+                    raise
+        return self._partitions
+
+    def _load(self, manifest):
+        partitions = {}
+        for year, info in manifest['partitions'].items():
+            folder = os.path.join(self.directory, _partition_folder(year, info))
+            arrays = {os.path.splitext(name)[0]: np.load(os.path.join(folder, name), mmap_mode='r')
+                      for name in os.listdir(folder) if name.endswith('.npy')}
+            partitions[int(year)] = {**info, **arrays}
+        return partitions
+
+
+def _partition_arrays(frame, types, cell_size):
+    # Lignes triées par cellule ; `cells` liste les cellules occupées, `starts` leur première ligne
+    cells = _cell_rows(frame['lat'], cell_size) * _grid(cell_size) + _cell_cols(frame['lon'], cell_size)
+    order = np.argsort(cells, kind='stable')
+    unique, starts = np.unique(cells[order], return_index=True)
+    arrays = {'cells': unique, 'starts': np.append(starts, len(cells)).astype(np.int64), 'types': types}
+    for name, dtype in ARRAYS.items():
+        arrays[name] = frame[name].to_numpy(dtype=dtype)[order]
+    return arrays
+
+
+@log_in_out
+def replace_spatial_index(accumulator, since=None, directory=SPATIAL_INDEX_DIR, cell_size=SPATIAL_CELL_SIZE):
+    # Remplacer les partitions des années à partir de `since` (toutes si `since` vaut None)
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    if manifest is None or since is None:
+        partitions = {}
+    else:
+        partitions = {year: info for year, info in manifest['partitions'].items() if int(year) < since.year}
+    for year, frame, types in accumulator.partitions():
+        if since is not None and year < since.year:
+            continue
+        folder = write_partition(directory, year, _partition_arrays(frame, types, cell_size))
+        partitions[str(year)] = {'rows': len(frame), 'cell_size': cell_size, 'built_at': _now(), 'folder': folder}
+    manifest = write_manifest(directory, partitions)
+    print(f"{_now()} - [INIT]: spatial index updated ({sum(p['rows'] for p in partitions.values())} rows, "
+          f"{len(partitions)} years)")
+    return manifest
+
+
+@log_in_out
+def refresh_spatial_index(engine, since=None, table='transactions', directory=SPATIAL_INDEX_DIR):
+    # Reconstruire l'index depuis la table des transactions, par blocs
+    query = f"SELECT {', '.join(INDEX_COLUMNS)} FROM {table}"
+    params = {}
+    if since is not None:
+        query += " WHERE date_transaction >= :since"
+        params['since'] = since.strftime('%Y-%m-%d')
+    accumulator = SpatialAccumulator()
+    for chunk in pd.read_sql(sqlalchemy.text(query), engine, params=params, chunksize=SPATIAL_CHUNKSIZE):
+        accumulator.update(chunk)
+    return replace_spatial_index(accumulator, since, directory)
+
+
+class SpatialIndex(MappedPartitions):
+    # Requêtes par rayon, rectangle et plus proches voisins sur les partitions projetées en mémoire
+    def __init__(self, directory=SPATIAL_INDEX_DIR):
+        super().__init__(directory)
+
+    def _candidates(self, south, west, north, east, type_batiment=None, since=None, until=None):
+        # Lignes des cellules qui recouvrent le rectangle, filtrées par rectangle, type et date
+        partitions = self.partitions()
+        since = pd.Timestamp(since) if since is not None else None
+        until = pd.Timestamp(until) if until is not None else None
+        frames = []
+        for year, part in sorted(partitions.items()):
+            if (since is not None and year < since.year) or (until is not None and year > until.year):
+                continue
+            cell_size = part['cell_size']
+            grid = _grid(cell_size)
+            row_min, row_max = _cell_rows(south, cell_size), _cell_rows(north, cell_size)
+            col_min, col_max = _cell_cols(west, cell_size), _cell_cols(east, cell_size)
+            bounds = [(row * grid + col_min, row * grid + col_max) for row in range(row_min, row_max + 1)]
+            lo = np.searchsorted(part['cells'], [b[0] for b in bounds], side='left')
+            hi = np.searchsorted(part['cells'], [b[1] for b in bounds], side='right')
+            ranges = [(part['starts'][a], part['starts'][b]) for a, b in zip(lo, hi) if b > a]
+            if not ranges:
+                continue
+            rows = np.concatenate([np.arange(a, b) for a, b in ranges])
+            lat, lon, day = part['lat'][rows], part['lon'][rows], part['day'][rows]
+            keep = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+            if type_batiment is not None:
+                codes = np.flatnonzero(np.isin(part['types'], np.atleast_1d(type_batiment)))
+                keep &= np.isin(part['type'][rows], codes)
+            if since is not None:
+                keep &= day >= np.datetime64(since.date(), 'D').astype(np.int64)
+            if until is not None:
+                keep &= day <= np.datetime64(until.date(), 'D').astype(np.int64)
+            rows = rows[keep]
+            prix, surface = part['prix'][rows].astype(np.float64), part['surface'][rows].astype(np.float64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                prix_m2 = np.where(surface > 0, prix / surface, np.nan)
+            frames.append(pd.DataFrame({
+                'date_transaction': part['day'][rows].astype('datetime64[D]'),
+                'latitude': part['lat'][rows], 'longitude': part['lon'][rows],
+                'type_batiment': part['types'][part['type'][rows]],
+                'prix': prix, 'surface_habitable': surface, 'prix_m2': prix_m2,
+            }))
+        if not frames:
+            return pd.DataFrame({'date_transaction': np.array([], dtype='datetime64[D]'),
+                                 'latitude': np.array([], dtype=np.float32), 'longitude': np.array([], dtype=np.float32),
+                                 'type_batiment': np.array([], dtype=str), 'prix': np.array([], dtype=np.float64),
+                                 'surface_habitable': np.array([], dtype=np.float64),
+                                 'prix_m2': np.array([], dtype=np.float64)})
+        return pd.concat(frames, ignore_index=True)
+
+    def bbox(self, south, west, north, east, type_batiment=None, since=None, until=None):
+        return self._candidates(south, west, north, east, type_batiment, since, until)
+
+    def radius(self, lat, lon, meters, type_batiment=None, since=None, until=None):
+        # Transactions à moins de `meters` mètres du point, triées par distance
+        dlat = meters / METERS_PER_DEGREE
+        dlon = meters / (METERS_PER_DEGREE * max(np.cos(np.radians(min(abs(lat) + dlat, 89.9))), 1e-6))
+        matches = self._candidates(lat - dlat, lon - dlon, lat + dlat, lon + dlon, type_batiment, since, until)
+        matches['distance'] = haversine(matches['latitude'].to_numpy(), matches['longitude'].to_numpy(), lat, lon)
+        return matches[matches['distance'] <= meters].sort_values('distance', kind='stable').reset_index(drop=True)
+
+    def nearest(self, lat, lon, k, type_batiment=None, since=None, until=None, max_radius=SPATIAL_MAX_RADIUS):
+        # Les k transactions les plus proches : le rayon double jusqu'à en contenir au moins k
+        meters = min(SPATIAL_START_RADIUS, max_radius)
+        while True:
+            matches = self.radius(lat, lon, meters, type_batiment, since, until)
+            if len(matches) >= k or meters >= max_radius:
+                return matches.head(k)
+            meters = min(meters * 2, max_radius)
+
+
+def summary(matches):
+    # Nombre de ventes et prix médian au m² d'un résultat de requête
+    prix_m2 = matches['prix_m2'].to_numpy(dtype=np.float64)
+    prix_m2 = prix_m2[np.isfinite(prix_m2)]
+    return {'count': len(matches), 'median_prix_m2': float(np.median(prix_m2)) if len(prix_m2) else None}
+
+
+if __name__ == '__main__':
+    # Reconstruire tout l'index à partir de la table des transactions
+    db_url = f"mysql+mysqlconnector://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}/{os.getenv('DB_NAME')}"
+    refresh_spatial_index(sqlalchemy.create_engine(db_url))
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+from import_transactions import clean_transactions, clean_transactions_absurd, OutlierStats, OutlierSketches
+from quantile_sketches import SKETCH_RELATIVE_ACCURACY
+
+
+def clean_transactions_absurd_reference(df_trans):
+    # Implémentation d'origine (groupby-apply puis fusion), conservée comme référence
+    grouped_stats = df_trans.groupby([pd.to_datetime(df_trans['date_transaction']).dt.year, 'departement'])[
+        ['prix', 'surface_habitable']].apply(
+        lambda x: (x['prix'] / x['surface_habitable']).agg(['median', 'std'])).reset_index(drop=False)
+    df_trans['year'] = pd.to_datetime(df_trans['date_transaction']).dt.year
+    to_clean_df = pd.merge(df_trans, grouped_stats, left_on=['year', 'departement'],
+                           right_on=['date_transaction', 'departement'], suffixes=('', '_stats'))
+    filtered_df = to_clean_df[
+        (to_clean_df['prix'] / to_clean_df['surface_habitable']) < to_clean_df['median'] + 3 * to_clean_df['std']]
+    filtered_df = filtered_df.drop(columns=['median', 'std', 'year', 'date_transaction_stats'])
+    return filtered_df
+
+
+def synthetic_transactions(n=50000, seed=42):
+    # Transactions aléatoires avec quelques prix absurdes et des groupes d'une seule ligne
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'date_transaction': (np.datetime64('2014-01-01') + rng.integers(0, 3650, n)).astype(str),
+        'departement': rng.choice([f"{i:02d}" for i in range(1, 96)] + ['2A', '2B'], n),
+        'ville': rng.choice(['Paris', 'Lyon', 'Marseille', 'Nantes'], n),
+        'type_batiment': rng.choice(['Maison', 'Appartement'], n),
+        'prix': rng.lognormal(12, 0.5, n).round(),
+        'surface_habitable': rng.integers(9, 250, n),
+    })
+    outliers = rng.choice(n, n // 100, replace=False)
+    df.loc[outliers, 'prix'] *= 50
+    lonely = pd.DataFrame({'date_transaction': ['2030-06-01'], 'departement': ['971'], 'ville': ['Pointe-à-Pitre'],
+                           'type_batiment': ['Maison'], 'prix': [150000.0], 'surface_habitable': [80]})
+    return pd.concat([df, lonely], ignore_index=True)
+
+
+def test_clean_transactions_absurd():
+    df = synthetic_transactions()
+    expected = clean_transactions_absurd_reference(df.copy())
+    pd.testing.assert_frame_equal(clean_transactions_absurd(df), expected)
+
+
+def test_clean_transactions_price_bounds():
+    # Bornes fixées ici : le résultat ne dépend pas de MIN_PRICE/MAX_PRICE dans l'environnement
+    df = synthetic_transactions()
+    bounded = df[df['prix'].between(25000, 69000000)]
+    # La référence fusionne puis renumérote les lignes : seules les valeurs sont comparées
+    expected = clean_transactions_absurd_reference(bounded.copy()).reset_index(drop=True)
+    result = clean_transactions(df, min_price=25000, max_price=69000000).reset_index(drop=True)
+    assert len(result) < len(clean_transactions(df))
+    pd.testing.assert_frame_equal(result, expected)
+    pd.testing.assert_frame_equal(clean_transactions(df), clean_transactions_absurd_reference(df.copy()))
+
+
+def test_outlier_stats_chunked():
+    df = synthetic_transactions()
+    expected = clean_transactions_absurd_reference(df.copy())
+    # Accumulateurs calculés séparément sur deux moitiés puis fusionnés
+    chunks = [df.iloc[i:i + 7000] for i in range(0, len(df), 7000)]
+    half = len(chunks) // 2
+    stats = OutlierStats()
+    other = OutlierStats()
+    for chunk in chunks[:half]:
+        stats.update(chunk)
+    for chunk in chunks[half:]:
+        other.update(chunk)
+    stats.merge(other)
+    thresholds = stats.thresholds()
+    result = pd.concat([stats.filter(chunk, thresholds) for chunk in chunks])
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_outlier_sketches_chunked():
+    df = synthetic_transactions()
+    chunks = [df.iloc[i:i + 7000] for i in range(0, len(df), 7000)]
+    exact, sketches, other = OutlierStats(), OutlierSketches(), OutlierSketches()
+    for i, chunk in enumerate(chunks):
+        exact.update(chunk)
+        (sketches if i % 2 else other).update(chunk)
+    sketches.merge(other)
+    expected = exact.thresholds()
+    thresholds = sketches.thresholds().reindex(expected.index)
+    # Seuls les groupes d'une valeur n'ont pas de seuil ; ailleurs la médiane est à α près, l'écart type exact
+    assert thresholds.isna().equals(expected.isna())
+    assert ((thresholds - expected).abs() / expected).max() <= SKETCH_RELATIVE_ACCURACY
+    result = pd.concat([sketches.filter(chunk, sketches.thresholds()) for chunk in chunks])
+    reference = pd.concat([exact.filter(chunk, expected) for chunk in chunks])
+    assert abs(len(result) - len(reference)) <= len(df) // 1000
+
+
+if __name__ == '__main__':
+    test_clean_transactions_absurd()
+    test_clean_transactions_price_bounds()
+    test_outlier_stats_chunked()
+    test_outlier_sketches_chunked()
+    print("Nettoyage vectorisé identique à l'implémentation d'origine")
@@ -0,0 +1,95 @@
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+import pandas as pd
+from script_model_transactions import FEATURES, prepare, build_model
+from export_model import export_model
+from model_artifact import load_artifact
+from prediction import Predictor
+
+# Ligne telle que l'envoient les clients de /api/predict : date en texte, département en texte, VEFA booléenne
+RAW_ROW = {'date_transaction': '2021-06-01', 'departement': '2A', 'ville': 'Ajaccio', 'type_batiment': 'Maison',
+           'vefa': True, 'n_pieces': 4, 'surface_habitable': 95, 'latitude': 41.92, 'longitude': 8.74}
+
+
+def synthetic_training_set(n=3000, seed=0):
+    # Transactions aléatoires avec les colonnes et les types lus dans la table transactions
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'date_transaction': (np.datetime64('2020-01-01') + rng.integers(0, 1500, n)).astype(str),
+        'departement': rng.choice(['01', '13', '2A', '75'], n),
+        'ville': rng.choice(['Ajaccio', 'Lyon', 'Marseille', 'Paris'], n),
+        'type_batiment': rng.choice(['Maison', 'Appartement'], n),
+        'vefa': rng.integers(0, 2, n),
+        'n_pieces': rng.integers(1, 7, n),
+        'surface_habitable': rng.integers(15, 250, n),
+        'latitude': rng.uniform(41, 51, n),
+        'longitude': rng.uniform(-4, 8, n),
+    })
+    df['prix'] = df['surface_habitable'] * 3000 + rng.normal(0, 20000, n)
+    return df
+
+
+def trained_model():
+    X, y = prepare(synthetic_training_set())
+    model = build_model()
+    model.set_params(regressor__n_estimators=5, regressor__max_depth=8)
+    return model.fit(X, y)
+
+
+def test_artifact_predicts_raw_rows(tmp_path):
+    model = trained_model()
+    path = export_model(model, str(tmp_path / 'model.joblib'))
+    artifact = load_artifact(path)
+    assert list(artifact.feature_names_in_) == FEATURES
+    row = pd.DataFrame([RAW_ROW])
+    expected = model.predict(row)
+    assert np.isfinite(expected).all()
+    np.testing.assert_allclose(artifact.predict(row), expected)
+
+
+def test_predictor_serves_fresh_model(tmp_path):
+    # Chemin de /api/predict : lignes JSON brutes, modèle picklé ou artefact d'un entraînement récent
+    model = trained_model()
+    pickle_path = tmp_path / 'model.pkl'
+    with open(pickle_path, 'wb') as f:
+        pickle.dump(model, f)
+    artifact_path = export_model(model, str(tmp_path / 'model.joblib'))
+    expected = model.predict(pd.DataFrame([RAW_ROW, {**RAW_ROW, 'vefa': False, 'departement': '75'}]))
+    for path in (str(pickle_path), artifact_path):
+        for max_wait_ms in (0, 2):
+            predictor = Predictor(path, columns_path=None, max_wait_ms=max_wait_ms)
+            assert predictor.columns == FEATURES
+            np.testing.assert_allclose(predictor.predict(RAW_ROW), expected[:1])
+            np.testing.assert_allclose(predictor.predict([RAW_ROW, {**RAW_ROW, 'vefa': False, 'departement': '75'}]),
+                                       expected)
+
+
+def test_predictor_isolates_bad_requests(tmp_path):
+    # Une requête invalide échoue seule, les requêtes groupées avec elle dans le même lot sont servies
+    model = trained_model()
+    path = export_model(model, str(tmp_path / 'model.joblib'))
+    predictor = Predictor(path, columns_path=None, max_wait_ms=50)
+    with pytest.raises(ValueError):
+        predictor.predict({**RAW_ROW, 'surface_habitable': 'grande'})
+    rows = [RAW_ROW, {**RAW_ROW, 'vefa': 0, 'departement': '75'}, {**RAW_ROW, 'n_pieces': [1, 2]}, RAW_ROW]
+    # Attendu ligne par ligne : un DataFrame mêlant vefa booléenne et entière ne garderait pas leurs types
+    expected = [model.predict(pd.DataFrame([row])) for row in rows[:2]]
+    with ThreadPoolExecutor(len(rows)) as pool:
+        futures = [pool.submit(predictor.predict, row) for row in rows]
+    np.testing.assert_allclose(futures[0].result(), expected[0])
+    np.testing.assert_allclose(futures[1].result(), expected[1])
+    np.testing.assert_allclose(futures[3].result(), expected[0])
+    with pytest.raises(TypeError):
+        futures[2].result()
+
+
+if __name__ == '__main__':
+    import tempfile
+    import pathlib
+    with tempfile.TemporaryDirectory() as directory:
+        test_artifact_predicts_raw_rows(pathlib.Path(directory))
+        test_predictor_serves_fresh_model(pathlib.Path(directory))
+        test_predictor_isolates_bad_requests(pathlib.Path(directory))
+    print("Artefact utilisable sur des lignes brutes")
@@ -0,0 +1,83 @@
+import hashlib
+import datetime
+import sqlalchemy
+
+# Table des filigranes d'import : un enregistrement par source (fichier npz ou CSV)
+WATERMARK_TABLE = 'import_watermarks'
+
+metadata = sqlalchemy.MetaData()
+watermarks = sqlalchemy.Table(
+    WATERMARK_TABLE, metadata,
+    sqlalchemy.Column('source', sqlalchemy.String(255), primary_key=True),
+    sqlalchemy.Column('file_hash', sqlalchemy.String(64), nullable=False),
+    sqlalchemy.Column('max_date', sqlalchemy.DateTime, nullable=True),
+    sqlalchemy.Column('row_count', sqlalchemy.BigInteger, nullable=False),
+    sqlalchemy.Column('imported_at', sqlalchemy.DateTime, nullable=False),
+)
+
+
+def file_hash(path, block_size=1 << 20):
+    # Empreinte SHA-256 du fichier source, lue par blocs
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def create_watermark_table(engine):
+    metadata.create_all(engine, tables=[watermarks], checkfirst=True)
+
+
+def get_watermark(engine, source):
+    create_watermark_table(engine)
+    with engine.connect() as conn:
+        row = conn.execute(sqlalchemy.select(watermarks).where(watermarks.c.source == source)).mappings().first()
+    return dict(row) if row is not None else None
+
+
+def set_watermark(engine, source, digest, max_date, row_count):
+    create_watermark_table(engine)
+    if max_date is not None:
+        max_date = max_date.to_pydatetime() if hasattr(max_date, 'to_pydatetime') else max_date
+    with engine.begin() as conn:
+        conn.execute(watermarks.delete().where(watermarks.c.source == source))
+        conn.execute(watermarks.insert().values(source=source, file_hash=digest, max_date=max_date,
+                                                row_count=int(row_count), imported_at=datetime.datetime.now()))
+
+
+def drop_table(engine, table):
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {quote(table)}")
+
+
+def swap_staging(engine, staging, table, where=None, params=None, columns=None):
+    # Remplacer le contenu de `table` par celui de `staging`.
+    # Sans condition, la table entière est échangée ; sinon seules les lignes vérifiant `where`
+    # sont supprimées puis remplacées, dans une même transaction, en recopiant `columns`
+    # (par défaut toutes les colonnes de la staging).
+    quote = engine.dialect.identifier_preparer.quote
+    if where is None or not sqlalchemy.inspect(engine).has_table(table):
+        if not sqlalchemy.inspect(engine).has_table(table):
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE {quote(staging)} RENAME TO {quote(table)}")
+        elif engine.dialect.name == 'mysql':
+            # RENAME TABLE est atomique : les lecteurs voient l'ancienne ou la nouvelle table
+            old = f"{table}_old"
+            drop_table(engine, old)
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"RENAME TABLE {quote(table)} TO {quote(old)}, {quote(staging)} TO {quote(table)}")
+            drop_table(engine, old)
+        else:
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"DROP TABLE {quote(table)}")
+                conn.exec_driver_sql(f"ALTER TABLE {quote(staging)} RENAME TO {quote(table)}")
+        return
+    if columns is None:
+        columns = [c['name'] for c in sqlalchemy.inspect(engine).get_columns(staging)]
+    columns = ', '.join(quote(c) for c in columns)
+    with engine.begin() as conn:
+        conn.execute(sqlalchemy.text(f"DELETE FROM {quote(table)} WHERE {where}"), params or {})
+        conn.exec_driver_sql(f"INSERT INTO {quote(table)} ({columns}) SELECT {columns} FROM {quote(staging)}")
+    drop_table(engine, staging)